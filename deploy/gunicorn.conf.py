@@ -0,0 +1,19 @@
+# <APP_ROOT_DIR>/deploy/gunicorn.conf.py
+
+import multiprocessing
+
+bind = 'unix:/run/dnfas/gunicorn.sock'
+
+workers = multiprocessing.cpu_count() + 1
+
+# Hunt alert streams hold a thread each while open, so a threaded worker
+# class is required. With the sync class, every open stream would block a
+# whole worker until HUNT_ALERTS_STREAM_DURATION ends it.
+worker_class = 'gthread'
+
+# Requests, alert streams included, served concurrently by each worker
+threads = 32
+
+# Streams send a keep-alive comment every HUNT_ALERTS_HEARTBEAT seconds
+timeout = 60
+keepalive = 5
@@ -16,7 +16,9 @@ from .models import (
     Worker,
     Recognition,
     RecognitionMatch,
-    HuntMatch
+    HuntMatch,
+    EncoderVersion,
+    SubjectPrototype
 )
 
 
@@ -106,7 +108,9 @@ class FaceAdmin(admin.ModelAdmin):
         'pred_sex_score',
         'pred_age',
         'pred_age_var',
-        'embeddings'
+        'embeddings',
+        'embeddings_version',
+        'next_embeddings_version'
     )
     readonly_fields = (
         'id',
@@ -115,7 +119,9 @@ class FaceAdmin(admin.ModelAdmin):
         'created_at',
         'pred_sex',
         'pred_age',
-        'embeddings'
+        'embeddings',
+        'embeddings_version',
+        'next_embeddings_version'
     )
 
 
@@ -276,3 +282,18 @@ class NotificationAdmin(admin.ModelAdmin):
 @admin.register(Worker)
 class WorkerAdmin(admin.ModelAdmin):
     pass
+
+
+@admin.register(EncoderVersion)
+class EncoderVersionAdmin(admin.ModelAdmin):
+    readonly_fields = (
+        'id', 'created_at', 'activated_at'
+    )
+
+
+@admin.register(SubjectPrototype)
+class SubjectPrototypeAdmin(admin.ModelAdmin):
+    readonly_fields = (
+        'id', 'updated_at'
+    )
+    list_display = ('subject', 'version', 'faces_count', 'updated_at')
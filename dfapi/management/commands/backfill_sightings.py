@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+from dfapi.models import Subject
+from dfapi import services
+
+
+class Command(BaseCommand):
+    help = 'Build the sightings of subjects from their faces'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Subjects rebuilt at once'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        subjects_ids = Subject.objects.order_by('pk').values_list(
+            'pk', flat=True
+        )
+
+        batch = []
+        count = 0
+        for subject_id in subjects_ids.iterator(chunk_size=batch_size):
+            batch.append(subject_id)
+            if len(batch) == batch_size:
+                services.sightings.rebuild(batch)
+                count += len(batch)
+                batch = []
+
+        if len(batch):
+            services.sightings.rebuild(batch)
+            count += len(batch)
+
+        self.stdout.write(f'Rebuilt sightings of {count} subjects.')
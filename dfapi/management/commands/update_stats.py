@@ -6,10 +6,17 @@ from dfapi import services
 class Command(BaseCommand):
     help = 'Update statistics'
 
-    def _run(self):
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--estimate',
+            action='store_true',
+            help='Estimate the stored counts from the database statistics'
+        )
+
+    def _run(self, estimate: bool):
         services.stats.update_time_stats(stat.Stat.RESOLUTION_DAY)
         services.stats.update_time_stats(stat.Stat.RESOLUTION_HOUR)
-        services.stats.update_total_stats()
+        services.stats.update_total_stats(estimate=estimate)
 
     def handle(self, *args, **options):
-        self._run()
\ No newline at end of file
+        self._run(options['estimate'])
\ No newline at end of file
@@ -0,0 +1,46 @@
+# Generated by Django 3.0.2 on 2020-04-06 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dfapi', '0016_auto_20200323_1153'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EncoderVersion',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.CharField(max_length=64, unique=True)),
+                ('active', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('activated_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.AddField(
+            model_name='face',
+            name='embeddings_version',
+            field=models.CharField(blank=True, db_index=True, default='', help_text='Version of the face encoder that produced the embeddings.', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='face',
+            name='next_embeddings_bytes',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='face',
+            name='next_embeddings_version',
+            field=models.CharField(blank=True, db_index=True, default='', help_text='Version of the face encoder of the staged embeddings.', max_length=64),
+        ),
+        migrations.AlterField(
+            model_name='task',
+            name='task_type',
+            field=models.CharField(choices=[('video_detect_faces', 'video_detect_faces'), ('video_hunt_faces', 'video_hunt_faces'), ('video_detect_person', 'video_detect_person'), ('video_hunt_person', 'video_hunt_person'), ('predict_genderage', 'predict_genderage'), ('face_clustering', 'face_clustering'), ('face_reencoding', 'face_reencoding')], default='video_detect_faces', max_length=64),
+        ),
+    ]
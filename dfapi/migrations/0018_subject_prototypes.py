@@ -0,0 +1,32 @@
+# Generated by Django 3.0.2 on 2020-04-09 16:41
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dfapi', '0017_encoder_versions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SubjectPrototype',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.CharField(blank=True, default='', max_length=64)),
+                ('faces_count', models.IntegerField(default=0)),
+                ('embeddings_sum_bytes', models.BinaryField(blank=True, null=True)),
+                ('exemplars_bytes', models.BinaryField(blank=True, null=True)),
+                ('exemplars_faces_bytes', models.BinaryField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('subject', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='prototype', to='dfapi.Subject')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='recognition',
+            name='mode',
+            field=models.CharField(blank=True, choices=[('faces', 'faces'), ('prototypes', 'prototypes')], default='faces', max_length=16),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 3.0.2 on 2020-04-14 11:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dfapi', '0018_subject_prototypes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recognition',
+            name='error',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='recognition',
+            name='finished_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        # Existing recognitions were all executed synchronously
+        migrations.AddField(
+            model_name='recognition',
+            name='status',
+            field=models.CharField(blank=True, choices=[('pending', 'pending'), ('running', 'running'), ('success', 'success'), ('failure', 'failure')], default='success', max_length=16),
+        ),
+        migrations.AlterField(
+            model_name='recognition',
+            name='status',
+            field=models.CharField(blank=True, choices=[('pending', 'pending'), ('running', 'running'), ('success', 'success'), ('failure', 'failure')], default='pending', max_length=16),
+        ),
+        migrations.AlterField(
+            model_name='notification',
+            name='category',
+            field=models.CharField(choices=[('task', 'Task'), ('recognition', 'Recognition')], max_length=16),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.0.2 on 2020-04-16 09:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dfapi', '0019_recognition_status'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='subject',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+    ]
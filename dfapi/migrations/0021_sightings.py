@@ -0,0 +1,46 @@
+# Generated by Django 3.0.2 on 2020-04-20 11:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dfapi', '0020_subject_updated_at_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Sighting',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('first_seen', models.DateTimeField()),
+                ('last_seen', models.DateTimeField()),
+                ('faces_count', models.PositiveIntegerField(default=0)),
+                ('camera', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='sightings', to='dfapi.Camera')),
+                ('subject', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sightings', to='dfapi.Subject')),
+                ('task', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='sightings', to='dfapi.Task')),
+                ('video', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='sightings', to='dfapi.VideoRecord')),
+            ],
+            options={
+                'ordering': ['first_seen'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='sighting',
+            index=models.Index(fields=['subject', 'first_seen'], name='sighting_subject_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sighting',
+            index=models.Index(fields=['subject', 'task', 'last_seen'], name='sighting_track_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sighting',
+            index=models.Index(fields=['camera', 'first_seen'], name='sighting_camera_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sighting',
+            index=models.Index(fields=['video', 'first_seen'], name='sighting_video_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 3.0.2 on 2020-04-22 10:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dfapi', '0021_sightings'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='subject',
+            index=models.Index(fields=['created_at', 'id'], name='subject_created_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['created_at', 'id'], name='task_created_at_idx'),
+        ),
+    ]
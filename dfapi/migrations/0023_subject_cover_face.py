@@ -0,0 +1,24 @@
+# Generated by Django 3.0.2 on 2020-04-23 15:37
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dfapi', '0022_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='subject',
+            name='cover_face',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='dfapi.Face'),
+        ),
+        migrations.AddField(
+            model_name='subject',
+            name='last_seen_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+    ]
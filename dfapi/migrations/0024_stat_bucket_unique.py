@@ -0,0 +1,36 @@
+# Generated by Django 3.0.2 on 2020-04-27 11:20
+
+from django.db import migrations, models
+
+
+def delete_duplicated_stats(apps, schema_editor):
+    Stat = apps.get_model('dfapi', 'Stat')
+    seen = set()
+    duplicated = []
+    stats = Stat.objects.order_by('-updated_at').values_list(
+        'pk', 'name', 'resolution', 'timestamp'
+    )
+    for pk, name, resolution, timestamp in stats.iterator():
+        key = (name, resolution, timestamp)
+        if key in seen:
+            duplicated.append(pk)
+        else:
+            seen.add(key)
+    Stat.objects.filter(pk__in=duplicated).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dfapi', '0023_subject_cover_face'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            delete_duplicated_stats, migrations.RunPython.noop
+        ),
+        migrations.AddConstraint(
+            model_name='stat',
+            constraint=models.UniqueConstraint(fields=('name', 'resolution', 'timestamp'), name='stat_bucket_unique'),
+        ),
+    ]
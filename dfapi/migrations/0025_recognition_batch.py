@@ -0,0 +1,18 @@
+# Generated by Django 3.0.2 on 2020-04-28 09:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dfapi', '0024_stat_bucket_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recognition',
+            name='batch',
+            field=models.UUIDField(blank=True, db_index=True, null=True),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 3.0.2 on 2020-04-29 10:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dfapi', '0025_recognition_batch'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatDelta',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255)),
+                ('delta', models.FloatField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
@@ -7,12 +7,15 @@ from .task import (
     VTaskConfig,
     PgaTaskConfig,
     FclTaskConfig,
-    FclTaskInfo
+    FclTaskInfo,
+    FreTaskConfig
 )
 from .tag import Tag
 from .face import Face, Frame
-from .subject import Subject, SubjectSegment
-from .stat import Stat
+from .encoder import EncoderVersion
+from .subject import Subject, SubjectSegment, SubjectPrototype
+from .stat import Stat, StatDelta
 from .notification import Notification
 from .worker import Worker
 from .recognition import Recognition, RecognitionMatch
+from .sighting import Sighting
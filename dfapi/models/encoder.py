@@ -0,0 +1,42 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import models
+
+ACTIVE_VERSION_KEY = 'encoder:active_version'
+
+
+class EncoderVersion(models.Model):
+    """A face encoder version whose embeddings are stored in the database.
+
+    Recognition only uses embeddings of the active version. Untagged
+    embeddings, stored before versions were tracked, belong to the empty
+    version, which is active while no other version has been activated.
+    """
+
+    version = models.CharField(max_length=64, unique=True)
+    active = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    activated_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return self.version
+
+    @staticmethod
+    def active_version() -> str:
+        version = cache.get(ACTIVE_VERSION_KEY)
+        if version is None:
+            instance = EncoderVersion.objects.filter(active=True).first()
+            version = '' if instance is None else instance.version
+            cache.set(
+                ACTIVE_VERSION_KEY,
+                version,
+                settings.ENCODER_VERSION_CACHE_TIMEOUT
+            )
+        return version
+
+    @staticmethod
+    def invalidate_active_version():
+        cache.delete(ACTIVE_VERSION_KEY)
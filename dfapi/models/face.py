@@ -1,8 +1,11 @@
 from django.db import models
+from django.db.models import Case, F, Q, When
 from django.conf import settings
 from django.utils import timezone
 import numpy as np
 
+from .encoder import EncoderVersion
+
 
 class Frame(models.Model):
     image = models.ImageField(upload_to=settings.FACES_IMAGES_PATH)
@@ -117,6 +120,89 @@ class Face(Entity):
         on_delete=models.CASCADE,
         related_name='faces'
     )
+    embeddings_version = models.CharField(
+        max_length=64,
+        blank=True,
+        default='',
+        db_index=True,
+        help_text='Version of the face encoder that produced the embeddings.'
+    )
+    next_embeddings_bytes = models.BinaryField(
+        null=True,
+        blank=True
+    )
+    next_embeddings_version = models.CharField(
+        max_length=64,
+        blank=True,
+        default='',
+        db_index=True,
+        help_text='Version of the face encoder of the staged embeddings.'
+    )
+
+    @property
+    def next_embeddings(self):
+        if self.next_embeddings_bytes is not None:
+            return np.frombuffer(self.next_embeddings_bytes, np.float32)
+        return []
+
+    @next_embeddings.setter
+    def next_embeddings(self, val: [list, np.ndarray]):
+        self.next_embeddings_bytes = np.array(val, np.float32).tobytes()
+
+    def embeddings_for(self, version: str):
+        """Return the embeddings produced by the encoder ``version``, or
+        None if the face has no embeddings for that version."""
+        if (
+            self.embeddings_version == version and
+            self.embeddings_bytes is not None
+        ):
+            return self.embeddings
+        if (
+            self.next_embeddings_version == version and
+            self.next_embeddings_bytes is not None
+        ):
+            return self.next_embeddings
+        return None
+
+    def set_embeddings(self, embeddings: [list, np.ndarray], version: str):
+        """Store embeddings produced by the encoder ``version``.
+
+        While ``version`` is not active, which happens while the stored
+        faces are being re-encoded, the embeddings are staged and the
+        current ones are left untouched.
+        """
+        if version == EncoderVersion.active_version():
+            self.embeddings = embeddings
+            self.embeddings_version = version
+        else:
+            self.next_embeddings = embeddings
+            self.next_embeddings_version = version
+
+    @staticmethod
+    def version_filter(version: str) -> Q:
+        """Faces with embeddings of the encoder ``version``, current or
+        staged."""
+        return Q(
+            embeddings_version=version,
+            embeddings_bytes__isnull=False
+        ) | Q(
+            next_embeddings_version=version,
+            next_embeddings_bytes__isnull=False
+        )
+
+    @staticmethod
+    def version_embeddings(version: str) -> Case:
+        """Expression of the embeddings of the encoder ``version``, to be
+        used along with ``version_filter``."""
+        return Case(
+            When(
+                embeddings_version=version,
+                embeddings_bytes__isnull=False,
+                then=F('embeddings_bytes')
+            ),
+            default=F('next_embeddings_bytes'),
+            output_field=models.BinaryField()
+        )
 
     @property
     def landmarks(self):
@@ -7,17 +7,23 @@ from django.db.models import Sum, Avg
 from django.db.models.functions import Cast
 from django.utils.functional import cached_property
 
-from .task import Task
+from .task import Task, VTaskConfig
 
 
 class MediaSource(models.Model):
 
+    # Video source type of the tasks processing this source
+    SOURCE_TYPE = ''
+
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     @cached_property
     def tasks(self):
-        return Task.objects.filter(config__video_source_id=self.pk)
+        return Task.objects.filter(
+            config__video_source_type=self.SOURCE_TYPE,
+            config__video_source_id=self.pk
+        )
 
     @cached_property
     def running_tasks(self):
@@ -75,6 +81,8 @@ class MediaSource(models.Model):
 
 class Camera(MediaSource):
 
+    SOURCE_TYPE = VTaskConfig.VIDEO_SOURCE_CAMERA
+
     stream_url = models.CharField(max_length=255)
     name = models.CharField(max_length=255)
     location_lat = models.FloatField(null=True, blank=True)
@@ -87,6 +95,8 @@ class Camera(MediaSource):
 
 class VideoRecord(MediaSource):
 
+    SOURCE_TYPE = VTaskConfig.VIDEO_SOURCE_RECORD
+
     path = models.CharField(max_length=255, unique=True, db_index=True)
     name = models.CharField(max_length=255, blank=True, default='')
     starts_at = models.DateTimeField(blank=True, null=True)
@@ -4,9 +4,11 @@ from django.db import models
 class Notification(models.Model):
 
     CATEGORY_TASK = 'task'
+    CATEGORY_RECOGNITION = 'recognition'
 
     CATEGORY_CHOICES = [
-        (CATEGORY_TASK, 'Task')
+        (CATEGORY_TASK, 'Task'),
+        (CATEGORY_RECOGNITION, 'Recognition')
     ]
 
     DTYPE_ERROR = 'error'
@@ -20,9 +20,44 @@ class RecognitionMatch(models.Model):
 
 class Recognition(models.Model):
 
+    MODE_FACES = 'faces'
+    MODE_PROTOTYPES = 'prototypes'
+
+    MODE_CHOICES = [
+        (MODE_FACES, 'faces'),
+        (MODE_PROTOTYPES, 'prototypes'),
+    ]
+
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_SUCCESS = 'success'
+    STATUS_FAILURE = 'failure'
+
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'pending'),
+        (STATUS_RUNNING, 'running'),
+        (STATUS_SUCCESS, 'success'),
+        (STATUS_FAILURE, 'failure'),
+    ]
+
+    mode = models.CharField(
+        max_length=16,
+        choices=MODE_CHOICES,
+        blank=True,
+        default=MODE_FACES
+    )
     sim_thresh = models.FloatField(blank=True, default=0.5)
     max_matches = models.IntegerField(blank=True, default=5)
     created_at = models.DateTimeField(auto_now_add=True, null=True, blank=True)
+    status = models.CharField(
+        max_length=16,
+        choices=STATUS_CHOICES,
+        blank=True,
+        default=STATUS_PENDING
+    )
+    error = models.TextField(blank=True, default='')
+    finished_at = models.DateTimeField(null=True, blank=True)
+    batch = models.UUIDField(null=True, blank=True, db_index=True)
 
     face = models.ForeignKey(
         'Face',
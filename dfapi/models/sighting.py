@@ -0,0 +1,61 @@
+from django.db import models
+
+
+class Sighting(models.Model):
+    """Contiguous appearance of a subject in a video task.
+
+    Faces of a subject stored by the same task are collapsed into a single
+    sighting while they are no more than ``SIGHTING_MAX_GAP`` seconds
+    apart, so trajectories are read without scanning faces.
+    """
+
+    subject = models.ForeignKey(
+        'Subject',
+        on_delete=models.CASCADE,
+        related_name='sightings'
+    )
+    task = models.ForeignKey(
+        'Task',
+        null=True,
+        blank=True,
+        on_delete=models.CASCADE,
+        related_name='sightings'
+    )
+    camera = models.ForeignKey(
+        'Camera',
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name='sightings'
+    )
+    video = models.ForeignKey(
+        'VideoRecord',
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name='sightings'
+    )
+    first_seen = models.DateTimeField()
+    last_seen = models.DateTimeField()
+    faces_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ['first_seen']
+        indexes = [
+            models.Index(
+                fields=['subject', 'first_seen'],
+                name='sighting_subject_idx'
+            ),
+            models.Index(
+                fields=['subject', 'task', 'last_seen'],
+                name='sighting_track_idx'
+            ),
+            models.Index(
+                fields=['camera', 'first_seen'],
+                name='sighting_camera_idx'
+            ),
+            models.Index(
+                fields=['video', 'first_seen'],
+                name='sighting_video_idx'
+            ),
+        ]
@@ -21,6 +21,25 @@ class Stat(models.Model):
 
     class Meta:
         ordering = ['-timestamp']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['name', 'resolution', 'timestamp'],
+                name='stat_bucket_unique'
+            )
+        ]
 
     def __str__(self):
         return f'Stat: ({self.name}, {self.value}, {self.timestamp}, {self.resolution})'
+
+
+class StatDelta(models.Model):
+    """Pending change of a total stats counter.
+
+    Changes are appended instead of updating the counter row, which every
+    stored instance would lock in turn, and are folded into the counters
+    by ``stats.fold_totals``.
+    """
+
+    name = models.CharField(max_length=255)
+    delta = models.FloatField()
+    created_at = models.DateTimeField(auto_now_add=True)
@@ -12,6 +12,10 @@ from django.db.models import QuerySet
 from django.utils.functional import cached_property
 from django.utils.timezone import make_aware
 
+from .encoder import EncoderVersion
+from .face import Face
+from ..quantization import quantize
+
 logger_name = settings.LOGGER_NAME
 logger = logging.getLogger(logger_name)
 
@@ -64,8 +68,18 @@ class Subject(models.Model):
     #     related_name='subjects'
     # )
 
+    # Denormalized from the subject faces, see services.subjects
+    cover_face = models.ForeignKey(
+        'Face',
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name='+'
+    )
+    last_seen_at = models.DateTimeField(null=True, blank=True, db_index=True)
+
     created_at = models.DateTimeField(auto_now_add=True)
-    updated_at = models.DateTimeField(auto_now=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     @cached_property
     def full_name(self):
@@ -73,19 +87,13 @@ class Subject(models.Model):
 
     @cached_property
     def image(self):
-        for face in self.faces.all():
-            if face.image:
-                return face.image
+        if self.cover_face_id is not None and self.cover_face.image:
+            return self.cover_face.image
         return None
 
     @cached_property
     def timestamp(self):
-        dt = None
-        for face in self.faces.all():
-            if dt is None or face.created_at > dt:
-                dt = face.created_at
-
-        return self.created_at if dt is None else dt
+        return self.created_at if self.last_seen_at is None else self.last_seen_at
 
     @cached_property
     def age(self):
@@ -98,6 +106,12 @@ class Subject(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(
+                fields=['created_at', 'id'],
+                name='subject_created_at_idx'
+            ),
+        ]
 
     @staticmethod
     def age_from_birthdate(birthdate):
@@ -121,19 +135,144 @@ class Subject(models.Model):
     #     return None
 
     @staticmethod
-    def queryset_train_data(queryset: QuerySet) -> Tuple[np.ndarray, np.ndarray]:
+    def queryset_train_data(
+        queryset: QuerySet
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
         embeddings = []
         subjects = []
-        queryset = queryset.exclude(faces__embeddings_bytes__isnull=True)
-        for subject in queryset.iterator():
-            for face in subject.faces.all():
-                embeddings.append(face.embeddings)
-                subjects.append(subject.id)
+        faces_ids = []
+        version = EncoderVersion.active_version()
+        faces = Face.objects.filter(
+            Face.version_filter(version),
+            subject__in=queryset
+        ).annotate(
+            version_embeddings_bytes=Face.version_embeddings(version)
+        ).order_by('subject_id', 'pk').values_list(
+            'id',
+            'subject_id',
+            'version_embeddings_bytes'
+        )
+        for face_id, subject_id, embeddings_bytes in faces.iterator():
+            embeddings.append(np.frombuffer(embeddings_bytes, np.float32))
+            subjects.append(subject_id)
+            faces_ids.append(face_id)
 
         embeddings = np.array(embeddings, np.float32)
         subjects = np.array(subjects, np.int32)
+        faces_ids = np.array(faces_ids, np.int64)
+
+        return embeddings, subjects, faces_ids
+
+
+class SubjectPrototype(models.Model):
+    """Compact summary of the face embeddings of a subject.
+
+    It holds the running sum of the subject embeddings, from which the
+    centroid is derived, plus a few diverse exemplar embeddings. It is
+    updated incrementally as faces are added to or removed from the
+    subject.
+    """
+
+    subject = models.OneToOneField(
+        'Subject',
+        on_delete=models.CASCADE,
+        related_name='prototype'
+    )
+    version = models.CharField(max_length=64, blank=True, default='')
+    faces_count = models.IntegerField(default=0)
+    embeddings_sum_bytes = models.BinaryField(null=True, blank=True)
+    exemplars_bytes = models.BinaryField(null=True, blank=True)
+    exemplars_faces_bytes = models.BinaryField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @property
+    def embeddings_sum(self):
+        if self.embeddings_sum_bytes is not None:
+            return np.frombuffer(self.embeddings_sum_bytes, np.float32)
+        return None
 
-        return embeddings, subjects
+    @property
+    def centroid(self):
+        if self.faces_count and self.embeddings_sum_bytes is not None:
+            return self.embeddings_sum / self.faces_count
+        return None
+
+    @property
+    def exemplars(self):
+        if (
+            self.exemplars_bytes is not None and
+            self.embeddings_sum_bytes is not None
+        ):
+            return np.frombuffer(self.exemplars_bytes, np.float32).reshape(
+                (-1, len(self.embeddings_sum))
+            )
+        return np.zeros((0, 0), np.float32)
+
+    @property
+    def exemplars_faces(self):
+        if self.exemplars_faces_bytes is not None:
+            return np.frombuffer(self.exemplars_faces_bytes, np.int64)
+        return np.zeros(0, np.int64)
+
+    def vectors(self) -> np.ndarray:
+        """Centroid followed by the exemplars, one vector per row."""
+        centroid = self.centroid
+        if centroid is None:
+            return np.zeros((0, 0), np.float32)
+        return np.vstack([centroid.reshape((1, -1)), self.exemplars])
+
+    def add_embeddings(
+        self,
+        face_id: int,
+        embeddings: np.ndarray,
+        max_exemplars: int
+    ):
+        embeddings = np.asarray(embeddings, np.float32)
+        if self.faces_count and self.embeddings_sum_bytes is not None:
+            embeddings_sum = self.embeddings_sum + embeddings
+        else:
+            embeddings_sum = embeddings
+        self.embeddings_sum_bytes = embeddings_sum.tobytes()
+        self.faces_count += 1
+
+        exemplars = self.exemplars
+        faces = self.exemplars_faces
+        if len(exemplars):
+            exemplars = np.vstack([exemplars, embeddings.reshape((1, -1))])
+        else:
+            exemplars = embeddings.reshape((1, -1))
+        faces = np.hstack([faces, [face_id]]).astype(np.int64)
+
+        if len(exemplars) > max_exemplars:
+            # Drop the exemplar most similar to any of the others
+            norms = np.linalg.norm(exemplars, axis=1, keepdims=True)
+            normalized = exemplars / np.where(norms > 0, norms, 1)
+            similarities = normalized @ normalized.T
+            np.fill_diagonal(similarities, -np.inf)
+            drop_ind = int(np.argmax(similarities.max(axis=1)))
+            exemplars = np.delete(exemplars, drop_ind, axis=0)
+            faces = np.delete(faces, drop_ind)
+
+        self.exemplars_bytes = exemplars.astype(np.float32).tobytes()
+        self.exemplars_faces_bytes = faces.tobytes()
+
+    def remove_embeddings(self, face_id: int, embeddings: np.ndarray):
+        if not self.faces_count or self.embeddings_sum_bytes is None:
+            return
+        embeddings = np.asarray(embeddings, np.float32)
+        self.embeddings_sum_bytes = (
+            self.embeddings_sum - embeddings
+        ).tobytes()
+        self.faces_count -= 1
+
+        faces = self.exemplars_faces
+        keep = faces != face_id
+        if not np.all(keep):
+            self.exemplars_bytes = self.exemplars[keep].tobytes()
+            self.exemplars_faces_bytes = faces[keep].tobytes()
+
+    def __str__(self):
+        return f'Prototype of subject <{self.subject_id}>'
 
 
 # noinspection PyTypeChecker
@@ -249,24 +388,81 @@ class SubjectSegment(models.Model):
         return queryset.distinct()
 
     def get_data(self):
-        if not self.disk_cached or not self.model_path or self.is_outdated():
-            embeddings, subjects = Subject.queryset_train_data(self.queryset)
-            self.update_data(embeddings, subjects)
-            return embeddings, subjects
-        else:
-            data = np.load(self.full_model_path)
-            return data['embeddings'], data['subjects']
-
-    def update_data(self, embeddings=None, subjects=None):
+        data = self.load_data(('embeddings', 'subjects'))
+        return data['embeddings'], data['subjects']
+
+    def get_prototypes_data(self):
+        data = self.load_data(('prototypes', 'prototypes_subjects'))
+        return data['prototypes'], data['prototypes_subjects']
+
+    def get_quantized_data(self):
+        return self.load_data(
+            ('codes', 'scales', 'norms', 'subjects', 'faces')
+        )
+
+    def load_data(self, keys: Tuple[str, ...]) -> dict:
+        mode = settings.EMBEDDINGS_QUANTIZATION
+        if self.disk_cached and self.model_path and not self.is_outdated():
+            with np.load(self.full_model_path) as data:
+                valid = all(key in data.files for key in keys)
+                if valid and 'codes' in keys:
+                    valid = (
+                        'quantization' in data.files and
+                        str(data['quantization']) == mode
+                    )
+                if valid:
+                    return {key: data[key] for key in keys}
+
+        data = self.build_data()
+        self.update_data(data)
+        return {key: data[key] for key in keys}
+
+    def build_data(self) -> dict:
+        embeddings, subjects, faces = Subject.queryset_train_data(
+            self.queryset
+        )
+        data = {
+            'embeddings': embeddings,
+            'subjects': subjects,
+            'faces': faces
+        }
+
+        prototypes = []
+        prototypes_subjects = []
+        prototypes_queryset = SubjectPrototype.objects.filter(
+            subject__in=self.queryset,
+            version=EncoderVersion.active_version()
+        )
+        for prototype in prototypes_queryset.iterator():
+            vectors = prototype.vectors()
+            prototypes.extend(vectors)
+            prototypes_subjects.extend([prototype.subject_id] * len(vectors))
+        data['prototypes'] = np.array(prototypes, np.float32)
+        data['prototypes_subjects'] = np.array(prototypes_subjects, np.int32)
+
+        mode = settings.EMBEDDINGS_QUANTIZATION
+        if mode:
+            codes, scales = quantize(embeddings, mode)
+            data['codes'] = codes
+            data['scales'] = scales
+            norms = np.zeros(len(faces), np.float32)
+            if len(faces):
+                norms = np.linalg.norm(embeddings, axis=1).astype(np.float32)
+            data['norms'] = norms
+            data['quantization'] = np.array(mode)
+
+        return data
+
+    def update_data(self, data: dict = None):
         if not self.disk_cached:
             return
         self.updated_at = make_aware(datetime.now())
         self.count = self.queryset.count()
         if self.model_path:
-            if embeddings is None or subjects is None:
-                embeddings, subjects = Subject.queryset_train_data(self.queryset)
-            np.savez(self.full_model_path, subjects=subjects, embeddings=embeddings)
-        self.save()
+            if data is None:
+                data = self.build_data()
+            np.savez(self.full_model_path, **data)
+        self.save(update_fields=['updated_at', 'count'])
 
     def is_outdated(self):
         if not self.disk_cached or not path.exists(self.full_model_path):
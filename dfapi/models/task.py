@@ -12,6 +12,7 @@ class Task(models.Model):
     TYPE_VIDEO_HUNT_PERSON = 'video_hunt_person'
     TYPE_PREDICT_GENDERAGE = 'predict_genderage'
     TYPE_FACE_CLUSTERING = 'face_clustering'
+    TYPE_FACE_REENCODING = 'face_reencoding'
 
     TYPE_CHOICES = [
         (TYPE_VIDEO_DETECT_FACES, 'video_detect_faces'),
@@ -19,7 +20,8 @@ class Task(models.Model):
         (TYPE_VIDEO_DETECT_PERSON, 'video_detect_person'),
         (TYPE_VIDEO_HUNT_PERSON, 'video_hunt_person'),
         (TYPE_PREDICT_GENDERAGE, 'predict_genderage'),
-        (TYPE_FACE_CLUSTERING, 'face_clustering')
+        (TYPE_FACE_CLUSTERING, 'face_clustering'),
+        (TYPE_FACE_REENCODING, 'face_reencoding')
     ]
 
     STATUS_CREATED = 'created'
@@ -82,6 +84,12 @@ class Task(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(
+                fields=['created_at', 'id'],
+                name='task_created_at_idx'
+            ),
+        ]
 
     def __str__(self):
         return self.name
@@ -115,6 +123,10 @@ class VdfTaskConfig(VTaskConfig):
         self.video_detect_interval: float = kwargs.get('video_detect_interval', 0.5)
         self.faces_time_memory: float = kwargs.get('faces_time_memory', 60)
         self.store_face_frames: bool = kwargs.get('store_face_frames', True)
+        self.predict_genderage: bool = kwargs.get('predict_genderage', False)
+        self.store_aligned_crops: bool = kwargs.get('store_aligned_crops', False)
+        self.link_subjects: bool = kwargs.get('link_subjects', False)
+        self.link_similarity_thresh: float = kwargs.get('link_similarity_thresh', 0.6)
 
 
 class VhfTaskConfig(VdfTaskConfig):
@@ -187,6 +199,14 @@ class FclTaskInfo:
         self.faces_count: float = 0
 
 
+class FreTaskConfig:
+    """Face re-encoding task config. """
+
+    def __init__(self, *args, **kwargs):
+        self.batch_size: int = kwargs.get('batch_size', 64)
+        self.auto_switch: bool = kwargs.get('auto_switch', True)
+
+
 class HuntMatch(models.Model):
     target_subject = models.ForeignKey(
         'Subject',
@@ -0,0 +1,192 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as BinasciiError
+from collections import OrderedDict
+from typing import Optional, Sequence
+
+from django.core.exceptions import ValidationError
+from django.db import connections
+from django.db.models import Q, QuerySet
+from rest_framework.exceptions import (
+    NotFound as ApiNotFound,
+    ValidationError as ApiValidationError
+)
+from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param, remove_query_param
+
+COUNT_EXACT = 'exact'
+COUNT_ESTIMATE = 'estimate'
+COUNT_NONE = 'none'
+
+COUNT_CHOICES = (COUNT_EXACT, COUNT_ESTIMATE, COUNT_NONE)
+
+
+def estimate_count(queryset: QuerySet) -> int:
+    """Rows the database planner expects ``queryset`` to return."""
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return queryset.count()
+
+    sql, params = queryset.order_by().values('pk').query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+class KeysetPagination(LimitOffsetPagination):
+    """Limit/offset pagination that switches to keyset pagination when the
+    `cursor` parameter is given.
+
+    Keyset pages are ordered by the view ``keyset_ordering`` fields, which
+    must be covered by an index, and each page filters from the last row
+    of the previous one. Reaching deep pages then costs the same as the
+    first one. Send an empty `cursor` to get the first page and follow the
+    `next` link, ``order_by`` does not apply to keyset pages.
+
+    The `count` parameter selects how the total is computed: `exact`
+    (default for offset pages), `estimate` (from the query plan) or `none`
+    (default for keyset pages).
+    """
+
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+
+    def __init__(self):
+        self.keyset_ordering: Optional[Sequence[str]] = None
+        self.next_cursor: Optional[str] = None
+        self.count: Optional[int] = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.limit = self.get_limit(request)
+        if self.limit is None:
+            return None
+
+        cursor = request.query_params.get(self.cursor_query_param, None)
+        ordering = getattr(view, 'keyset_ordering', None)
+        if cursor is None or ordering is None:
+            self.keyset_ordering = None
+            self.count = self.get_count_mode(request, COUNT_EXACT, queryset)
+            self.offset = self.get_offset(request)
+            if self.count is not None and (
+                self.count == 0 or self.offset > self.count
+            ):
+                self.has_next = False
+                return []
+            page = list(queryset[self.offset:self.offset + self.limit + 1])
+            self.has_next = len(page) > self.limit
+            return page[0:self.limit]
+
+        self.keyset_ordering = ordering
+        self.count = self.get_count_mode(request, COUNT_NONE, queryset)
+        queryset = queryset.order_by(*ordering)
+        if cursor:
+            queryset = queryset.filter(
+                self.keyset_filter(self.decode_cursor(cursor, queryset))
+            )
+
+        page = list(queryset[0:self.limit + 1])
+        self.has_next = len(page) > self.limit
+        page = page[0:self.limit]
+        self.next_cursor = None
+        if self.has_next:
+            self.next_cursor = self.encode_cursor(page[-1])
+        return page
+
+    def get_count_mode(
+        self,
+        request,
+        default: str,
+        queryset: QuerySet
+    ) -> Optional[int]:
+        mode = request.query_params.get(self.count_query_param, default)
+        if mode not in COUNT_CHOICES:
+            raise ApiValidationError(
+                f'Invalid {self.count_query_param} value "{mode}", it must be '
+                f'one of {", ".join(COUNT_CHOICES)}.'
+            )
+        if mode == COUNT_EXACT:
+            return self.get_count(queryset)
+        if mode == COUNT_ESTIMATE:
+            return estimate_count(queryset)
+        return None
+
+    def keyset_filter(self, values: list) -> Q:
+        """Rows after ``values`` in the keyset ordering.
+
+        It expands the row comparison ``(a, b) < (x, y)`` as
+        ``a <= x AND (a < x OR (a = x AND b < y))``, so the leading
+        condition keeps it an index range scan.
+        """
+        keys = list(zip(self.keyset_ordering, values))
+
+        condition = None
+        for key, value in reversed(keys):
+            field = key.lstrip('-')
+            lookup = 'lt' if key.startswith('-') else 'gt'
+            after = Q(**{f'{field}__{lookup}': value})
+            if condition is not None:
+                after |= Q(**{field: value}) & condition
+            condition = after
+
+        key, value = keys[0]
+        lookup = 'lte' if key.startswith('-') else 'gte'
+        return Q(**{f'{key.lstrip("-")}__{lookup}': value}) & condition
+
+    def encode_cursor(self, instance) -> str:
+        values = []
+        for field in self.keyset_ordering:
+            value = getattr(instance, field.lstrip('-'))
+            if hasattr(value, 'isoformat'):
+                value = value.isoformat()
+            values.append(value)
+        return urlsafe_b64encode(json.dumps(values).encode('ascii')).decode('ascii')
+
+    def decode_cursor(self, cursor: str, queryset: QuerySet) -> list:
+        try:
+            values = json.loads(urlsafe_b64decode(cursor.encode('ascii')))
+            if len(values) != len(self.keyset_ordering):
+                raise ValueError
+            meta = queryset.model._meta
+            return [
+                meta.get_field(field.lstrip('-')).to_python(value)
+                for field, value in zip(self.keyset_ordering, values)
+            ]
+        except (BinasciiError, TypeError, ValueError, ValidationError):
+            raise ApiNotFound('Invalid cursor.')
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        if self.keyset_ordering is not None:
+            return replace_query_param(
+                url, self.cursor_query_param, self.next_cursor
+            )
+        url = replace_query_param(url, self.limit_query_param, self.limit)
+        offset = self.offset + self.limit
+        return replace_query_param(url, self.offset_query_param, offset)
+
+    def get_previous_link(self):
+        if self.keyset_ordering is not None:
+            return None
+        if self.offset <= 0:
+            return None
+        url = self.request.build_absolute_uri()
+        url = replace_query_param(url, self.limit_query_param, self.limit)
+        if self.offset - self.limit <= 0:
+            return remove_query_param(url, self.offset_query_param)
+        offset = self.offset - self.limit
+        return replace_query_param(url, self.offset_query_param, offset)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('count', self.count),
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data)
+        ]))
@@ -0,0 +1,86 @@
+"""Compact representations of face embeddings.
+
+Quantized codes are used for a fast first-pass scan of large galleries,
+whose top candidates are then re-ranked with the full precision vectors.
+"""
+from typing import Tuple
+
+import numpy as np
+
+QUANTIZATION_FLOAT16 = 'float16'
+QUANTIZATION_INT8 = 'int8'
+
+QUANTIZATION_CHOICES = [
+    QUANTIZATION_FLOAT16,
+    QUANTIZATION_INT8
+]
+
+INT8_MAX = 127
+SCAN_BLOCK_SIZE = 65536
+
+
+def quantize(
+    embeddings: np.ndarray,
+    mode: str
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Return the codes of ``embeddings`` and their per vector scales."""
+    embeddings = np.asarray(embeddings, np.float32)
+    if embeddings.size == 0:
+        embeddings = embeddings.reshape((0, 0))
+    n_vectors = embeddings.shape[0]
+
+    if mode == QUANTIZATION_FLOAT16:
+        codes = embeddings.astype(np.float16)
+        scales = np.ones(n_vectors, np.float32)
+    elif mode == QUANTIZATION_INT8:
+        scales = np.abs(embeddings).max(axis=1, initial=0) / INT8_MAX
+        scales = np.where(scales > 0, scales, 1).astype(np.float32)
+        codes = np.clip(
+            np.rint(embeddings / scales[:, np.newaxis]), -INT8_MAX, INT8_MAX
+        ).astype(np.int8)
+    else:
+        raise ValueError(f'Invalid quantization mode "{mode}".')
+
+    return codes, scales
+
+
+def dequantize(codes: np.ndarray, scales: np.ndarray) -> np.ndarray:
+    return codes.astype(np.float32) * scales[:, np.newaxis]
+
+
+def scan(
+    query: np.ndarray,
+    codes: np.ndarray,
+    scales: np.ndarray,
+    norms: np.ndarray
+) -> np.ndarray:
+    """Approximate cosine similarity between ``query`` and every code.
+
+    A matrix of queries, one per row, is scanned in a single pass and gets
+    a row of similarities each. Codes are expanded block by block, so the
+    scan never holds a full precision copy of the gallery in memory.
+    """
+    query = np.asarray(query, np.float32)
+    queries = query.reshape((-1, query.shape[-1]))
+    similarities = np.empty((len(queries), codes.shape[0]), np.float32)
+
+    for start in range(0, codes.shape[0], SCAN_BLOCK_SIZE):
+        stop = start + SCAN_BLOCK_SIZE
+        block = codes[start:stop].astype(np.float32)
+        similarities[:, start:stop] = (queries @ block.T) * scales[start:stop]
+
+    denominator = np.outer(np.linalg.norm(queries, axis=1), norms)
+    denominator[denominator == 0] = 1
+    similarities /= denominator
+    if query.ndim == 2:
+        return similarities
+    return similarities[0]
+
+
+def top_candidates(similarities: np.ndarray, count: int) -> np.ndarray:
+    """Indices of the ``count`` largest similarities, best first."""
+    count = min(count, len(similarities))
+    if count <= 0:
+        return np.zeros(0, np.int64)
+    inds = np.argpartition(-similarities, count - 1)[:count]
+    return inds[np.argsort(-similarities[inds])]
@@ -0,0 +1,31 @@
+from rest_framework.renderers import BaseRenderer
+
+
+class EventStreamRenderer(BaseRenderer):
+    """Accept server-sent events requests. Streaming views build their
+    response body themselves, so only error details are rendered."""
+
+    media_type = 'text/event-stream'
+    format = 'event-stream'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if isinstance(data, bytes):
+            return data
+        return f'event: error\ndata: {data}\n\n'.encode(self.charset)
+
+
+class BinaryRenderer(BaseRenderer):
+    """Accept binary downloads built by streaming views."""
+
+    media_type = 'application/octet-stream'
+    format = 'bin'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, bytes):
+            return data
+        return str(data).encode('utf-8')
@@ -1,8 +1,13 @@
 from .face import FaceSerializer, FrameSerializer
 from .media import CameraSerializer, VideoRecordSerializer
 from .subject import SubjectSerializer, SubjectSegmentSerializer
-from .task import TaskSerializer
+from .task import TaskSerializer, HuntedSubjectsSerializer
 from .tag import TagSerializer
 from .stat import StatSerializer
 from .notification import NotificationSerializer
-from .recognition import RecognitionSerializer
+from .recognition import (
+    RecognitionSerializer,
+    RecognitionBatchSerializer,
+    ShardSearchSerializer
+)
+from .sighting import SightingSerializer
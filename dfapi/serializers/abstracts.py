@@ -1,8 +1,22 @@
+from typing import Dict, Iterable, Optional, Sequence, Tuple
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch, QuerySet
 from rest_framework import serializers
 
 
 class MaskFieldsSerializer(serializers.ModelSerializer):
 
+    # Model columns read by each serializer field, for the fields that are
+    # not columns themselves. Columns of forward relations, as in
+    # ``'relation__column'``, are joined. Serializers that leave it as None
+    # load full rows in lists.
+    query_columns: Optional[Dict[str, Sequence[str]]] = None
+
+    # Related objects read by each serializer field, as the relation name
+    # and the columns needed from the related model.
+    query_prefetch: Dict[str, Tuple[str, Sequence[str]]] = {}
+
     def __init__(self, *args, **kwargs):
         # Don't pass the 'fields' arg up to the superclass
         fields = kwargs.pop('fields', None)
@@ -16,3 +30,76 @@ class MaskFieldsSerializer(serializers.ModelSerializer):
             existing = set(self.fields)
             for field_name in existing - allowed:
                 self.fields.pop(field_name)
+
+    @classmethod
+    def setup_queryset(
+        cls,
+        queryset: QuerySet,
+        fields: Iterable[str] = None
+    ) -> QuerySet:
+        """Load only the columns and relations of the requested fields.
+
+        Columns not read by any field, such as embeddings and landmarks
+        blobs, are deferred, and related objects are fetched in one query
+        instead of one per row.
+        """
+        if cls.query_columns is None:
+            return queryset
+
+        meta = queryset.model._meta
+        if fields is None:
+            fields = cls.Meta.fields
+        fields = set(fields) & set(cls.Meta.fields)
+
+        columns = {meta.pk.name}
+        select = set()
+        prefetch = {}
+        for field_name in fields:
+            if field_name in cls.query_prefetch:
+                relation, related_columns = cls.query_prefetch[field_name]
+                prefetch.setdefault(relation, set()).update(related_columns)
+            if field_name in cls.query_columns:
+                columns.update(cls.query_columns[field_name])
+                continue
+            try:
+                field = meta.get_field(field_name)
+            except FieldDoesNotExist:
+                continue
+            if field.concrete:
+                columns.add(field_name)
+                nested = cls._declared_fields.get(field_name, None)
+                if field.many_to_one and isinstance(
+                    nested, serializers.BaseSerializer
+                ):
+                    select.add(field_name)
+            elif field_name not in cls.query_prefetch:
+                prefetch.setdefault(field_name, set())
+
+        for column in columns:
+            if '__' in column:
+                select.add(column.split('__')[0])
+
+        queryset = queryset.only(*columns)
+        if len(select):
+            queryset = queryset.select_related(*select)
+
+        for relation, related_columns in prefetch.items():
+            field = meta.get_field(relation)
+            related_model = field.related_model
+            related_columns = set(related_columns)
+            related_columns.add(related_model._meta.pk.name)
+            if field.one_to_many:
+                related_columns.add(field.field.name)
+                queryset = queryset.prefetch_related(Prefetch(
+                    relation,
+                    queryset=related_model.objects.only(*related_columns)
+                ))
+            else:
+                queryset = queryset.prefetch_related(relation)
+
+        return queryset
+
+    @classmethod
+    def setup_page(cls, page: list, fields: Iterable[str] = None):
+        """Load values computed for the whole page of a list at once."""
+        pass
@@ -73,6 +73,10 @@ class FaceSerializer(MaskFieldsSerializer):
     pred_sex = serializers.ChoiceField(read_only=True, choices=Face.SEX_CHOICES)
     pred_age = serializers.IntegerField(read_only=True)
 
+    query_columns = {
+        'box': ('box_bytes',)
+    }
+
     class Meta:
         model = Face
         fields = (
@@ -114,6 +118,8 @@ class FrameSerializer(MaskFieldsSerializer):
         read_only=True
     )
 
+    query_columns = {}
+
     class Meta:
         model = Frame
         fields = ('id', 'image', 'timestamp', 'faces')
@@ -1,3 +1,5 @@
+from typing import Iterable
+
 from rest_framework import serializers
 from rest_framework.serializers import ValidationError
 
@@ -14,6 +16,12 @@ class VideoThumbSerializer(serializers.ModelSerializer):
         read_only_fields = ('id', 'image', 'video')
 
 
+def fill_page_stats(page: list, fields: Iterable[str] = None):
+    stats_fields = set(services.media.SOURCE_STATS_FIELDS)
+    if fields is None or len(stats_fields & set(fields)):
+        services.media.fill_sources_stats(page)
+
+
 def video_path_validator(value):
     valid, msg = services.media.is_valid_video_path(value)
     if not valid:
@@ -38,6 +46,19 @@ class VideoRecordSerializer(MaskFieldsSerializer):
     frame_rate = serializers.FloatField(read_only=True)
     last_task_at = serializers.DateTimeField(read_only=True)
 
+    query_columns = {
+        'size': ('size_bytes',),
+        'url': ('path',),
+        **{field: () for field in services.media.SOURCE_STATS_FIELDS}
+    }
+    query_prefetch = {
+        'thumbs': ('thumbs', ('image',))
+    }
+
+    @classmethod
+    def setup_page(cls, page: list, fields: Iterable[str] = None):
+        fill_page_stats(page, fields)
+
     class Meta:
         model = VideoRecord
         fields = (
@@ -91,6 +112,14 @@ class CameraSerializer(MaskFieldsSerializer):
     frame_rate = serializers.FloatField(read_only=True)
     last_task_at = serializers.DateTimeField(read_only=True)
 
+    query_columns = {
+        field: () for field in services.media.SOURCE_STATS_FIELDS
+    }
+
+    @classmethod
+    def setup_page(cls, page: list, fields: Iterable[str] = None):
+        fill_page_stats(page, fields)
+
     class Meta:
         model = Camera
         fields = (
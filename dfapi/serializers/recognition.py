@@ -1,6 +1,16 @@
+from uuid import uuid4
+
+from django.db import transaction
 from rest_framework import serializers
+
 from .abstracts import MaskFieldsSerializer
-from ..models import Recognition, RecognitionMatch, SubjectSegment
+from ..models import (
+    Face,
+    Recognition,
+    RecognitionMatch,
+    SubjectSegment,
+    Task
+)
 # from .subject import SubjectSegmentSerializer, SubjectSerializer
 
 
@@ -42,9 +52,14 @@ class RecognitionSerializer(MaskFieldsSerializer):
         model = Recognition
         fields = (
             'id',
+            'mode',
             'sim_thresh',
             'max_matches',
             'created_at',
+            'status',
+            'error',
+            'finished_at',
+            'batch',
             'face',
             'segments',
             'matches'
@@ -52,6 +67,10 @@ class RecognitionSerializer(MaskFieldsSerializer):
         read_only_fields = (
             'id',
             'created_at',
+            'status',
+            'error',
+            'finished_at',
+            'batch',
             'matches'
         )
 
@@ -71,3 +90,105 @@ class RecognitionSerializer(MaskFieldsSerializer):
     #             validated_data['filter_id'] = segment.pk
     #
     #     return super().create(validated_data)
+
+
+class RecognitionBatchSerializer(serializers.Serializer):
+
+    mode = serializers.ChoiceField(
+        choices=Recognition.MODE_CHOICES,
+        required=False
+    )
+    sim_thresh = serializers.FloatField(
+        required=False,
+        min_value=0,
+        max_value=1
+    )
+    max_matches = serializers.IntegerField(required=False, min_value=0)
+    segments = serializers.PrimaryKeyRelatedField(
+        queryset=SubjectSegment.objects.all(),
+        many=True,
+        required=False
+    )
+    faces = serializers.ListSerializer(
+        child=serializers.IntegerField(),
+        required=False
+    )
+    task = serializers.PrimaryKeyRelatedField(
+        queryset=Task.objects.all(),
+        required=False
+    )
+
+    def validate_faces(self, value):
+        value = list(set(value))
+        if Face.objects.filter(pk__in=value).count() != len(value):
+            raise serializers.ValidationError(f'Invalid faces IDs')
+        return value
+
+    def validate(self, data):
+        if ('faces' in data) == ('task' in data):
+            raise serializers.ValidationError(
+                'Either a list of faces or a task must be provided.'
+            )
+        return super().validate(data)
+
+    def create(self, validated_data):
+        segments = validated_data.pop('segments', [])
+        faces_ids = validated_data.pop('faces', None)
+        task = validated_data.pop('task', None)
+        if task is not None:
+            faces_ids = Face.objects.filter(
+                task=task
+            ).values_list('id', flat=True)
+
+        batch = uuid4()
+        with transaction.atomic():
+            recognitions = Recognition.objects.bulk_create([
+                Recognition(face_id=face_id, batch=batch, **validated_data)
+                for face_id in faces_ids
+            ])
+            through_model = Recognition.segments.through
+            through_model.objects.bulk_create([
+                through_model(
+                    recognition_id=recognition.pk,
+                    subjectsegment_id=segment.pk
+                )
+                for recognition in recognitions
+                for segment in segments
+            ])
+
+        return recognitions
+
+
+class ShardSearchSerializer(serializers.Serializer):
+
+    embeddings = serializers.ListSerializer(
+        child=serializers.ListSerializer(
+            child=serializers.FloatField()
+        ),
+        allow_empty=False
+    )
+    shard_key = serializers.IntegerField()
+    shard_keys = serializers.ListSerializer(
+        child=serializers.IntegerField()
+    )
+    segments = serializers.ListSerializer(
+        child=serializers.IntegerField(),
+        required=False
+    )
+    sim_thresh = serializers.FloatField(required=False, default=0.5)
+    max_matches = serializers.IntegerField(
+        required=False,
+        min_value=0,
+        default=5
+    )
+
+    def validate(self, data):
+        if data['shard_key'] not in data['shard_keys']:
+            raise serializers.ValidationError(
+                'The shard key must be one of the shard keys.'
+            )
+        if len({len(query) for query in data['embeddings']}) != 1:
+            raise serializers.ValidationError(
+                'The embeddings must have the same size.'
+            )
+        return super().validate(data)
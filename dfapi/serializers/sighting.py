@@ -0,0 +1,19 @@
+from .abstracts import MaskFieldsSerializer
+from ..models import Sighting
+
+
+class SightingSerializer(MaskFieldsSerializer):
+
+    class Meta:
+        model = Sighting
+        fields = (
+            'id',
+            'subject',
+            'task',
+            'camera',
+            'video',
+            'first_seen',
+            'last_seen',
+            'faces_count'
+        )
+        read_only_fields = fields
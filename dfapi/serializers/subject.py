@@ -23,6 +23,16 @@ class SubjectSerializer(MaskFieldsSerializer):
     pred_age = serializers.IntegerField(read_only=True)
     pred_age_var = serializers.FloatField(read_only=True)
 
+    query_columns = {
+        'full_name': ('name', 'last_name'),
+        'age': ('birthdate',),
+        'image': ('cover_face', 'cover_face__image'),
+        'timestamp': ('last_seen_at', 'created_at')
+    }
+    query_prefetch = {
+        'faces': ('faces', ())
+    }
+
     class Meta:
         model = Subject
         fields = (
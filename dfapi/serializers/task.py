@@ -51,6 +51,14 @@ class VdfTaskConfigSerializer(VTaskConfigSerializer):
     video_detect_interval = serializers.FloatField(required=False)
     faces_time_memory = serializers.FloatField(required=False)
     store_face_frames = serializers.BooleanField(required=False)
+    predict_genderage = serializers.BooleanField(required=False)
+    store_aligned_crops = serializers.BooleanField(required=False)
+    link_subjects = serializers.BooleanField(required=False)
+    link_similarity_thresh = serializers.FloatField(
+        required=False,
+        min_value=0,
+        max_value=0.99999
+    )
 
 
 class VhfTaskConfigSerializer(VdfTaskConfigSerializer):
@@ -70,6 +78,28 @@ class VhfTaskConfigSerializer(VdfTaskConfigSerializer):
         return value
 
 
+class HuntedSubjectsSerializer(serializers.Serializer):
+
+    add = serializers.ListSerializer(
+        child=serializers.IntegerField(),
+        required=False
+    )
+    remove = serializers.ListSerializer(
+        child=serializers.IntegerField(),
+        required=False
+    )
+
+    def validate_add(self, value):
+        value = list(set(value))
+        if len(value):
+            subjects = Subject.objects.filter(pk__in=value)
+            if len(subjects) != len(value):
+                raise serializers.ValidationError(
+                    f'Invalid hunted subjects IDs'
+                )
+        return value
+
+
 class PgaTaskConfigSerializer(serializers.Serializer):
 
     min_created_at = serializers.DateTimeField(required=False, allow_null=True)
@@ -156,11 +186,18 @@ class FclTaskConfigSerializer(serializers.Serializer):
         return super().validate(data)
 
 
+class FreTaskConfigSerializer(serializers.Serializer):
+
+    batch_size = serializers.IntegerField(required=False, min_value=1)
+    auto_switch = serializers.BooleanField(required=False)
+
+
 _config_serializers = {
     Task.TYPE_VIDEO_DETECT_FACES: VdfTaskConfigSerializer,
     Task.TYPE_VIDEO_HUNT_FACES: VhfTaskConfigSerializer,
     Task.TYPE_PREDICT_GENDERAGE: PgaTaskConfigSerializer,
-    Task.TYPE_FACE_CLUSTERING: FclTaskConfigSerializer
+    Task.TYPE_FACE_CLUSTERING: FclTaskConfigSerializer,
+    Task.TYPE_FACE_REENCODING: FreTaskConfigSerializer
 }
 
 
@@ -4,6 +4,15 @@ from . import (
     subjects,
     notifications,
     faces,
-    stats
+    face_index,
+    stats,
+    crops,
+    prototypes,
+    recognition_cache,
+    shards,
+    alerts,
+    sightings,
+    exports,
+    retention
 )
 from .exceptions import ServiceError
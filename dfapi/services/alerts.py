@@ -0,0 +1,197 @@
+"""Publish/subscribe channel of hunt match alerts.
+
+Hunt tasks run in worker processes, while alert streams are served by the
+API processes. Alerts are sent with Postgres NOTIFY as soon as a match is
+confirmed, so they are not stored. Every API process LISTENs on a
+dedicated connection and hands them in memory to its stream subscribers.
+"""
+import json
+import logging
+import select
+from itertools import count
+from queue import Queue, Full as QueueFullError, Empty as QueueEmptyError
+from threading import Event, Lock, Thread
+from time import time
+from typing import Optional, Set
+
+import psycopg2
+from django.conf import settings
+from django.db import connection
+
+from ..models import Face, HuntMatch
+
+logger_name = settings.LOGGER_NAME
+logger = logging.getLogger(logger_name)
+
+
+class AlertChannel:
+    """Fan out published alerts to the queues of every subscriber.
+
+    Publishing never blocks the hunt tasks. A subscriber that does not
+    keep up loses its oldest pending alerts instead.
+    """
+
+    def __init__(self, max_pending: int):
+        self.max_pending: int = max_pending
+
+        self._subscribers: Set[Queue] = set()
+        self._ids = count(1)
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._subscribers)
+
+    def subscribe(self) -> Queue:
+        subscription = Queue(maxsize=self.max_pending)
+        with self._lock:
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Queue):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def publish(self, alert: dict) -> dict:
+        alert = dict(alert, id=next(self._ids))
+        alert.setdefault('published_at', time())
+        with self._lock:
+            subscribers = list(self._subscribers)
+
+        for subscription in subscribers:
+            while True:
+                try:
+                    subscription.put_nowait(alert)
+                    break
+                except QueueFullError:
+                    try:
+                        subscription.get_nowait()
+                    except QueueEmptyError:
+                        pass
+
+        return alert
+
+
+class AlertListener:
+    """Publish to a channel of this process the alerts notified by any
+    process on a Postgres notification channel.
+
+    The listener thread is started on the first subscription and keeps a
+    dedicated connection, since Django connections are not shared among
+    threads. It connects again when the connection is lost, alerts notified
+    meanwhile are lost.
+    """
+
+    POLL_INTERVAL = 1
+    RECONNECT_INTERVAL = 3
+
+    def __init__(self, channel: AlertChannel, name: str):
+        self.channel: AlertChannel = channel
+        self.name: str = name
+        self.listening = Event()
+
+        self._thread: Optional[Thread] = None
+        self._stop = Event()
+        self._lock = Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self._listen()
+            except psycopg2.Error as err:
+                logger.error(f'Hunt alerts listener error: {err}')
+                self._stop.wait(self.RECONNECT_INTERVAL)
+            finally:
+                self.listening.clear()
+
+    def _listen(self):
+        conn = psycopg2.connect(**connection.get_connection_params())
+        try:
+            conn.set_isolation_level(
+                psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT
+            )
+            with conn.cursor() as cursor:
+                cursor.execute(f'LISTEN "{self.name}"')
+            self.listening.set()
+
+            while not self._stop.is_set():
+                if select.select([conn], [], [], self.POLL_INTERVAL) == (
+                    [], [], []
+                ):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    notify = conn.notifies.pop(0)
+                    try:
+                        alert = json.loads(notify.payload)
+                    except ValueError:
+                        logger.error(f'Invalid hunt alert "{notify.payload}".')
+                        continue
+                    self.channel.publish(alert)
+        finally:
+            conn.close()
+
+
+def notify_alert(name: str, alert: dict):
+    """Send an alert to the listeners of every process. Connections are in
+    autocommit mode, so it is delivered right away."""
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_notify(%s, %s)', [name, json.dumps(alert)])
+
+
+def hunt_alert(
+    hunt_match: HuntMatch,
+    face: Face,
+    score: float,
+    captured_at: float
+) -> dict:
+    """Alert of a confirmed hunt match. ``captured_at`` is the timestamp
+    of the frame, so subscribers can measure the alert latency."""
+    return {
+        'hunt_match': hunt_match.pk,
+        'task': hunt_match.task_id,
+        'target_subject': hunt_match.target_subject_id,
+        'matched_subject': hunt_match.matched_subject_id,
+        'score': score,
+        'face': face.pk,
+        'thumbnail': face.image.url if face.image else None,
+        'captured_at': captured_at
+    }
+
+
+def publish_hunt_alert(
+    hunt_match: HuntMatch,
+    face: Face,
+    score: float,
+    captured_at: float
+):
+    alert = dict(
+        hunt_alert(hunt_match, face, score, captured_at),
+        published_at=time()
+    )
+    notify_alert(settings.HUNT_ALERTS_CHANNEL, alert)
+    logger.debug(
+        f'Hunt match <{hunt_match.pk}> alert published '
+        f'{alert["published_at"] - captured_at:.3f}s after capture.'
+    )
+
+
+def subscribe_hunt_alerts() -> Queue:
+    hunt_alerts_listener.start()
+    return hunt_alerts.subscribe()
+
+
+hunt_alerts = AlertChannel(settings.HUNT_ALERTS_MAX_PENDING)
+hunt_alerts_listener = AlertListener(hunt_alerts, settings.HUNT_ALERTS_CHANNEL)
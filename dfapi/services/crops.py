@@ -0,0 +1,249 @@
+import os
+import struct
+from collections import OrderedDict
+from os import path
+from threading import Lock
+from time import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+
+from ..models import Face
+
+CROP_CHANNELS = 3
+
+# Face ID of each record, followed by the raw crop
+RECORD_HEADER = struct.Struct('<q')
+
+# Face ID of the records of deleted faces
+TOMBSTONE_ID = -1
+
+# Minimum seconds between checks for new records of faces not indexed
+REFRESH_INTERVAL = 1
+
+
+class CropsPack:
+    """Append-only binary pack of aligned face crops.
+
+    Each record holds a face ID and the raw ``ALIGNED_CROP_SIZE`` squared
+    RGB crop, so every record has the same size and is located by its
+    offset. Batch jobs read the crops straight from a memory map, without
+    decoding images nor aligning faces again. Raw crops take several
+    times the size of the stored face images, which is the price of
+    skipping the decode.
+
+    The records offsets are indexed as they are read. Since records are
+    only appended, a lookup only checks the file for new records when the
+    face is not indexed yet, at most once every REFRESH_INTERVAL seconds.
+
+    Records of deleted faces are tombstoned in place, so they are no longer
+    read, but their space is only reclaimed when the pack of the task is
+    deleted.
+    """
+
+    def __init__(self, file_path: str, crop_size: int = None):
+        self.file_path: str = file_path
+        if crop_size is None:
+            crop_size = settings.ALIGNED_CROP_SIZE
+        self.crop_size: int = crop_size
+        self.crop_shape: Tuple[int, int, int] = (
+            crop_size, crop_size, CROP_CHANNELS
+        )
+        self.record_size: int = (
+            RECORD_HEADER.size + crop_size * crop_size * CROP_CHANNELS
+        )
+
+        self._lock = Lock()
+        self._data: Optional[np.memmap] = None
+        self._index: Dict[int, int] = {}
+        self._offset: int = 0
+        self._refreshed_at: float = 0
+
+    @classmethod
+    def for_task(cls, task_id: int) -> 'CropsPack':
+        return _packs.get(task_pack_path(task_id))
+
+    def __len__(self):
+        with self._lock:
+            self._refresh()
+            return len(self._index)
+
+    def __iter__(self) -> Iterator[Tuple[int, np.ndarray]]:
+        with self._lock:
+            self._refresh()
+            data = self._data
+            records = list(self._index.items())
+        for face_id, offset in records:
+            yield face_id, self._crop(data, offset)
+
+    def _crop(self, data: np.memmap, offset: int) -> np.ndarray:
+        start = offset + RECORD_HEADER.size
+        return np.asarray(
+            data[start:offset + self.record_size]
+        ).reshape(self.crop_shape)
+
+    def append(self, face_id: int, crop: np.ndarray):
+        if crop.shape != self.crop_shape:
+            raise ValueError(
+                f'Invalid crop shape {crop.shape}, expected '
+                f'{self.crop_shape}.'
+            )
+        record = RECORD_HEADER.pack(face_id) + np.ascontiguousarray(
+            crop, np.uint8
+        ).tobytes()
+        with self._lock:
+            with open(self.file_path, 'ab') as f:
+                f.write(record)
+
+    def get(self, face_id: int) -> Optional[np.ndarray]:
+        with self._lock:
+            offset = self._index.get(face_id, None)
+            if offset is None:
+                if time() - self._refreshed_at < REFRESH_INTERVAL:
+                    return None
+                self._refresh()
+                offset = self._index.get(face_id, None)
+                if offset is None:
+                    return None
+            return self._crop(self._data, offset)
+
+    def remove(self, face_id: int):
+        """Tombstone the record of a deleted face."""
+        with self._lock:
+            self._refresh()
+            offset = self._index.pop(face_id, None)
+            if offset is None:
+                return
+            with open(self.file_path, 'r+b') as f:
+                f.seek(offset)
+                f.write(RECORD_HEADER.pack(TOMBSTONE_ID))
+
+    def iter_batches(
+        self,
+        batch_size: int = 64
+    ) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        face_ids: List[int] = []
+        crops: List[np.ndarray] = []
+        for face_id, crop in self:
+            face_ids.append(face_id)
+            crops.append(crop)
+            if len(face_ids) == batch_size:
+                yield np.array(face_ids), np.stack(crops)
+                face_ids, crops = [], []
+        if len(face_ids):
+            yield np.array(face_ids), np.stack(crops)
+
+    def close(self):
+        """Drop the memory map and the index, which are loaded again on
+        the next read."""
+        with self._lock:
+            self._data = None
+            self._index = {}
+            self._offset = 0
+            self._refreshed_at = 0
+
+    def delete(self):
+        self.close()
+        with self._lock:
+            if path.exists(self.file_path):
+                os.remove(self.file_path)
+
+    def _refresh(self):
+        """Index the records appended since the last refresh."""
+        self._refreshed_at = time()
+        try:
+            size = path.getsize(self.file_path)
+        except FileNotFoundError:
+            size = 0
+
+        if size < self._offset:
+            # The pack was deleted and written again
+            self._index = {}
+            self._offset = 0
+        if size == 0:
+            self._data = None
+            return
+        if size == self._offset and self._data is not None:
+            return
+
+        data = np.memmap(self.file_path, dtype=np.uint8, mode='r')
+        # A record still being written is indexed on a later refresh
+        end = size - (size - self._offset) % self.record_size
+        for offset in range(self._offset, end, self.record_size):
+            face_id, = RECORD_HEADER.unpack(
+                data[offset:offset + RECORD_HEADER.size].tobytes()
+            )
+            if face_id != TOMBSTONE_ID:
+                self._index[face_id] = offset
+
+        self._data = data
+        self._offset = end
+
+
+class _PacksRegistry:
+    """Open packs of the current process, the least recently used ones are
+    closed when there are more than ``max_size``."""
+
+    def __init__(self, max_size: int):
+        self.max_size: int = max_size
+        self._packs: OrderedDict = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._packs)
+
+    def get(self, file_path: str) -> CropsPack:
+        evicted = []
+        with self._lock:
+            pack = self._packs.get(file_path, None)
+            if pack is None:
+                pack = CropsPack(file_path)
+                self._packs[file_path] = pack
+            self._packs.move_to_end(file_path)
+            while len(self._packs) > self.max_size:
+                _, evicted_pack = self._packs.popitem(last=False)
+                evicted.append(evicted_pack)
+
+        for evicted_pack in evicted:
+            evicted_pack.close()
+        return pack
+
+    def discard(self, file_path: str):
+        with self._lock:
+            pack = self._packs.pop(file_path, None)
+        if pack is not None:
+            pack.close()
+
+
+_packs = _PacksRegistry(settings.ALIGNED_CROPS_OPEN_PACKS)
+
+
+def task_pack_path(task_id: int) -> str:
+    return path.join(
+        settings.DATA_ROOT,
+        settings.CROPS_DATA_PATH,
+        f'task_{task_id}.crops'
+    )
+
+
+def get_face_crop(face: Face) -> Optional[np.ndarray]:
+    if face.task_id is None:
+        return None
+    return CropsPack.for_task(face.task_id).get(face.pk)
+
+
+def remove_face_crop(face: Face):
+    if face.task_id is not None:
+        CropsPack.for_task(face.task_id).remove(face.pk)
+
+
+def release_task_crops(task_id: int):
+    """Close the pack of a task that stopped writing it."""
+    _packs.discard(task_pack_path(task_id))
+
+
+def delete_task_crops(task_id: int):
+    file_path = task_pack_path(task_id)
+    CropsPack.for_task(task_id).delete()
+    _packs.discard(file_path)
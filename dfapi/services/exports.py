@@ -0,0 +1,275 @@
+"""Streaming exports of large amounts of faces and subjects data.
+
+Exports are generators of ``bytes`` to be sent by a streaming response.
+Rows are read with server-side cursors and encoded in chunks, so memory
+use does not depend on the number of exported rows.
+"""
+import csv
+import struct
+from datetime import datetime
+from itertools import chain
+from os import path
+from tempfile import TemporaryFile
+from typing import IO, Iterator, List, Optional, Tuple
+
+import numpy as np
+from django.core.files.storage import default_storage
+from django.db.models import Q, QuerySet
+from django.http import HttpRequest
+from django.utils import timezone
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+
+from ..models import Face
+
+EMBEDDINGS_MAGIC = b'DNFE'
+EMBEDDINGS_FORMAT_VERSION = 1
+EMBEDDINGS_HEADER = struct.Struct('<4sIII')
+
+EXPORT_CHUNK_SIZE = 2000
+
+NO_SUBJECT = -1
+
+
+def embeddings_dtype(dim: int) -> np.dtype:
+    """Record of the embeddings export: face id, subject id or -1, and the
+    little endian float32 embeddings."""
+    return np.dtype([
+        ('face', '<i8'),
+        ('subject', '<i8'),
+        ('embeddings', '<f4', (dim,))
+    ])
+
+
+def embeddings_header(dim: int, version: str) -> bytes:
+    """Magic bytes, format version, embeddings dimension and encoder
+    version length as little endian uint32, followed by the encoder
+    version in utf-8."""
+    version = version.encode('utf-8')
+    return EMBEDDINGS_HEADER.pack(
+        EMBEDDINGS_MAGIC,
+        EMBEDDINGS_FORMAT_VERSION,
+        dim,
+        len(version)
+    ) + version
+
+
+def faces_embeddings(
+    queryset: QuerySet,
+    version: str,
+    chunk_size: int = EXPORT_CHUNK_SIZE
+) -> Iterator[Tuple[int, Optional[int], bytes]]:
+    """Face id, subject id and embeddings bytes of the faces encoded with
+    ``version``, in primary key order."""
+    faces = queryset.filter(
+        Q(embeddings_version=version, embeddings_bytes__isnull=False) |
+        Q(
+            next_embeddings_version=version,
+            next_embeddings_bytes__isnull=False
+        )
+    ).order_by('pk').values_list(
+        'id',
+        'subject_id',
+        'embeddings_version',
+        'embeddings_bytes',
+        'next_embeddings_bytes'
+    )
+    for (
+        face_id, subject_id, embeddings_version, embeddings_bytes,
+        next_embeddings_bytes
+    ) in faces.iterator(chunk_size=chunk_size):
+        if embeddings_version == version and embeddings_bytes is not None:
+            yield face_id, subject_id, bytes(embeddings_bytes)
+        else:
+            yield face_id, subject_id, bytes(next_embeddings_bytes)
+
+
+def stream_embeddings(
+    queryset: QuerySet,
+    version: str,
+    chunk_size: int = EXPORT_CHUNK_SIZE
+) -> Iterator[bytes]:
+    """Encode the faces embeddings as a header followed by fixed size
+    records, see ``embeddings_dtype``.
+
+    The dimension is taken from the first face, faces with embeddings of
+    another size are skipped.
+    """
+    rows = faces_embeddings(queryset, version, chunk_size)
+
+    first = next(rows, None)
+    if first is None:
+        yield embeddings_header(0, version)
+        return
+
+    dim = len(first[2]) // 4
+    dtype = embeddings_dtype(dim)
+    yield embeddings_header(dim, version)
+
+    records = np.zeros(chunk_size, dtype)
+    count = 0
+    for face_id, subject_id, embeddings in chain([first], rows):
+        if len(embeddings) != 4 * dim:
+            continue
+        record = records[count]
+        record['face'] = face_id
+        record['subject'] = NO_SUBJECT if subject_id is None else subject_id
+        record['embeddings'] = np.frombuffer(embeddings, np.float32)
+        count += 1
+        if count == chunk_size:
+            yield records.tobytes()
+            count = 0
+
+    if count:
+        yield records[0:count].tobytes()
+
+
+def read_embeddings(data: bytes) -> Tuple[str, np.ndarray]:
+    """Decode an embeddings export into its encoder version and records."""
+    magic, format_version, dim, version_size = EMBEDDINGS_HEADER.unpack_from(
+        data
+    )
+    if magic != EMBEDDINGS_MAGIC:
+        raise ValueError('Invalid embeddings export.')
+    if format_version != EMBEDDINGS_FORMAT_VERSION:
+        raise ValueError(
+            f'Unsupported embeddings export version {format_version}.'
+        )
+
+    offset = EMBEDDINGS_HEADER.size
+    version = data[offset:offset + version_size].decode('utf-8')
+    offset += version_size
+    records = np.frombuffer(data, embeddings_dtype(dim), offset=offset)
+    return version, records
+
+
+def export_faces(params) -> QuerySet:
+    """Faces selected by the export query parameters."""
+    queryset = Face.objects.all()
+
+    subjects = params.getlist('subjects', None)
+    if subjects is not None and len(subjects):
+        queryset = queryset.filter(subject__in=subjects)
+
+    tasks = params.getlist('tasks', None)
+    if tasks is not None and len(tasks):
+        queryset = queryset.filter(task__in=tasks)
+
+    after = params.get('after', None)
+    if after is not None:
+        queryset = queryset.filter(pk__gt=int(after))
+
+    return queryset
+
+
+# Title and query column of each subjects export column
+SUBJECTS_COLUMNS = {
+    'id': ('Id', 'id'),
+    'image': ('Image', 'cover_face__image'),
+    'created_at': ('Created at', 'created_at'),
+    'pred_sex': ('Predicted sex', 'pred_sex'),
+    'pred_age': ('Predicted age', 'pred_age')
+}
+
+
+def subjects_columns(columns: List[str] = None) -> List[str]:
+    if columns is None or not len(columns):
+        return list(SUBJECTS_COLUMNS)
+    invalid = set(columns) - set(SUBJECTS_COLUMNS)
+    if len(invalid):
+        raise ValueError(f'Invalid columns {sorted(invalid)}.')
+    return [column for column in SUBJECTS_COLUMNS if column in columns]
+
+
+def subjects_rows(
+    queryset: QuerySet,
+    columns: List[str],
+    chunk_size: int = EXPORT_CHUNK_SIZE
+) -> Iterator[tuple]:
+    """Values of the export columns of every subject, with the cover image
+    joined, read with a server-side cursor."""
+    values = queryset.values_list(
+        *[SUBJECTS_COLUMNS[column][1] for column in columns]
+    )
+    return values.iterator(chunk_size=chunk_size)
+
+
+def naive_datetime(value: datetime) -> datetime:
+    if timezone.is_aware(value):
+        value = timezone.localtime(value).replace(tzinfo=None)
+    return value
+
+
+def image_url(request: HttpRequest, name: str) -> str:
+    return request.build_absolute_uri(default_storage.url(name))
+
+
+class _Echo:
+    """File-like object returning what is written, for csv writers."""
+
+    def write(self, value):
+        return value
+
+
+def stream_subjects_csv(
+    queryset: QuerySet,
+    request: HttpRequest,
+    columns: List[str] = None
+) -> Iterator[str]:
+    columns = subjects_columns(columns)
+    image_ind = columns.index('image') if 'image' in columns else None
+    writer = csv.writer(_Echo())
+
+    yield writer.writerow([SUBJECTS_COLUMNS[column][0] for column in columns])
+
+    for row in subjects_rows(queryset, columns):
+        row = list(row)
+        if image_ind is not None:
+            name = row[image_ind]
+            row[image_ind] = image_url(request, name) if name else ''
+        yield writer.writerow([
+            value.isoformat() if isinstance(value, datetime) else value
+            for value in row
+        ])
+
+
+def subjects_xlsx(
+    queryset: QuerySet,
+    request: HttpRequest,
+    title: str = 'Subjects',
+    columns: List[str] = None
+) -> IO:
+    """Write the subjects to a temporary xlsx file, open at its start.
+
+    The workbook is write-only, so rows are flushed to disk as they are
+    added instead of being kept in memory. It is still written completely
+    before the first byte is sent, since it is a zip archive, so large
+    exports are streamed with ``stream_subjects_csv`` instead.
+    """
+    columns = subjects_columns(columns)
+
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet(title)
+    worksheet.append([SUBJECTS_COLUMNS[column][0] for column in columns])
+
+    for row in subjects_rows(queryset, columns):
+        cells = []
+        for column, value in zip(columns, row):
+            if column == 'image':
+                cell = WriteOnlyCell(
+                    worksheet,
+                    value=path.basename(value) if value else ''
+                )
+                if value:
+                    cell.hyperlink = image_url(request, value)
+            else:
+                if isinstance(value, datetime):
+                    value = naive_datetime(value)
+                cell = WriteOnlyCell(worksheet, value=value)
+            cells.append(cell)
+        worksheet.append(cells)
+
+    xlsx_file = TemporaryFile()
+    workbook.save(xlsx_file)
+    xlsx_file.seek(0)
+    return xlsx_file
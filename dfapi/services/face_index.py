@@ -0,0 +1,599 @@
+import hashlib
+import logging
+from os import path
+from threading import Lock
+from time import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Max, Q
+
+from ..models import (
+    EncoderVersion,
+    Face,
+    Subject,
+    SubjectSegment,
+    Task,
+    VTaskConfig
+)
+
+logger_name = settings.LOGGER_NAME
+logger = logging.getLogger(logger_name)
+
+INDEX_FILENAME = 'face_index.npz'
+
+BIRTHDATE_BUCKET_DAYS = 5 * 365
+TIMESTAMP_BUCKET_SECONDS = 7 * 24 * 3600
+
+ATTR_NAMING = 'naming'
+ATTR_SEX = 'sex'
+ATTR_SKIN = 'skin'
+ATTR_BIRTHDATE = 'birthdate'
+ATTR_TIMESTAMP = 'timestamp'
+ATTR_TASK = 'task'
+ATTR_CAMERA = 'camera'
+ATTR_VIDEO = 'video'
+
+UNKNOWN_BIRTHDATE = -1
+
+INDEX_GENERATION_KEY = 'face_index:generation'
+
+# Faces below the last indexed one that are checked again when new faces
+# are appended, since concurrent inserts may commit out of order
+APPEND_LOOKBACK = 1000
+
+# Appended parts are merged together when there are more of them, and
+# into the saved index when they hold more faces
+MAX_APPENDED_PARTS = 16
+MAX_APPENDED_FACES = 50000
+
+# Key of a shard and keys of all the shards
+Shard = Optional[Tuple[int, Tuple[int, ...]]]
+
+
+def _mix(values: np.ndarray) -> np.ndarray:
+    """Scramble 64 bit integers, splitmix64 finalizer."""
+    values = values ^ (values >> np.uint64(30))
+    values = values * np.uint64(0xBF58476D1CE4E5B9)
+    values = values ^ (values >> np.uint64(27))
+    values = values * np.uint64(0x94D049BB133111EB)
+    return values ^ (values >> np.uint64(31))
+
+
+def shard_of(subjects: np.ndarray, shard_keys: Iterable[int]) -> np.ndarray:
+    """Key of the shard that holds each subject.
+
+    Subjects are assigned by rendezvous hashing: each one goes to the shard
+    with the highest hash of the subject and the shard key. Adding or
+    removing a shard only moves the subjects that belong to that shard.
+    """
+    shard_keys = np.asarray(list(shard_keys), np.int64)
+    subjects = _mix(np.asarray(subjects, np.int64).astype(np.uint64))
+    with np.errstate(over='ignore'):
+        weights = np.vstack([
+            _mix(subjects ^ _mix(np.array([key], np.uint64)))
+            for key in shard_keys.astype(np.uint64)
+        ])
+    return shard_keys[np.argmax(weights, axis=0)]
+
+
+def birthdate_bucket(ordinal: int) -> int:
+    return ordinal // BIRTHDATE_BUCKET_DAYS
+
+
+def timestamp_bucket(timestamp: float) -> int:
+    return int(timestamp // TIMESTAMP_BUCKET_SECONDS)
+
+
+class FaceIndex:
+    """Global index of the recognizable faces with per attribute bitmaps.
+
+    Every face with embeddings of the active encoder version is a row of a
+    single embeddings matrix. For each value of a filterable attribute the
+    index keeps a packed bitmap of the rows having that value, so segment
+    filters are evaluated as bitmap unions and intersections instead of
+    database queries. Range filters use bucket bitmaps to prune the rows
+    and the exact columns to refine the rows of the boundary buckets.
+
+    ``last_face`` is the last face ID the index was built up to, faces
+    added after it are indexed apart and appended.
+    """
+
+    def __init__(
+        self,
+        version: str,
+        embeddings: np.ndarray,
+        faces: np.ndarray,
+        subjects: np.ndarray,
+        birthdates: np.ndarray,
+        timestamps: np.ndarray,
+        bitmaps: Dict[str, Dict[str, np.ndarray]],
+        last_face: int = 0
+    ):
+        self.version: str = version
+        self.embeddings: np.ndarray = embeddings
+        self.faces: np.ndarray = faces
+        self.subjects: np.ndarray = subjects
+        self.birthdates: np.ndarray = birthdates
+        self.timestamps: np.ndarray = timestamps
+        self.bitmaps: Dict[str, Dict[str, np.ndarray]] = bitmaps
+        self.last_face: int = last_face
+
+    def __len__(self):
+        return len(self.faces)
+
+    @classmethod
+    def build(
+        cls,
+        version: str,
+        shard: Shard = None,
+        faces_filter: Q = None,
+        last_face: int = None
+    ) -> 'FaceIndex':
+        """Build the index from the database.
+
+        When ``shard`` is given as ``(shard_key, shard_keys)`` only the
+        faces of the subjects assigned to that shard are indexed. When
+        ``faces_filter`` is given only the matching faces are indexed, up
+        to ``last_face``.
+        """
+        if last_face is None:
+            # Read first, faces added while building are appended later
+            last_face = Face.objects.aggregate(last=Max('id'))['last'] or 0
+
+        tasks = Task.objects.all()
+        if faces_filter is not None:
+            tasks = tasks.filter(faces__in=Face.objects.filter(faces_filter))
+        tasks_sources = {}
+        for task_id, config in tasks.distinct().values_list('id', 'config'):
+            config = VTaskConfig(**(config or {}))
+            tasks_sources[task_id] = (
+                config.video_source_type,
+                config.video_source_id
+            )
+
+        encoder_version = EncoderVersion.active_version()
+        faces = Face.objects.filter(
+            Face.version_filter(encoder_version),
+            subject__isnull=False
+        )
+        if faces_filter is not None:
+            faces = faces.filter(faces_filter)
+        faces = faces.annotate(
+            version_embeddings_bytes=Face.version_embeddings(encoder_version)
+        )
+
+        shard_subjects = None
+        if shard is not None:
+            shard_key, shard_keys = shard
+            subjects_ids = np.array(
+                faces.values_list('subject_id', flat=True).distinct(),
+                np.int64
+            )
+            shard_subjects = set(subjects_ids[
+                shard_of(subjects_ids, shard_keys) == shard_key
+            ].tolist())
+
+        faces = faces.order_by('pk').values_list(
+            'id',
+            'subject_id',
+            'task_id',
+            'version_embeddings_bytes',
+            'subject__name',
+            'subject__last_name',
+            'subject__sex',
+            'subject__skin',
+            'subject__birthdate',
+            'subject__created_at'
+        )
+
+        embeddings = []
+        faces_ids = []
+        subjects = []
+        birthdates = []
+        timestamps = []
+        values = {
+            attr: [] for attr in (
+                ATTR_NAMING,
+                ATTR_SEX,
+                ATTR_SKIN,
+                ATTR_BIRTHDATE,
+                ATTR_TIMESTAMP,
+                ATTR_TASK,
+                ATTR_CAMERA,
+                ATTR_VIDEO
+            )
+        }
+
+        for (
+            face_id, subject_id, task_id, embeddings_bytes, name, last_name,
+            sex, skin, birthdate, created_at
+        ) in faces.iterator():
+            if shard_subjects is not None and subject_id not in shard_subjects:
+                continue
+            embeddings.append(np.frombuffer(embeddings_bytes, np.float32))
+            faces_ids.append(face_id)
+            subjects.append(subject_id)
+
+            birthdate = (
+                birthdate.toordinal() if birthdate is not None
+                else UNKNOWN_BIRTHDATE
+            )
+            timestamp = created_at.timestamp()
+            birthdates.append(birthdate)
+            timestamps.append(timestamp)
+
+            source_type, source_id = tasks_sources.get(task_id, ('', None))
+            values[ATTR_NAMING].append(
+                SubjectSegment.NAMING_NAMED if name or last_name
+                else SubjectSegment.NAMING_UNNAMED
+            )
+            values[ATTR_SEX].append(sex)
+            values[ATTR_SKIN].append(skin)
+            values[ATTR_BIRTHDATE].append(
+                birthdate_bucket(birthdate) if birthdate != UNKNOWN_BIRTHDATE
+                else None
+            )
+            values[ATTR_TIMESTAMP].append(timestamp_bucket(timestamp))
+            values[ATTR_TASK].append(task_id)
+            values[ATTR_CAMERA].append(
+                source_id if source_type == VTaskConfig.VIDEO_SOURCE_CAMERA
+                else None
+            )
+            values[ATTR_VIDEO].append(
+                source_id if source_type == VTaskConfig.VIDEO_SOURCE_RECORD
+                else None
+            )
+
+        bitmaps = {}
+        for attr, attr_values in values.items():
+            attr_values = np.array(
+                [
+                    '' if value is None else str(value)
+                    for value in attr_values
+                ],
+                dtype=str
+            )
+            bitmaps[attr] = {
+                str(value): np.packbits(attr_values == value)
+                for value in np.unique(attr_values) if value
+            }
+
+        return cls(
+            version=version,
+            embeddings=np.array(embeddings, np.float32),
+            faces=np.array(faces_ids, np.int64),
+            subjects=np.array(subjects, np.int32),
+            birthdates=np.array(birthdates, np.int32),
+            timestamps=np.array(timestamps, np.float64),
+            bitmaps=bitmaps,
+            last_face=last_face
+        )
+
+    @classmethod
+    def concat(cls, indexes: List['FaceIndex']) -> 'FaceIndex':
+        """Index of the rows of ``indexes``, in order."""
+        last_face = max(index.last_face for index in indexes)
+        version = indexes[-1].version
+        indexes = [index for index in indexes if len(index)] or indexes[:1]
+
+        bitmaps = {}
+        for attr in {attr for index in indexes for attr in index.bitmaps}:
+            values = {
+                value for index in indexes
+                for value in index.bitmaps.get(attr, {})
+            }
+            bitmaps[attr] = {
+                value: np.packbits(np.hstack([
+                    index.unpacked_bitmap(attr, value) for index in indexes
+                ]))
+                for value in values
+            }
+
+        return cls(
+            version=version,
+            embeddings=np.vstack([index.embeddings for index in indexes]),
+            faces=np.hstack([index.faces for index in indexes]),
+            subjects=np.hstack([index.subjects for index in indexes]),
+            birthdates=np.hstack([index.birthdates for index in indexes]),
+            timestamps=np.hstack([index.timestamps for index in indexes]),
+            bitmaps=bitmaps,
+            last_face=last_face
+        )
+
+    def unpacked_bitmap(self, attr: str, value: str) -> np.ndarray:
+        bitmap = self.bitmaps.get(attr, {}).get(value, None)
+        if bitmap is None:
+            return np.zeros(len(self), np.bool_)
+        return np.unpackbits(bitmap)[:len(self)].astype(np.bool_)
+
+    @classmethod
+    def load(cls, file_path: str) -> Optional['FaceIndex']:
+        if not path.exists(file_path):
+            return None
+        bitmaps = {}
+        with np.load(file_path) as data:
+            for key in data.files:
+                if key.startswith('bitmap:'):
+                    _, attr, value = key.split(':', 2)
+                    bitmaps.setdefault(attr, {})[value] = data[key]
+            return cls(
+                version=str(data['version']),
+                embeddings=data['embeddings'],
+                faces=data['faces'],
+                subjects=data['subjects'],
+                birthdates=data['birthdates'],
+                timestamps=data['timestamps'],
+                bitmaps=bitmaps,
+                last_face=int(data['last_face'])
+            )
+
+    def save(self, file_path: str):
+        data = {
+            'version': np.array(self.version),
+            'embeddings': self.embeddings,
+            'faces': self.faces,
+            'subjects': self.subjects,
+            'birthdates': self.birthdates,
+            'timestamps': self.timestamps,
+            'last_face': np.array(self.last_face)
+        }
+        for attr, attr_bitmaps in self.bitmaps.items():
+            for value, bitmap in attr_bitmaps.items():
+                data[f'bitmap:{attr}:{value}'] = bitmap
+        np.savez(file_path, **data)
+
+    def _union(self, attr: str, values: Iterable) -> np.ndarray:
+        attr_bitmaps = self.bitmaps.get(attr, {})
+        packed = np.zeros((len(self) + 7) // 8, np.uint8)
+        for value in values:
+            bitmap = attr_bitmaps.get(str(value), None)
+            if bitmap is not None:
+                packed |= bitmap
+        return packed
+
+    def _buckets_union(
+        self,
+        attr: str,
+        min_bucket: Optional[int],
+        max_bucket: Optional[int]
+    ) -> np.ndarray:
+        buckets = [int(value) for value in self.bitmaps.get(attr, {})]
+        return self._union(attr, [
+            bucket for bucket in buckets
+            if (min_bucket is None or bucket >= min_bucket) and
+            (max_bucket is None or bucket <= max_bucket)
+        ])
+
+    def segment_mask(self, segment: SubjectSegment) -> np.ndarray:
+        """Boolean mask of the rows matched by the filters of ``segment``.
+
+        Segments do not need to be saved, so ad-hoc filters are evaluated
+        the same way as stored segments.
+        """
+        packed = np.packbits(np.ones(len(self), np.bool_))
+
+        if segment.naming in (
+            SubjectSegment.NAMING_NAMED,
+            SubjectSegment.NAMING_UNNAMED
+        ):
+            packed &= self._union(ATTR_NAMING, [segment.naming])
+        if segment.sex:
+            packed &= self._union(ATTR_SEX, [segment.sex])
+        if segment.skin:
+            packed &= self._union(ATTR_SKIN, [segment.skin])
+
+        tasks, cameras, videos = [], [], []
+        try:
+            tasks = [task.pk for task in segment.tasks.all()]
+            cameras = [camera.pk for camera in segment.cameras.all()]
+            videos = [video.pk for video in segment.videos.all()]
+        except ValueError:
+            pass
+
+        if len(tasks):
+            packed &= self._union(ATTR_TASK, tasks)
+        elif len(cameras):
+            packed &= self._union(ATTR_CAMERA, cameras)
+        elif len(videos):
+            packed &= self._union(ATTR_VIDEO, videos)
+
+        min_timestamp = max_timestamp = None
+        if segment.min_timestamp is not None:
+            min_timestamp = segment.min_timestamp.timestamp()
+        if segment.max_timestamp is not None:
+            max_timestamp = segment.max_timestamp.timestamp()
+        if min_timestamp is not None or max_timestamp is not None:
+            packed &= self._buckets_union(
+                ATTR_TIMESTAMP,
+                None if min_timestamp is None else timestamp_bucket(min_timestamp),
+                None if max_timestamp is None else timestamp_bucket(max_timestamp)
+            )
+
+        min_birthdate = max_birthdate = None
+        if segment.min_birthdate is not None:
+            min_birthdate = segment.min_birthdate.toordinal()
+        if segment.max_birthdate is not None:
+            max_birthdate = segment.max_birthdate.toordinal()
+        if min_birthdate is not None or max_birthdate is not None:
+            packed &= self._buckets_union(
+                ATTR_BIRTHDATE,
+                None if min_birthdate is None else birthdate_bucket(min_birthdate),
+                None if max_birthdate is None else birthdate_bucket(max_birthdate)
+            )
+
+        mask = np.unpackbits(packed)[:len(self)].astype(np.bool_)
+
+        # Refine the rows of the boundary buckets with the exact values
+        rows = np.flatnonzero(mask)
+        keep = np.ones(len(rows), np.bool_)
+        if min_timestamp is not None:
+            keep &= self.timestamps[rows] > min_timestamp
+        if max_timestamp is not None:
+            keep &= self.timestamps[rows] < max_timestamp
+        if min_birthdate is not None:
+            keep &= self.birthdates[rows] > min_birthdate
+        if max_birthdate is not None:
+            keep &= self.birthdates[rows] < max_birthdate
+
+        # Free text filters can not be indexed, so they are resolved to
+        # subjects by the database.
+        if segment.name or segment.last_name:
+            subjects = Subject.objects.all()
+            if segment.name:
+                subjects = subjects.filter(name__icontains=segment.name)
+            if segment.last_name:
+                subjects = subjects.filter(
+                    last_name__icontains=segment.last_name
+                )
+            keep &= np.isin(
+                self.subjects[rows],
+                np.array(subjects.values_list('id', flat=True), np.int32)
+            )
+
+        mask[rows[~keep]] = False
+        return mask
+
+    def segments_data(self, segments) -> Tuple[np.ndarray, np.ndarray]:
+        mask = np.zeros(len(self), np.bool_)
+        for segment in segments:
+            mask |= self.segment_mask(segment)
+        return self.embeddings[mask], self.subjects[mask]
+
+
+class FaceIndexParts:
+    """A face index followed by the indexes of the faces appended to it,
+    searched as a single index."""
+
+    def __init__(self, parts: List[FaceIndex]):
+        self.parts: List[FaceIndex] = parts
+
+    def __len__(self):
+        return sum(len(part) for part in self.parts)
+
+    def segments_data(self, segments) -> Tuple[np.ndarray, np.ndarray]:
+        embeddings = []
+        subjects = []
+        for part in self.parts:
+            part_embeddings, part_subjects = part.segments_data(segments)
+            if len(part_subjects):
+                embeddings.append(part_embeddings)
+                subjects.append(part_subjects)
+        if not len(subjects):
+            return np.zeros((0, 0), np.float32), np.zeros(0, np.int32)
+        return np.vstack(embeddings), np.hstack(subjects)
+
+
+def index_generation() -> int:
+    # A new cache starts from the current time, so that indexes saved
+    # before it are not taken as up to date.
+    return cache.get_or_set(
+        INDEX_GENERATION_KEY,
+        lambda: int(time() * 1000),
+        None
+    )
+
+
+def invalidate_face_index():
+    """Rebuild the face index on its next use, after indexed faces or
+    subjects change or are deleted. New faces are appended instead."""
+    try:
+        cache.incr(INDEX_GENERATION_KEY)
+    except ValueError:
+        index_generation()
+
+
+def index_version() -> str:
+    return f'{EncoderVersion.active_version()}|{index_generation()}'
+
+
+def index_path(shard: Shard = None) -> str:
+    filename = INDEX_FILENAME
+    if shard is not None:
+        shard_key, shard_keys = shard
+        keys = '_'.join(str(key) for key in sorted(shard_keys))
+        keys_hash = hashlib.sha1(keys.encode('utf-8')).hexdigest()[:12]
+        filename = f'face_index_{shard_key}_of_{keys_hash}.npz'
+    return path.join(
+        settings.DATA_ROOT,
+        settings.MODELS_DATA_PATH,
+        filename
+    )
+
+
+class _IndexHolder:
+
+    def __init__(self, shard: Shard = None):
+        self.shard: Shard = shard
+        self._parts: List[FaceIndex] = []
+        self._lock = Lock()
+
+    def get(self) -> FaceIndexParts:
+        version = index_version()
+        last_face = Face.objects.aggregate(last=Max('id'))['last'] or 0
+        with self._lock:
+            if not len(self._parts) or self._parts[0].version != version:
+                self._parts = [self._load(version)]
+            if last_face > self._parts[-1].last_face:
+                self._append(version, last_face)
+            return FaceIndexParts(list(self._parts))
+
+    def _load(self, version: str) -> FaceIndex:
+        file_path = index_path(self.shard)
+        index = None
+        try:
+            index = FaceIndex.load(file_path)
+        except (OSError, ValueError, KeyError) as err:
+            logger.error(err)
+
+        if index is None or index.version != version:
+            index = FaceIndex.build(version, self.shard)
+            index.save(file_path)
+        return index
+
+    def _append(self, version: str, last_face: int):
+        """Index the faces added since the last part was built."""
+        previous = self._parts[-1].last_face
+        since = max(previous - APPEND_LOOKBACK, 0)
+        recent = np.array(
+            Face.objects.filter(
+                pk__gt=since,
+                pk__lte=previous
+            ).values_list('id', flat=True),
+            np.int64
+        )
+        indexed = np.hstack([part.faces for part in self._parts])
+        missing = recent[~np.isin(recent, indexed[indexed > since])]
+
+        faces_filter = Q(pk__gt=previous, pk__lte=last_face)
+        if len(missing):
+            faces_filter |= Q(pk__in=missing.tolist())
+        self._parts.append(FaceIndex.build(
+            version,
+            self.shard,
+            faces_filter=faces_filter,
+            last_face=last_face
+        ))
+
+        appended = self._parts[1:]
+        if sum(len(part) for part in appended) > MAX_APPENDED_FACES:
+            index = FaceIndex.concat(self._parts)
+            index.save(index_path(self.shard))
+            self._parts = [index]
+        elif len(appended) > MAX_APPENDED_PARTS:
+            self._parts = [self._parts[0], FaceIndex.concat(appended)]
+
+
+_holders: Dict[Shard, _IndexHolder] = {}
+_holders_lock = Lock()
+
+
+def get_face_index(shard: Shard = None) -> FaceIndexParts:
+    with _holders_lock:
+        holder = _holders.get(shard, None)
+        if holder is None:
+            holder = _IndexHolder(shard)
+            _holders[shard] = holder
+    return holder.get()
@@ -5,21 +5,30 @@ from multiprocessing import Process, Queue
 from os import path
 from queue import Empty as QueueEmptyError
 from queue import Full as QueueFullError
-from typing import List
+from typing import Iterable, List, Optional, Tuple
 
 import cv2 as cv
 import numpy as np
 from django import db
 from django.conf import settings
-from django.db.models import QuerySet
+from django.db import transaction
+from django.db.models import QuerySet, F
+from django.utils import timezone
 from dnfal.alignment import FaceAligner
 from dnfal.genderage import GenderAgePredictor
 from dnfal.settings import Settings
 from dnfal.vision import FacesVision
 from openpyxl import Workbook
 
+from .. import quantization
+from . import prototypes, shards
+from .crops import get_face_crop
 from .exceptions import ServiceError
+from .face_index import get_face_index
+from .notifications import recognition_notificate
+from .recognition_cache import data_version, recognition_cache, recognition_key
 from ..models import (
+    EncoderVersion,
     Face,
     Frame,
     Recognition,
@@ -39,10 +48,16 @@ def predict_genderage(
     face_aligner: FaceAligner
 ):
 
-    faces = Face.objects.filter(pk__in=faces_id)
+    faces = list(Face.objects.filter(pk__in=faces_id))
     faces_images = []
     faces_inds = []
-    for ind, face in faces:
+    for ind, face in enumerate(faces):
+        face_image_align = get_face_crop(face)
+        if face_image_align is not None:
+            faces_images.append(face_image_align)
+            faces_inds.append(ind)
+            continue
+
         face_image = face.image
         landmarks = face.landmarks
         if face_image is not None and len(landmarks):
@@ -80,7 +95,10 @@ def analyze_face(face_id: int, faces_vision: FacesVision):
         return face
 
     face.box = detected_faces[0].box
-    face.embeddings = detected_faces[0].embeddings
+    face.set_embeddings(
+        detected_faces[0].embeddings,
+        settings.DNFAL_ENCODER_VERSION
+    )
     face.landmarks = detected_faces[0].landmarks
 
     face.save()
@@ -103,26 +121,107 @@ def analyze_frame(frame_id: int, faces_vision: FacesVision):
         full_path = path.join(settings.MEDIA_ROOT, rel_path)
         cv.imwrite(full_path, face.image)
 
-        face_objects.append(Face.objects.create(
+        face_object = Face(
             frame=frame,
             image=rel_path,
+            size_bytes=path.getsize(full_path),
             box=face.box,
-            embeddings=face.embeddings,
             landmarks=face.landmarks,
-        ))
-
+        )
+        face_object.set_embeddings(
+            face.embeddings,
+            settings.DNFAL_ENCODER_VERSION
+        )
+        face_object.save()
+        face_objects.append(face_object)
 
-def recognize_face(
-    recognition_id: int,
-    faces_vision: FacesVision
-):
-    recognition: Recognition = Recognition.objects.get(pk=recognition_id)
 
-    face_embeddings = recognition.face.embeddings.reshape((1, -1))
+def segments_data(segments) -> Tuple[np.ndarray, np.ndarray]:
+    if settings.RECOGNITION_FACE_INDEX:
+        return get_face_index().segments_data(segments)
 
     subjects_embeddings = []
     subjects = []
 
+    for segment in segments:
+        segment_embeddings, segment_subjects = segment.get_data()
+        subjects_embeddings.append(segment_embeddings)
+        subjects.append(segment_subjects)
+
+    if len(segments) > 1:
+        subjects_embeddings = np.vstack(subjects_embeddings)
+        subjects = np.hstack(subjects)
+    else:
+        subjects_embeddings = subjects_embeddings[0]
+        subjects = subjects[0]
+
+    return subjects_embeddings, subjects
+
+
+def segments_candidates(
+    queries: np.ndarray,
+    segments,
+    count: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Scan the quantized segments data and return the full precision
+    embeddings and subjects of the ``count`` best candidates of each query,
+    a row of ``queries``. The queries are scanned in a single pass and the
+    vectors of the union of their candidates are fetched at once."""
+    codes, scales, norms, subjects, faces = [], [], [], [], []
+
+    for segment in segments:
+        data = segment.get_quantized_data()
+        if len(data['faces']):
+            codes.append(data['codes'])
+            scales.append(data['scales'])
+            norms.append(data['norms'])
+            subjects.append(data['subjects'])
+            faces.append(data['faces'])
+
+    if not len(faces):
+        return np.zeros((0, 0), np.float32), np.zeros(0, np.int32)
+
+    queries = np.asarray(queries, np.float32)
+    similarities = quantization.scan(
+        queries.reshape((-1, queries.shape[-1])),
+        np.vstack(codes),
+        np.hstack(scales),
+        np.hstack(norms)
+    )
+    inds = np.unique(np.concatenate([
+        quantization.top_candidates(query_similarities, count)
+        for query_similarities in similarities
+    ]))
+    subjects = np.hstack(subjects)[inds]
+    faces = np.hstack(faces)[inds]
+
+    version = EncoderVersion.active_version()
+    embeddings_bytes = dict(
+        Face.objects.filter(
+            Face.version_filter(version),
+            pk__in=faces.tolist()
+        ).annotate(
+            version_embeddings_bytes=Face.version_embeddings(version)
+        ).values_list('id', 'version_embeddings_bytes')
+    )
+
+    candidates_embeddings = []
+    candidates_subjects = []
+    for face_id, subject_id in zip(faces, subjects):
+        face_embeddings_bytes = embeddings_bytes.get(int(face_id), None)
+        if face_embeddings_bytes is not None:
+            candidates_embeddings.append(
+                np.frombuffer(face_embeddings_bytes, np.float32)
+            )
+            candidates_subjects.append(subject_id)
+
+    return (
+        np.array(candidates_embeddings, np.float32),
+        np.array(candidates_subjects, np.int32)
+    )
+
+
+def recognition_segments(recognition: Recognition):
     segments = recognition.segments.all()
 
     # if len(segments) == 0 and recognition.filter is not None:
@@ -141,20 +240,82 @@ def recognize_face(
         )
         segments = [segment]
 
-    for segment in segments:
-        segment_embeddings, segment_subjects = segment.get_data()
-        subjects_embeddings.append(segment_embeddings)
-        subjects.append(segment_subjects)
+    return segments
 
-    if len(segments) > 1:
-        subjects_embeddings = np.vstack(subjects_embeddings)
-        subjects = np.hstack(subjects)
+
+def recognize_face(
+    recognition_id: int,
+    faces_vision: FacesVision
+):
+    recognition: Recognition = Recognition.objects.get(pk=recognition_id)
+
+    active_version = EncoderVersion.active_version()
+    face_embeddings = recognition.face.embeddings_for(active_version)
+    if face_embeddings is None:
+        logger.warning(
+            f'Face <{recognition.face_id}> has no embeddings for the active '
+            f'encoder version "{active_version}".'
+        )
+        return
+    face_embeddings = face_embeddings.reshape((1, -1))
+
+    segments = recognition_segments(recognition)
+
+    # Read once, changes made while matching expire the stored matches
+    key = recognition_key(recognition, face_embeddings, data_version(segments))
+    cached_matches = recognition_cache.get(key)
+    if cached_matches is not None:
+        create_matches(recognition.pk, cached_matches)
+        return
+
+    segments_updates = [segment.updated_at for segment in segments]
+    matches = match_face(recognition, face_embeddings, segments, faces_vision)
+    # Matches against rebuilt segments data may be newer than the version
+    if segments_updates == [segment.updated_at for segment in segments]:
+        recognition_cache.set(key, matches)
+    create_matches(recognition.pk, matches)
+
+
+def create_matches(recognition_id: int, matches: Iterable[Tuple[int, float]]):
+    RecognitionMatch.objects.bulk_create([
+        RecognitionMatch(
+            subject_id=subject_id,
+            score=score,
+            recognition_id=recognition_id
+        )
+        for subject_id, score in matches
+    ])
+
+
+def match_face(
+    recognition: Recognition,
+    face_embeddings: np.ndarray,
+    segments,
+    faces_vision: FacesVision
+) -> List[Tuple[int, float]]:
+    if settings.RECOGNITION_SHARDING:
+        return shards.scatter_gather(
+            shards.worker_shards(faces_vision.face_matcher),
+            face_embeddings,
+            [segment.pk for segment in segments],
+            float(recognition.sim_thresh),
+            recognition.max_matches
+        )
+
+    if (
+        recognition.mode == Recognition.MODE_PROTOTYPES or
+        settings.EMBEDDINGS_QUANTIZATION
+    ):
+        subjects_embeddings, subjects = block_candidates(
+            recognition,
+            face_embeddings,
+            segments
+        )
     else:
-        subjects_embeddings = subjects_embeddings[0]
-        subjects = subjects[0]
+        subjects_embeddings, subjects = segments_data(segments)
 
     if len(subjects) == 0:
-        return [], []
+        return []
 
     faces_vision.face_matcher.similarity_threshold = float(recognition.sim_thresh)
     subject_ids, scores = faces_vision.face_matcher.match(
@@ -166,30 +327,221 @@ def recognize_face(
     subject_ids = subject_ids[0]
     scores = scores[0]
 
-    if len(subject_ids) == 0:
-        return [], []
-
     max_matches = recognition.max_matches
     if 0 < max_matches < len(subject_ids):
         subject_ids = subject_ids[0:max_matches]
         scores = scores[0:max_matches]
 
-    for subject_id, score in zip(subject_ids, scores):
-        RecognitionMatch.objects.create(
-            subject_id=subject_id,
-            score=score,
-            recognition_id=recognition.pk
+    return [
+        (int(subject_id), float(score))
+        for subject_id, score in zip(subject_ids, scores)
+    ]
+
+
+def recognize_faces(
+    recognitions_ids: List[int],
+    faces_vision: FacesVision
+):
+    """Recognize the faces of a batch of recognitions in a single pass.
+
+    Recognitions of a batch share their parameters and segments. The query
+    faces are matched in blocks of ``RECOGNITION_BATCH_BLOCK_SIZE`` rows,
+    against the segments data gathered once, or, when recognition scans
+    prototypes or quantized codes first, against the union of the
+    candidates of the block queries, searched and fetched once per block.
+    With sharding enabled each block is sent to the shards in a single
+    request.
+    """
+    recognitions = Recognition.objects.filter(
+        pk__in=recognitions_ids
+    ).select_related('face').order_by('pk')
+
+    recognition: Recognition = recognitions.first()
+    if recognition is None:
+        return
+
+    active_version = EncoderVersion.active_version()
+    queries = []
+    queries_recognitions = []
+    for instance in recognitions.iterator():
+        face_embeddings = instance.face.embeddings_for(active_version)
+        if face_embeddings is not None:
+            queries.append(face_embeddings)
+            queries_recognitions.append(instance.pk)
+
+    skipped = len(recognitions_ids) - len(queries)
+    if skipped:
+        logger.warning(
+            f'{skipped} faces have no embeddings for the active encoder '
+            f'version "{active_version}".'
         )
 
+    if len(queries) == 0:
+        return
+
+    segments = recognition_segments(recognition)
+    queries = np.array(queries, np.float32)
+    max_matches = recognition.max_matches
+    block_size = settings.RECOGNITION_BATCH_BLOCK_SIZE
+    matches = []
+
+    if settings.RECOGNITION_SHARDING:
+        recognition_shards = shards.worker_shards(faces_vision.face_matcher)
+        segments_ids = [segment.pk for segment in segments]
+        for start in range(0, len(queries), block_size):
+            stop = start + block_size
+            block_matches = shards.scatter_gather_batch(
+                recognition_shards,
+                queries[start:stop],
+                segments_ids,
+                float(recognition.sim_thresh),
+                max_matches
+            )
+            for recognition_id, query_matches in zip(
+                queries_recognitions[start:stop],
+                block_matches
+            ):
+                for subject_id, score in query_matches:
+                    matches.append(RecognitionMatch(
+                        subject_id=subject_id,
+                        score=score,
+                        recognition_id=recognition_id
+                    ))
+        RecognitionMatch.objects.bulk_create(matches, batch_size=1000)
+        return
+
+    full_scan = (
+        recognition.mode != Recognition.MODE_PROTOTYPES and
+        not settings.EMBEDDINGS_QUANTIZATION
+    )
+    if full_scan:
+        subjects_embeddings, subjects = segments_data(segments)
+        if len(subjects) == 0:
+            return
+
+    faces_vision.face_matcher.similarity_threshold = float(recognition.sim_thresh)
+    for start in range(0, len(queries), block_size):
+        stop = start + block_size
+        if not full_scan:
+            subjects_embeddings, subjects = block_candidates(
+                recognition,
+                queries[start:stop],
+                segments
+            )
+            if len(subjects) == 0:
+                continue
+
+        block_subjects, block_scores = faces_vision.face_matcher.match(
+            x_test=queries[start:stop],
+            x_train=subjects_embeddings,
+            y_train=subjects
+        )
+        for recognition_id, subject_ids, scores in zip(
+            queries_recognitions[start:stop],
+            block_subjects,
+            block_scores
+        ):
+            if 0 < max_matches < len(subject_ids):
+                subject_ids = subject_ids[0:max_matches]
+                scores = scores[0:max_matches]
+
+            for subject_id, score in zip(subject_ids, scores):
+                matches.append(RecognitionMatch(
+                    subject_id=int(subject_id),
+                    score=float(score),
+                    recognition_id=recognition_id
+                ))
+
+    RecognitionMatch.objects.bulk_create(matches, batch_size=1000)
+
+
+def block_candidates(
+    recognition: Recognition,
+    queries: np.ndarray,
+    segments
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Union of the candidates of every query of a block, selected as a
+    single recognition does, with one scan and one fetch of the vectors
+    for the whole block."""
+    if recognition.mode == Recognition.MODE_PROTOTYPES:
+        return prototypes.segments_candidates(
+            queries,
+            segments,
+            settings.RECOGNITION_PROTOTYPE_CANDIDATES
+        )
+    return segments_candidates(
+        queries,
+        segments,
+        settings.RECOGNITION_RERANK_SIZE
+    )
+
+
+def activate_encoder_version(version: str, batch_size: int = 1000):
+    """Switch recognition to the embeddings of ``version``.
+
+    The version is activated first. Since the embeddings of the active
+    version are read from the current and the staged embeddings alike,
+    faces stay recognizable while the staged embeddings are then moved
+    into place, in primary key ordered batches. Each moved face keeps its
+    previous embeddings staged, and faces without a staged replacement
+    keep their previous embeddings.
+
+    Faces ingested while ``version`` was being staged are encoded with the
+    previous version only, so they are not recognizable once it is active
+    until a re-encoding task stages them too.
+    """
+    with transaction.atomic():
+        EncoderVersion.objects.exclude(version=version).update(active=False)
+        EncoderVersion.objects.update_or_create(
+            version=version,
+            defaults={
+                'active': True,
+                'activated_at': timezone.now()
+            }
+        )
+        SubjectSegment.objects.update(updated_at=None)
+    EncoderVersion.invalidate_active_version()
+
+    # Faces that could not be re-encoded, they are retried by the next
+    # re-encoding task.
+    Face.objects.filter(
+        next_embeddings_version=version,
+        next_embeddings_bytes__isnull=True
+    ).update(next_embeddings_version='')
+
+    staged_faces = Face.objects.filter(
+        next_embeddings_version=version,
+        next_embeddings_bytes__isnull=False
+    ).order_by('pk')
+    last_pk = 0
+    while True:
+        pks = list(staged_faces.filter(
+            pk__gt=last_pk
+        ).values_list('pk', flat=True)[0:batch_size])
+        if not len(pks):
+            break
+        # Both sides are swapped in a single UPDATE, which reads the old
+        # values of the row.
+        staged_faces.filter(pk__in=pks).update(
+            embeddings_bytes=F('next_embeddings_bytes'),
+            embeddings_version=version,
+            next_embeddings_bytes=F('embeddings_bytes'),
+            next_embeddings_version=F('embeddings_version')
+        )
+        last_pk = pks[-1]
+
 
 class FaceAnalyzer:
 
     MAX_QUEUE_SIZE = 1000
     REQUEST_TIMEOUT = 30
+    BATCH_REQUEST_TIMEOUT = 120
 
     TASK_ANALYZE_FACE = 'analyze_face'
     TASK_ANALYZE_FRAME = 'analyze_frame'
     TASK_RECOGNIZE_FACE = 'recognize_face'
+    TASK_RECOGNIZE_FACES = 'recognize_faces'
+    TASK_SEARCH_SHARD = 'search_shard'
     TASK_PREDICT_GENDERAGE = 'predict_genderage'
     TASK_TERMINATE = 'terminate'
 
@@ -213,12 +565,14 @@ class FaceAnalyzer:
             )
             self.process.start()
 
-    def send_task(self, task_data: dict, timeout=None):
+    def send_task(self, task_data: dict, timeout=None, response_timeout=None):
+        if response_timeout is None:
+            response_timeout = self.REQUEST_TIMEOUT
         self.start_process()
         try:
             self.send_queue.put(task_data, timeout=timeout)
             response: dict = self.recv_queue.get(
-                timeout=self.REQUEST_TIMEOUT
+                timeout=response_timeout
             )
             if response['error'] is not None:
                 raise ServiceError(response['error'])
@@ -228,6 +582,7 @@ class FaceAnalyzer:
             raise ServiceError('Task can no be completed. Task queue is full.')
         except QueueEmptyError:
             raise ServiceError('Task result could not be retrieved. Timeout error.')
+        return response.get('result', None)
 
     def analyze_face(self, face_id: int):
         self._task_count += 1
@@ -273,6 +628,32 @@ class FaceAnalyzer:
         }
         self.send_task(task_data, timeout=self.REQUEST_TIMEOUT)
 
+    def recognize_faces(self, recognitions_ids: List[int]):
+        self._task_count += 1
+        task_data = {
+            'task_name': self.TASK_RECOGNIZE_FACES,
+            'task_id': self._task_count,
+            'kwargs': {
+                'recognitions_ids': recognitions_ids
+            }
+        }
+        self.send_task(
+            task_data,
+            timeout=self.REQUEST_TIMEOUT,
+            response_timeout=self.BATCH_REQUEST_TIMEOUT
+        )
+
+    def search_shard(self, **kwargs) -> List[Tuple[int, float]]:
+        """Search a shard of the face index with the face matcher of the
+        engine process, see ``shards.search_shard``."""
+        self._task_count += 1
+        task_data = {
+            'task_name': self.TASK_SEARCH_SHARD,
+            'task_id': self._task_count,
+            'kwargs': kwargs
+        }
+        return self.send_task(task_data, timeout=self.REQUEST_TIMEOUT)
+
     def terminate(self):
         if self.process is not None and self.process.is_alive():
             self._task_count += 1
@@ -284,6 +665,73 @@ class FaceAnalyzer:
             self.send_task(task_data)
 
 
+def create_faces_vision() -> FacesVision:
+    se = Settings()
+
+    se.force_cpu = settings.DNFAL_FORCE_CPU
+    se.detector_weights_path = settings.DNFAL_MODELS_PATHS['face_detector']
+    se.marker_weights_path = settings.DNFAL_MODELS_PATHS['face_marker']
+    se.encoder_weights_path = settings.DNFAL_MODELS_PATHS['face_encoder']
+    se.align_max_deviation = None
+    se.detection_min_scores = 0.9
+    se.marking_min_score = 0
+    se.detection_min_size = 32
+
+    if settings.DEBUG:
+        se.log_to_console = True
+
+    se.video_capture_source = None
+
+    return FacesVision(se)
+
+
+_worker_faces_vision: Optional[FacesVision] = None
+
+
+def worker_faces_vision() -> FacesVision:
+    """Return the faces vision of the current worker process, loading its
+    models on first use so that they stay warm between jobs."""
+    global _worker_faces_vision
+    if _worker_faces_vision is None:
+        _worker_faces_vision = create_faces_vision()
+    return _worker_faces_vision
+
+
+def finish_recognitions(recognitions_ids: List[int], error: str = ''):
+    status = Recognition.STATUS_FAILURE if error else Recognition.STATUS_SUCCESS
+    Recognition.objects.filter(pk__in=recognitions_ids).update(
+        status=status,
+        error=error,
+        finished_at=timezone.now()
+    )
+
+
+def run_recognitions(recognitions_ids: List[int]):
+    """Execute pending recognitions in the current worker process.
+
+    This is the entry point of asynchronous recognition jobs. The job status
+    is stored in the recognitions, and a notification is created when the
+    job finishes.
+    """
+    Recognition.objects.filter(pk__in=recognitions_ids).update(
+        status=Recognition.STATUS_RUNNING
+    )
+
+    error = ''
+    try:
+        faces_vision = worker_faces_vision()
+        if len(recognitions_ids) == 1:
+            recognize_face(recognitions_ids[0], faces_vision)
+        else:
+            recognize_faces(recognitions_ids, faces_vision)
+    except Exception as err:
+        logger.error(err)
+        error = str(err) or err.__class__.__name__
+
+    finish_recognitions(recognitions_ids, error)
+    recognition_notificate(recognitions_ids, error)
+
+
 def execute_task(send_queue: Queue, recv_queue: Queue):
 
     def _handle_signal(_signal_number, _stack_frame):
@@ -297,28 +745,12 @@ def execute_task(send_queue: Queue, recv_queue: Queue):
     for signal_key in (signal.SIGQUIT, signal.SIGTERM, signal.SIGINT):
         signal.signal(signal_key, _handle_signal)
 
-    se = Settings()
-
-    se.force_cpu = settings.DNFAL_FORCE_CPU
-    se.detector_weights_path = settings.DNFAL_MODELS_PATHS['face_detector']
-    se.marker_weights_path = settings.DNFAL_MODELS_PATHS['face_marker']
-    se.encoder_weights_path = settings.DNFAL_MODELS_PATHS['face_encoder']
-    se.align_max_deviation = None
-    se.detection_min_scores = 0.9
-    se.marking_min_score = 0
-    se.detection_min_size = 32
-
     genderage_weights_path = settings.DNFAL_MODELS_PATHS['genderage_predictor']
 
     genderage_predictor = None
     face_aligner = None
 
-    if settings.DEBUG:
-        se.log_to_console = True
-
-    se.video_capture_source = None
-
-    faces_vision = FacesVision(se)
+    faces_vision = create_faces_vision()
 
     while True:
         try:
@@ -356,6 +788,17 @@ def execute_task(send_queue: Queue, recv_queue: Queue):
         elif task_name == FaceAnalyzer.TASK_RECOGNIZE_FACE:
             recognition_id = kwargs['recognition_id']
             recognize_face(recognition_id=recognition_id, faces_vision=faces_vision)
+        elif task_name == FaceAnalyzer.TASK_RECOGNIZE_FACES:
+            recognitions_ids = kwargs['recognitions_ids']
+            recognize_faces(
+                recognitions_ids=recognitions_ids,
+                faces_vision=faces_vision
+            )
+        elif task_name == FaceAnalyzer.TASK_SEARCH_SHARD:
+            response_data['result'] = shards.search_shard(
+                face_matcher=faces_vision.face_matcher,
+                **kwargs
+            )
         elif task_name == FaceAnalyzer.TASK_TERMINATE:
             break
         else:
@@ -0,0 +1,226 @@
+from threading import Lock
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+from dnfal.engine import similarity_to_distance
+
+from ..models import Face, HuntMatch
+
+INITIAL_CAPACITY = 1024
+
+# Engine similarities used to map cosine similarities back to its scale
+_ENGINE_SIMILARITIES = np.linspace(0, 1, 1001)
+_ENGINE_DISTANCES = np.array([
+    similarity_to_distance(similarity)
+    for similarity in _ENGINE_SIMILARITIES
+])
+
+
+class HuntIndex:
+    """Watch list of hunted subjects shared by the hunt tasks of a worker
+    process.
+
+    The index lives in the memory of the process, hunt tasks are started in
+    the same worker process so they share it, see
+    ``tasks.RUNNER_GROUP_SHARED``.
+
+    Face embeddings are stored L2 normalized in a contiguous matrix with
+    spare capacity, so matching a detection is a single matrix-vector
+    product and adding subjects does not copy the matrix. Readers take the
+    ``(matrix, keys, size)`` snapshot at once and only read its first
+    ``size`` rows, so subjects can be added or removed while the tasks
+    keep matching.
+
+    Subjects are reference counted, since several tasks may hunt the same
+    subject.
+
+    Similarities are cosine similarities, see ``cosine_threshold`` and
+    ``engine_similarity`` to convert from and to the scale of the
+    recognition engine.
+    """
+
+    def __init__(self, dim: int = 0):
+        self.dim: int = dim
+
+        self._snapshot: Tuple[np.ndarray, np.ndarray, int] = (
+            np.zeros((0, dim), np.float32),
+            np.zeros(0, np.int64),
+            0
+        )
+        self._refs: Dict[int, int] = {}
+        self._lock = Lock()
+
+    def __len__(self):
+        return self._snapshot[2]
+
+    @property
+    def subjects(self) -> Set[int]:
+        return set(self._refs)
+
+    def add_subject(self, subject_id: int, embeddings: Iterable[np.ndarray]):
+        with self._lock:
+            if subject_id in self._refs:
+                self._refs[subject_id] += 1
+                return
+
+            embeddings = np.array(list(embeddings), np.float32)
+            self._refs[subject_id] = 1
+            if not len(embeddings):
+                return
+
+            if not self.dim:
+                self.dim = embeddings.shape[1]
+
+            norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+            embeddings /= np.where(norms > 0, norms, 1)
+
+            matrix, keys, size = self._snapshot
+            new_size = size + len(embeddings)
+            if new_size > len(matrix):
+                capacity = max(INITIAL_CAPACITY, len(matrix))
+                while capacity < new_size:
+                    capacity *= 2
+                new_matrix = np.zeros((capacity, self.dim), np.float32)
+                new_matrix[:size] = matrix[:size]
+                new_keys = np.zeros(capacity, np.int64)
+                new_keys[:size] = keys[:size]
+                matrix, keys = new_matrix, new_keys
+
+            # Rows past the published size are not visible to readers yet
+            matrix[size:new_size] = embeddings
+            keys[size:new_size] = subject_id
+            self._snapshot = (matrix, keys, new_size)
+
+    def remove_subject(self, subject_id: int):
+        with self._lock:
+            refs = self._refs.get(subject_id, 0)
+            if refs > 1:
+                self._refs[subject_id] = refs - 1
+                return
+            self._refs.pop(subject_id, None)
+
+            matrix, keys, size = self._snapshot
+            keep = keys[:size] != subject_id
+            new_size = int(np.count_nonzero(keep))
+            if new_size == size:
+                return
+
+            # Copy instead of compacting in place, readers may still hold
+            # the current matrix.
+            new_matrix = np.zeros_like(matrix)
+            new_matrix[:new_size] = matrix[:size][keep]
+            new_keys = np.zeros_like(keys)
+            new_keys[:new_size] = keys[:size][keep]
+            self._snapshot = (new_matrix, new_keys, new_size)
+
+    def match(
+        self,
+        embeddings: np.ndarray,
+        sim_thresh: float,
+        subjects: Set[int] = None
+    ) -> Optional[Tuple[int, float]]:
+        """Return the most similar hunted subject above ``sim_thresh``,
+        restricted to ``subjects`` if given, or None."""
+        matrix, keys, size = self._snapshot
+        if not size:
+            return None
+
+        query = np.asarray(embeddings, np.float32).ravel()
+        norm = np.linalg.norm(query)
+        if norm == 0:
+            return None
+
+        similarities = matrix[:size] @ (query / norm)
+        candidates = np.flatnonzero(similarities >= sim_thresh)
+        if not len(candidates):
+            return None
+
+        for ind in candidates[np.argsort(-similarities[candidates])]:
+            subject_id = int(keys[ind])
+            if subjects is None or subject_id in subjects:
+                return subject_id, float(similarities[ind])
+
+        return None
+
+
+def cosine_threshold(sim_thresh: float) -> float:
+    """Cosine similarity equivalent to a similarity threshold of the
+    recognition engine, which thresholds the euclidean distance of the
+    normalized embeddings."""
+    distance = similarity_to_distance(sim_thresh)
+    return float(1 - distance ** 2 / 2)
+
+
+def engine_similarity(cosine: float) -> float:
+    """Similarity of the recognition engine of a cosine similarity."""
+    distance = np.sqrt(max(0., 2 - 2 * cosine))
+    # Engine distances decrease as similarities increase
+    return float(np.interp(
+        distance,
+        _ENGINE_DISTANCES[::-1],
+        _ENGINE_SIMILARITIES[::-1]
+    ))
+
+
+def get_hunt_match(task_id: int, subject_id: int) -> HuntMatch:
+    """Hunt match of a task and a hunted subject, which is reused when the
+    subject is hunted again or the task restarts."""
+    try:
+        hunt_match, _ = HuntMatch.objects.get_or_create(
+            task_id=task_id,
+            target_subject_id=subject_id
+        )
+    except HuntMatch.MultipleObjectsReturned:
+        # Created by tasks started before hunt matches were reused
+        hunt_match = HuntMatch.objects.filter(
+            task_id=task_id,
+            target_subject_id=subject_id
+        ).order_by('pk').first()
+    return hunt_match
+
+
+def subjects_embeddings(
+    subjects_ids: List[int],
+    version: str
+) -> Dict[int, List[np.ndarray]]:
+    embeddings = {subject_id: [] for subject_id in subjects_ids}
+    faces = Face.objects.filter(
+        subject_id__in=subjects_ids
+    ).values_list(
+        'subject_id',
+        'embeddings_bytes',
+        'embeddings_version',
+        'next_embeddings_bytes',
+        'next_embeddings_version'
+    )
+    for (
+        subject_id, embeddings_bytes, embeddings_version,
+        next_embeddings_bytes, next_embeddings_version
+    ) in faces.iterator():
+        if embeddings_version == version and embeddings_bytes is not None:
+            face_embeddings = embeddings_bytes
+        elif (
+            next_embeddings_version == version and
+            next_embeddings_bytes is not None
+        ):
+            face_embeddings = next_embeddings_bytes
+        else:
+            continue
+        embeddings[subject_id].append(
+            np.frombuffer(face_embeddings, np.float32)
+        )
+    return embeddings
+
+
+_indexes: Dict[str, HuntIndex] = {}
+_indexes_lock = Lock()
+
+
+def shared_hunt_index(version: str) -> HuntIndex:
+    """Hunt index of the current worker process for an encoder version."""
+    with _indexes_lock:
+        index = _indexes.get(version, None)
+        if index is None:
+            index = HuntIndex()
+            _indexes[version] = index
+        return index
@@ -0,0 +1,180 @@
+"""Online re-identification of subjects across the video tasks of a node.
+
+Video tasks track faces independently, so a person seen by several
+cameras becomes one subject per camera. Tasks that link subjects keep
+the embeddings of the subjects they recently stored in a rolling index
+shared by the worker process, and new tracks reuse a recent subject
+that matches instead of creating another one. Linking tasks are started
+in the same worker process, see ``tasks.RUNNER_GROUP_SHARED``.
+"""
+from threading import Event, Lock
+from time import time
+from typing import Callable, Dict, Optional
+
+import numpy as np
+from django.conf import settings
+
+
+# Key of the entries whose subject is being created
+PENDING_KEY = -2
+
+
+class _Reservation:
+    """Entry of a subject being created, tracks matching it wait for it."""
+
+    def __init__(self):
+        self.subject_id: Optional[int] = None
+        self.done = Event()
+
+
+class SubjectLinker:
+    """Short memory of recent subject embeddings.
+
+    Embeddings are stored L2 normalized in a ring buffer, so the index
+    never grows past ``capacity`` and the oldest entries are overwritten
+    first. Entries older than ``memory`` seconds are ignored as well.
+    """
+
+    def __init__(self, capacity: int, memory: float, dim: int = 0):
+        self.capacity: int = capacity
+        self.memory: float = memory
+        self.dim: int = dim
+
+        self._matrix: Optional[np.ndarray] = None
+        self._keys: np.ndarray = np.full(capacity, -1, np.int64)
+        self._times: np.ndarray = np.full(capacity, -np.inf)
+        self._position: int = 0
+        self._reservations: Dict[int, _Reservation] = {}
+        self._lock = Lock()
+
+    def _normalize(self, embeddings: np.ndarray) -> Optional[np.ndarray]:
+        embeddings = np.asarray(embeddings, np.float32).ravel()
+        norm = np.linalg.norm(embeddings)
+        if norm == 0:
+            return None
+        if self._matrix is None:
+            self.dim = self.dim or len(embeddings)
+            self._matrix = np.zeros((self.capacity, self.dim), np.float32)
+        return embeddings / norm
+
+    def _add(
+        self,
+        subject_id: int,
+        embeddings: np.ndarray,
+        now: float
+    ) -> int:
+        position = self._position
+        self._reservations.pop(position, None)
+        self._matrix[position] = embeddings
+        self._keys[position] = subject_id
+        self._times[position] = now
+        self._position = (position + 1) % self.capacity
+        return position
+
+    def _match(
+        self,
+        embeddings: np.ndarray,
+        sim_thresh: float,
+        now: float
+    ) -> Optional[int]:
+        """Position of the most similar valid entry, or None."""
+        valid = self._times >= now - self.memory
+        if not np.any(valid):
+            return None
+        similarities = self._matrix @ embeddings
+        similarities[~valid] = -np.inf
+        ind = int(np.argmax(similarities))
+        if similarities[ind] < sim_thresh:
+            return None
+        return ind
+
+    def add(self, subject_id: int, embeddings: np.ndarray):
+        if self.capacity <= 0:
+            return
+        with self._lock:
+            embeddings = self._normalize(embeddings)
+            if embeddings is not None:
+                self._add(subject_id, embeddings, time())
+
+    def link(
+        self,
+        embeddings: np.ndarray,
+        sim_thresh: float,
+        create_subject: Callable[[], int]
+    ) -> int:
+        """Return the recent subject most similar to ``embeddings`` above
+        ``sim_thresh``, or the one returned by ``create_subject``.
+
+        When nothing matches, an entry is reserved under the lock and the
+        subject is created outside it. Concurrent tracks of the same person
+        that match the reserved entry wait for that subject, so they end in
+        one subject without serializing the other tracks on the insert.
+        """
+        if self.capacity <= 0:
+            return create_subject()
+
+        with self._lock:
+            embeddings = self._normalize(embeddings)
+            if embeddings is None:
+                return create_subject()
+            now = time()
+            ind = self._match(embeddings, sim_thresh, now)
+            if ind is not None and self._keys[ind] != PENDING_KEY:
+                subject_id = int(self._keys[ind])
+                self._add(subject_id, embeddings, now)
+                return subject_id
+            if ind is not None:
+                reservation = self._reservations[ind]
+                waiting = True
+            else:
+                reservation = _Reservation()
+                position = self._add(PENDING_KEY, embeddings, now)
+                self._reservations[position] = reservation
+                waiting = False
+
+        if waiting:
+            reservation.done.wait()
+            if reservation.subject_id is not None:
+                self.add(reservation.subject_id, embeddings)
+                return reservation.subject_id
+            # The creation failed, create the subject of this track
+            return create_subject()
+
+        try:
+            reservation.subject_id = create_subject()
+        finally:
+            with self._lock:
+                if self._reservations.get(position, None) is reservation:
+                    del self._reservations[position]
+                    if reservation.subject_id is None:
+                        self._keys[position] = -1
+                        self._times[position] = -np.inf
+                    else:
+                        self._keys[position] = reservation.subject_id
+            reservation.done.set()
+        return reservation.subject_id
+
+    def clear(self):
+        with self._lock:
+            self._keys[:] = -1
+            self._times[:] = -np.inf
+            self._position = 0
+            self._reservations = {}
+
+
+_linkers: Dict[str, SubjectLinker] = {}
+_linkers_lock = Lock()
+
+
+def shared_subject_linker(version: str) -> SubjectLinker:
+    """Subject linker of the current worker process for an encoder
+    version."""
+    with _linkers_lock:
+        linker = _linkers.get(version, None)
+        if linker is None:
+            linker = SubjectLinker(
+                capacity=settings.SUBJECT_LINKING_CAPACITY,
+                memory=settings.SUBJECT_LINKING_MEMORY
+            )
+            _linkers[version] = linker
+        return linker
@@ -4,12 +4,25 @@ from os import path
 from glob import iglob
 from datetime import datetime
 
+from typing import List
+
 from django.utils.timezone import make_aware
 from django.conf import settings
+from django.contrib.postgres.fields.jsonb import KeyTextTransform
+from django.db.models import (
+    Avg,
+    Count,
+    FloatField,
+    IntegerField,
+    Max,
+    Q,
+    Sum
+)
+from django.db.models.functions import Cast
 
 import cv2 as cv
 
-from ..models import VideoRecord, VideoThumb
+from ..models import Task, VideoRecord, VideoThumb
 from cvtlib.video import VideoCapture
 
 FILENAME_DATE_SEPARATOR = '__'
@@ -129,3 +142,54 @@ def create_video_thumbs(instance: VideoRecord):
             )
 
         video_capture.release()
+
+
+SOURCE_STATS_FIELDS = (
+    'running_tasks',
+    'frames_count',
+    'processing_time',
+    'frame_rate',
+    'last_task_at'
+)
+
+
+def json_value(key: str, output_field):
+    return Cast(KeyTextTransform(key, 'info'), output_field)
+
+
+def fill_sources_stats(sources: List):
+    """Compute the tasks statistics of several cameras or video records with
+    a single grouped query.
+
+    Values are stored as the sources cached properties, so they are not
+    computed again with one query per source and statistic.
+    """
+    if not len(sources):
+        return
+
+    source_type = sources[0].SOURCE_TYPE
+    rows = Task.objects.filter(
+        config__video_source_type=source_type
+    ).annotate(
+        source_id=Cast(
+            KeyTextTransform('video_source_id', 'config'),
+            IntegerField()
+        )
+    ).filter(
+        source_id__in=[source.pk for source in sources]
+    ).values('source_id').annotate(
+        running_tasks=Count('id', filter=Q(status=Task.STATUS_RUNNING)),
+        frames_count=Sum(json_value('frames_count', IntegerField())),
+        processing_time=Sum(json_value('processing_time', FloatField())),
+        frame_rate=Avg(json_value('frame_rate', FloatField())),
+        last_task_at=Max('finished_at')
+    ).order_by()
+
+    stats = {row['source_id']: row for row in rows}
+    for source in sources:
+        row = stats.get(source.pk, {})
+        for field in SOURCE_STATS_FIELDS:
+            value = row.get(field, None)
+            if value is None and field != 'last_task_at':
+                value = 0
+            source.__dict__[field] = value
@@ -1,3 +1,5 @@
+from typing import List
+
 from dfapi.models import Task, Notification
 
 TASK_OPTIONS = {
@@ -41,3 +43,30 @@ def task_notificate(task_id: int, prev_status: str, next_status: str):
             resource=task_id,
             seen=False
         )
+
+
+def recognition_notificate(recognitions_ids: List[int], error: str = ''):
+    if not len(recognitions_ids):
+        return
+    count = len(recognitions_ids)
+    if error:
+        title = 'Error de reconocimiento'
+        message = f'El reconocimiento #{recognitions_ids[0]} finalizó con error'
+        dtype = Notification.DTYPE_ERROR
+    elif count > 1:
+        title = 'Reconocimiento finalizado'
+        message = f'Finalizó el reconocimiento de {count} rostros'
+        dtype = Notification.DTYPE_INFO
+    else:
+        title = 'Reconocimiento finalizado'
+        message = f'El reconocimiento #{recognitions_ids[0]} finalizó correctamente'
+        dtype = Notification.DTYPE_INFO
+
+    Notification.objects.create(
+        category=Notification.CATEGORY_RECOGNITION,
+        dtype=dtype,
+        title=title,
+        message=message,
+        resource=recognitions_ids[0],
+        seen=False
+    )
@@ -0,0 +1,217 @@
+import logging
+from typing import Iterable, Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+
+from .recognition_cache import face_changed
+from ..models import (
+    EncoderVersion,
+    Face,
+    Subject,
+    SubjectPrototype
+)
+
+logger_name = settings.LOGGER_NAME
+logger = logging.getLogger(logger_name)
+
+
+def add_face(face: Face):
+    version = EncoderVersion.active_version()
+    embeddings = face.embeddings_for(version)
+    if face.subject_id is None or embeddings is None:
+        return
+    add_embeddings(face.subject_id, face.pk, embeddings, version)
+
+
+def remove_face(face: Face, subject_id: int = None):
+    if subject_id is None:
+        subject_id = face.subject_id
+    if subject_id is None:
+        return
+
+    with transaction.atomic():
+        prototype = SubjectPrototype.objects.select_for_update().filter(
+            subject_id=subject_id
+        ).first()
+        if prototype is None:
+            return
+        embeddings = face.embeddings_for(prototype.version)
+        if embeddings is None:
+            return
+        _remove_embeddings(prototype, face.pk, embeddings)
+
+
+def update_face(
+    face: Face,
+    old_subject_id: Optional[int],
+    old_embeddings: Optional[np.ndarray]
+):
+    """Move the embeddings of a saved face between the prototypes when its
+    subject or its embeddings of the active version changed."""
+    if not face_changed(face, old_subject_id, old_embeddings):
+        return
+
+    version = EncoderVersion.active_version()
+    embeddings = face.embeddings_for(version)
+
+    if old_subject_id is not None and old_embeddings is not None:
+        remove_embeddings(old_subject_id, face.pk, old_embeddings, version)
+    if face.subject_id is not None and embeddings is not None:
+        add_embeddings(face.subject_id, face.pk, embeddings, version)
+
+
+def add_embeddings(
+    subject_id: int,
+    face_id: int,
+    embeddings: np.ndarray,
+    version: str
+):
+    with transaction.atomic():
+        prototype, _ = SubjectPrototype.objects.select_for_update(
+        ).get_or_create(
+            subject_id=subject_id,
+            defaults={'version': version}
+        )
+        if prototype.version != version:
+            rebuild(subject_id)
+            return
+
+        prototype.add_embeddings(
+            face_id,
+            embeddings,
+            settings.PROTOTYPE_MAX_EXEMPLARS
+        )
+        prototype.save()
+
+
+def remove_embeddings(
+    subject_id: int,
+    face_id: int,
+    embeddings: np.ndarray,
+    version: str
+):
+    with transaction.atomic():
+        prototype = SubjectPrototype.objects.select_for_update().filter(
+            subject_id=subject_id,
+            version=version
+        ).first()
+        if prototype is not None:
+            _remove_embeddings(prototype, face_id, embeddings)
+
+
+def _remove_embeddings(
+    prototype: SubjectPrototype,
+    face_id: int,
+    embeddings: np.ndarray
+):
+    prototype.remove_embeddings(face_id, embeddings)
+    if prototype.faces_count > 0:
+        prototype.save()
+    else:
+        prototype.delete()
+
+
+def rebuild(subject_id: int):
+    version = EncoderVersion.active_version()
+    faces = Face.objects.filter(
+        Face.version_filter(version),
+        subject_id=subject_id
+    ).annotate(
+        version_embeddings_bytes=Face.version_embeddings(version)
+    ).order_by('pk').values_list('id', 'version_embeddings_bytes')
+
+    with transaction.atomic():
+        SubjectPrototype.objects.filter(subject_id=subject_id).delete()
+        if not Subject.objects.filter(pk=subject_id).exists():
+            return
+
+        prototype = SubjectPrototype(subject_id=subject_id, version=version)
+        for face_id, embeddings_bytes in faces.iterator():
+            prototype.add_embeddings(
+                face_id,
+                np.frombuffer(embeddings_bytes, np.float32),
+                settings.PROTOTYPE_MAX_EXEMPLARS
+            )
+
+        if prototype.faces_count > 0:
+            prototype.save()
+
+
+def rebuild_many(subjects_ids: Iterable[int]):
+    for subject_id in subjects_ids:
+        try:
+            rebuild(subject_id)
+        except Exception as err:
+            logger.error(err)
+
+
+def rebuild_all():
+    subjects_ids = Face.objects.filter(
+        subject__isnull=False
+    ).values_list('subject_id', flat=True).distinct().order_by()
+    # Prototypes of other versions are kept until they are replaced
+    rebuild_many(subjects_ids.iterator())
+    SubjectPrototype.objects.exclude(
+        version=EncoderVersion.active_version()
+    ).delete()
+
+
+def segments_candidates(
+    queries: np.ndarray,
+    segments,
+    count: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Scan the prototypes of the segments subjects and return the
+    embeddings and subjects of every face of the ``count`` best subjects
+    of each query, a row of ``queries``. The faces of the union of those
+    subjects are fetched at once.
+    """
+    prototypes = []
+    prototypes_subjects = []
+    for segment in segments:
+        segment_prototypes, segment_subjects = segment.get_prototypes_data()
+        if len(segment_subjects):
+            prototypes.append(segment_prototypes)
+            prototypes_subjects.append(segment_subjects)
+
+    if not len(prototypes):
+        return np.zeros((0, 0), np.float32), np.zeros(0, np.int32)
+
+    prototypes = np.vstack(prototypes)
+    prototypes_subjects = np.hstack(prototypes_subjects)
+
+    queries = np.asarray(queries, np.float32)
+    queries = queries.reshape((-1, queries.shape[-1]))
+    norms = np.outer(
+        np.linalg.norm(queries, axis=1),
+        np.linalg.norm(prototypes, axis=1)
+    )
+    similarities = (queries @ prototypes.T) / np.where(norms > 0, norms, 1)
+
+    subjects_ids = set()
+    for query_similarities in similarities:
+        # Best similarity of each subject over its prototype vectors
+        query_subjects = set()
+        for ind in np.argsort(-query_similarities):
+            query_subjects.add(int(prototypes_subjects[ind]))
+            if len(query_subjects) == count:
+                break
+        subjects_ids.update(query_subjects)
+
+    version = EncoderVersion.active_version()
+    faces = Face.objects.filter(
+        Face.version_filter(version),
+        subject_id__in=list(subjects_ids)
+    ).annotate(
+        version_embeddings_bytes=Face.version_embeddings(version)
+    ).values_list('subject_id', 'version_embeddings_bytes')
+
+    embeddings = []
+    subjects = []
+    for subject_id, embeddings_bytes in faces.iterator():
+        embeddings.append(np.frombuffer(embeddings_bytes, np.float32))
+        subjects.append(subject_id)
+
+    return np.array(embeddings, np.float32), np.array(subjects, np.int32)
@@ -0,0 +1,160 @@
+import hashlib
+from collections import OrderedDict
+from threading import Lock
+from time import time
+from typing import Dict, Hashable, Iterable, List, Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+
+from ..models import EncoderVersion, Face, Recognition, SubjectSegment
+
+Matches = Tuple[Tuple[int, float], ...]
+
+
+class RecognitionCache:
+    """Thread safe LRU cache of recognition matches.
+
+    Entries are never invalidated in place. Instead, keys include the
+    versions of the recognized data, so stale entries simply stop being
+    hit and are eventually evicted.
+
+    Each recognition process holds its own entries, while the segments
+    generations are kept in the shared cache.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size: int = max_size
+
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[Matches]:
+        with self._lock:
+            matches = self._entries.get(key, None)
+            if matches is not None:
+                self._entries.move_to_end(key)
+            return matches
+
+    def set(self, key: Hashable, matches: List[Tuple[int, float]]):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = tuple(matches)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+SEGMENT_GENERATION_KEY = 'recognition:segment_generation:{}'
+
+
+def segments_generations(segments_ids: Iterable[int]) -> Dict[int, int]:
+    """Generation of the data of each segment, kept in the shared cache.
+
+    Missing generations start at the current time in milliseconds, so
+    matches cached before the shared cache was cleared are never hit.
+    """
+    keys = {
+        SEGMENT_GENERATION_KEY.format(segment_id): segment_id
+        for segment_id in segments_ids
+    }
+    generations = cache.get_many(keys.keys())
+    for key in keys.keys() - generations.keys():
+        cache.add(key, int(time() * 1000), None)
+        generations[key] = cache.get(key)
+    return {keys[key]: generation for key, generation in generations.items()}
+
+
+def invalidate_segments(segments_ids: Iterable[int]):
+    """Expire the cached recognitions against some segments."""
+    for segment_id in segments_ids:
+        key = SEGMENT_GENERATION_KEY.format(segment_id)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, int(time() * 1000), None)
+
+
+def invalidate_subjects(subjects_ids: Iterable[int]):
+    """Expire the cached recognitions against the segments holding some
+    subjects, after their recognizable faces change."""
+    subjects_ids = {
+        subject_id for subject_id in subjects_ids if subject_id is not None
+    }
+    if not len(subjects_ids):
+        return
+    invalidate_segments([
+        segment.pk for segment in SubjectSegment.objects.all()
+        if segment.queryset.filter(pk__in=subjects_ids).exists()
+    ])
+
+
+def invalidate_all():
+    """Expire every cached recognition, after subjects are deleted or
+    change the segments they belong to."""
+    invalidate_segments(
+        SubjectSegment.objects.values_list('pk', flat=True)
+    )
+
+
+def face_recognizable(face: Face) -> bool:
+    return (
+        face.subject_id is not None and
+        face.embeddings_for(EncoderVersion.active_version()) is not None
+    )
+
+
+def face_changed(
+    face: Face,
+    old_subject_id: Optional[int],
+    old_embeddings: Optional[np.ndarray]
+) -> bool:
+    """Whether the subject or the embeddings of the active version of a
+    saved face differ from the previous ones."""
+    if old_subject_id != face.subject_id:
+        return True
+    embeddings = face.embeddings_for(EncoderVersion.active_version())
+    if embeddings is None or old_embeddings is None:
+        return embeddings is not old_embeddings
+    return not np.array_equal(embeddings, old_embeddings)
+
+
+def data_version(segments) -> tuple:
+    """Version of the data recognized against ``segments``, made of the
+    generations of those segments only, so changes of subjects out of them
+    do not expire their cached recognitions."""
+    generations = segments_generations(segment.pk for segment in segments)
+    return (
+        tuple(sorted(generations.items())),
+        EncoderVersion.active_version(),
+        settings.EMBEDDINGS_QUANTIZATION
+    )
+
+
+def recognition_key(
+    recognition: Recognition,
+    face_embeddings: np.ndarray,
+    version: tuple
+) -> tuple:
+    embeddings_hash = hashlib.sha1(
+        np.asarray(face_embeddings, np.float32).tobytes()
+    ).hexdigest()
+    return (
+        embeddings_hash,
+        recognition.mode,
+        float(recognition.sim_thresh),
+        recognition.max_matches,
+        version
+    )
+
+
+recognition_cache = RecognitionCache(settings.RECOGNITION_CACHE_SIZE)
@@ -0,0 +1,311 @@
+"""Retention policies of the stored data, applied by the clean database job.
+
+Policies are deleted in small primary key ordered batches with set-based
+SQL instead of ``QuerySet.delete``, which loads every row to send the
+``post_delete`` signals. What those signals maintain is done in bulk for
+each batch instead: related rows are deleted or detached, image files are
+unlinked from a background thread and the totals, subjects summaries,
+sightings and prototypes are refreshed.
+"""
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+from queue import Queue
+from threading import Thread
+from typing import Callable, Dict, Iterable, List, Set
+
+from django.conf import settings
+from django.db import connections, models, router, transaction
+from django.db.models import Exists, OuterRef, QuerySet, Sum
+from django.utils.timezone import make_aware
+
+from . import (
+    face_index,
+    prototypes,
+    recognition_cache,
+    sightings,
+    stats,
+    subjects
+)
+from ..models import Face, Frame, Recognition, Subject
+
+logger_name = settings.LOGGER_NAME
+logger = logging.getLogger(logger_name)
+
+
+def orphan_faces(now: datetime) -> QuerySet:
+    return Face.objects.filter(subject__isnull=True)
+
+
+def old_faces(now: datetime, days: int) -> QuerySet:
+    return Face.objects.filter(created_at__lt=now - timedelta(days=days))
+
+
+def frames_without_faces(now: datetime) -> QuerySet:
+    return Frame.objects.filter(
+        ~Exists(Face.objects.filter(frame=OuterRef('pk')))
+    )
+
+
+def unnamed_subjects(now: datetime, days: int) -> QuerySet:
+    return Subject.objects.filter(
+        name='',
+        last_name='',
+        updated_at__lt=now - timedelta(days=days)
+    )
+
+
+def old_recognitions(now: datetime, days: int) -> QuerySet:
+    return Recognition.objects.filter(
+        created_at__lt=now - timedelta(days=days)
+    )
+
+
+POLICIES: Dict[str, Callable[..., QuerySet]] = {
+    'orphan_faces': orphan_faces,
+    'old_faces': old_faces,
+    'frames_without_faces': frames_without_faces,
+    'unnamed_subjects': unnamed_subjects,
+    'old_recognitions': old_recognitions
+}
+
+
+class FileUnlinker:
+    """Background thread removing the files of deleted rows."""
+
+    def __init__(self):
+        self.queue = Queue()
+        self.thread = Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            file_paths = self.queue.get()
+            if file_paths is None:
+                break
+            for file_path in file_paths:
+                try:
+                    os.remove(file_path)
+                except FileNotFoundError:
+                    pass
+                except OSError as err:
+                    logger.error(err)
+
+    def unlink(self, file_names: Iterable[str]):
+        self.queue.put([
+            os.path.join(settings.MEDIA_ROOT, file_name)
+            for file_name in file_names if file_name
+        ])
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+
+def reverse_relations(model) -> list:
+    """Relations of other models to ``model``, hidden ones included, such as
+    the many to many through tables and relations without reverse
+    accessor."""
+    return [
+        field for field in model._meta.get_fields(include_hidden=True)
+        if field.auto_created and not field.concrete and (
+            field.one_to_many or field.one_to_one
+        )
+    ]
+
+
+class BatchDeletion:
+    """Rows deleted by a batch, cascading through their relations as the
+    models ``on_delete`` states."""
+
+    def __init__(self):
+        self.files: List[str] = []
+        self.totals: Dict[str, float] = {}
+        self.faces_subjects: Set[int] = set()
+        self.deleted_subjects: Set[int] = set()
+        self.deleted_faces: bool = False
+
+    def delete(self, model, pks: List[int]):
+        if not len(pks):
+            return
+
+        self.collect(model, pks)
+
+        for relation in reverse_relations(model):
+            related_model = relation.related_model
+            field = relation.field
+            rows = related_model._base_manager.filter(
+                **{f'{field.name}__in': pks}
+            )
+            if relation.on_delete == models.CASCADE:
+                self.delete(
+                    related_model,
+                    list(rows.values_list('pk', flat=True))
+                )
+            elif relation.on_delete == models.SET_NULL:
+                rows.update(**{field.name: None})
+            elif relation.on_delete != models.DO_NOTHING:
+                raise ValueError(
+                    f'Unsupported on_delete of {related_model.__name__}.'
+                    f'{field.name}'
+                )
+
+        raw_delete(model, pks)
+
+    def collect(self, model, pks: List[int]):
+        """Keep what the deleted rows signals would have updated."""
+        meta = model._meta
+        file_fields = [
+            field.name for field in meta.concrete_fields
+            if isinstance(field, models.FileField)
+        ]
+        for field_name in file_fields:
+            self.files.extend(model._base_manager.filter(
+                pk__in=pks
+            ).values_list(field_name, flat=True))
+
+        if model in stats.TOTAL_COUNTERS:
+            count_name, size_name = stats.TOTAL_COUNTERS[model]
+            self.totals[count_name] = (
+                self.totals.get(count_name, 0) - len(pks)
+            )
+            if size_name is not None:
+                size = model._base_manager.filter(
+                    pk__in=pks
+                ).aggregate(Sum('size_bytes'))['size_bytes__sum']
+                self.totals[size_name] = (
+                    self.totals.get(size_name, 0) - (size or 0)
+                )
+
+        if model is Face:
+            self.deleted_faces = True
+            self.faces_subjects.update(Face.objects.filter(
+                pk__in=pks,
+                subject__isnull=False
+            ).values_list('subject_id', flat=True).distinct().order_by())
+        elif model is Subject:
+            self.deleted_subjects.update(pks)
+
+    @property
+    def changed_subjects(self) -> Set[int]:
+        """Subjects that lost faces but were not deleted."""
+        return self.faces_subjects - self.deleted_subjects
+
+    def refresh(self):
+        """Update the data derived from the deleted rows."""
+        stats.add_totals(self.totals)
+
+        subjects_ids = self.changed_subjects
+        if len(subjects_ids):
+            subjects.refresh_summary(subjects_ids)
+            sightings.rebuild(subjects_ids)
+        if len(self.deleted_subjects):
+            subjects.invalidate_demograp()
+        if self.deleted_faces:
+            recognition_cache.invalidate_all()
+            face_index.invalidate_face_index()
+
+
+def raw_delete(model, pks: List[int]):
+    """Delete rows by primary key without loading them nor sending
+    signals."""
+    meta = model._meta
+    connection = connections[router.db_for_write(model)]
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {quote(meta.db_table)} '
+            f'WHERE {quote(meta.pk.column)} = ANY(%s)',
+            [list(pks)]
+        )
+
+
+def apply_policy(
+    queryset: QuerySet,
+    unlinker: FileUnlinker,
+    batch_size: int,
+    pause: float
+) -> int:
+    """Delete the rows of ``queryset`` in batches, each one in its own short
+    transaction, and return how many were deleted.
+
+    The rows that cascade from each batch are deleted before it the same
+    way, so no transaction deletes more than ``batch_size`` rows of a model,
+    however many faces a subject has. Only the rows cascading from parents
+    that still match ``queryset`` are deleted, and rows locked by live
+    ingestion are skipped instead of waited for. The job sleeps ``pause``
+    seconds between batches so it does not starve the database.
+    """
+    model = queryset.model
+    queryset = queryset.order_by('pk')
+
+    deleted = 0
+    last_pk = None
+    while True:
+        batch = queryset
+        if last_pk is not None:
+            batch = batch.filter(pk__gt=last_pk)
+        pks = list(batch.values_list('pk', flat=True)[0:batch_size])
+        if not len(pks):
+            break
+
+        parents = queryset.filter(pk__in=pks).values('pk')
+        for relation in reverse_relations(model):
+            if relation.on_delete == models.CASCADE:
+                apply_policy(
+                    relation.related_model._base_manager.filter(
+                        **{f'{relation.field.name}__in': parents}
+                    ),
+                    unlinker,
+                    batch_size,
+                    pause
+                )
+
+        # Rows cascading from the batch after its children were deleted
+        # are still deleted with it.
+        deletion = BatchDeletion()
+        with transaction.atomic():
+            locked_pks = list(queryset.filter(pk__in=pks).select_for_update(
+                skip_locked=True
+            ).values_list('pk', flat=True))
+            if len(locked_pks):
+                deletion.delete(model, locked_pks)
+                deletion.refresh()
+
+        unlinker.unlink(deletion.files)
+        prototypes.rebuild_many(deletion.changed_subjects)
+
+        deleted += len(locked_pks)
+        last_pk = pks[-1]
+        if pause > 0:
+            time.sleep(pause)
+
+    return deleted
+
+
+def clean_database(policies: Dict[str, dict] = None) -> Dict[str, int]:
+    """Apply the retention ``policies``, by default the ones in the
+    RETENTION_POLICIES setting, and return the rows deleted by each one."""
+    if policies is None:
+        policies = settings.RETENTION_POLICIES
+
+    now = make_aware(datetime.now())
+    unlinker = FileUnlinker()
+    deleted = {}
+    try:
+        for name, params in policies.items():
+            if params is None:
+                continue
+            queryset = POLICIES[name](now, **params)
+            deleted[name] = apply_policy(
+                queryset,
+                unlinker,
+                batch_size=settings.RETENTION_BATCH_SIZE,
+                pause=settings.RETENTION_BATCH_PAUSE
+            )
+            logger.info(f'Retention policy {name} deleted {deleted[name]} rows.')
+    finally:
+        unlinker.close()
+
+    return deleted
@@ -3,3 +3,4 @@ from .vdf import VdfTaskRunner
 from .vhf import VhfTaskRunner
 from .fcl import FclTaskRunner
 from .pga import PgaTaskRunner
+from .fre import FreTaskRunner
@@ -8,7 +8,10 @@ from dnfal.engine import similarity_to_distance
 from dnfal.clustering import hcg_cluster
 
 from .task import TaskRunner
+from .. import prototypes, sightings
+from ..subjects import refresh_summary
 from ...models import (
+    EncoderVersion,
     Subject,
     Face,
     FclTaskConfig,
@@ -31,9 +34,8 @@ class FclTaskRunner(TaskRunner):
 
         config = self.task_config
 
-        faces_queryset = Face.objects.exclude(
-            embeddings_bytes__isnull=True
-        )
+        version = EncoderVersion.active_version()
+        faces_queryset = Face.objects.filter(Face.version_filter(version))
 
         back_time = {}
 
@@ -101,7 +103,7 @@ class FclTaskRunner(TaskRunner):
         timestamps = [] if timestamp_thr else None
         queryset_pks = []
         for face in faces_queryset.iterator():
-            embeddings.append(face.embeddings)
+            embeddings.append(face.embeddings_for(version))
             queryset_pks.append(face.id)
             if timestamps is not None:
                 timestamps.append(face.created_at.timestamp())
@@ -174,6 +176,9 @@ class FclTaskRunner(TaskRunner):
 
         subject = Subject.objects.create(**subject_data)
         subject.faces.set(faces_cluster)
+        prototypes.rebuild(subject.pk)
+        sightings.rebuild([subject.pk])
+        refresh_summary([subject.pk])
 
     def pause(self):
         self._pause = True
@@ -0,0 +1,151 @@
+from time import time, sleep
+from typing import List
+
+import cv2 as cv
+from django.conf import settings
+from dnfal.settings import Settings
+from dnfal.vision import FacesVision
+
+from .task import TaskRunner, PAUSE_DURATION, PROGRESS_UPDATE_INTERVAL
+from .. import prototypes
+from ..faces import activate_encoder_version
+from ...models import (
+    Face,
+    FreTaskConfig,
+    Task
+)
+
+
+class FreTaskRunner(TaskRunner):
+    """Re-encode stored faces with the current face encoder.
+
+    New embeddings are staged next to the current ones, so recognition
+    keeps serving the active version until every face is re-encoded.
+    Faces already staged are skipped, which makes the task resumable.
+    """
+
+    def __init__(self, task: Task, daemon: bool = True):
+        super().__init__(task, daemon)
+
+        se = Settings()
+
+        se.force_cpu = settings.DNFAL_FORCE_CPU
+        se.detector_weights_path = settings.DNFAL_MODELS_PATHS['face_detector']
+        se.marker_weights_path = settings.DNFAL_MODELS_PATHS['face_marker']
+        se.encoder_weights_path = settings.DNFAL_MODELS_PATHS['face_encoder']
+        se.align_max_deviation = None
+        se.detection_min_scores = 0.9
+        se.marking_min_score = 0
+        se.detection_min_size = 32
+        se.video_capture_source = None
+
+        self.task_config: FreTaskConfig = FreTaskConfig(**self.task.config)
+        self.version: str = settings.DNFAL_ENCODER_VERSION
+
+        self.faces_vision: FacesVision = FacesVision(se)
+
+        self._run: bool = False
+        self._pause: bool = False
+
+    def pending_faces(self):
+        return Face.objects.exclude(
+            embeddings_version=self.version
+        ).exclude(
+            next_embeddings_version=self.version
+        ).exclude(
+            image__isnull=True
+        ).exclude(
+            image=''
+        ).order_by('pk')
+
+    def main_run(self):
+
+        faces_queryset = self.pending_faces()
+
+        batch_size = self.task_config.batch_size
+        faces_count = 0
+        started_at = time()
+        total = faces_queryset.count()
+        faces_batch = []
+
+        self._run = True
+
+        for face in faces_queryset.iterator(chunk_size=batch_size):
+            if not self._run:
+                break
+
+            while self._pause:
+                sleep(PAUSE_DURATION)
+
+            faces_batch.append(face)
+            faces_count += 1
+            last_face = faces_count == total
+
+            if len(faces_batch) == batch_size or last_face:
+                self.encode_faces(faces_batch)
+                faces_batch = []
+                now = time()
+                elapsed = now - self.last_progress_update
+                if elapsed > PROGRESS_UPDATE_INTERVAL or last_face:
+                    self.last_progress_update = now
+                    self.task.progress = 100 * faces_count / total
+                    info = self.task.info
+                    info['faces_count'] = faces_count
+                    info['processing_time'] = now - started_at
+                    info['version'] = self.version
+                    self.send_progress()
+
+        # A stopped task leaves the rest for the next run
+        if len(faces_batch) and self._run:
+            self.encode_faces(faces_batch)
+
+        if (
+            self._run and
+            self.task_config.auto_switch and
+            not self.pending_faces().exists()
+        ):
+            activate_encoder_version(self.version)
+            self.task.info['switched'] = True
+            prototypes.rebuild_all()
+
+    def encode_faces(self, faces: List[Face]):
+        frame_analyzer = self.faces_vision.frame_analyzer
+
+        for face in faces:
+            # Faces that can not be re-encoded are staged without
+            # embeddings, so they are not retried on resume.
+            face.next_embeddings_bytes = None
+            face.next_embeddings_version = self.version
+
+            face_image = cv.imread(face.image.path)
+            if face_image is None:
+                continue
+
+            detected_faces, _ = frame_analyzer.find_faces(face_image)
+            if len(detected_faces) == 1:
+                face.next_embeddings = detected_faces[0].embeddings
+
+        Face.objects.bulk_update(
+            faces,
+            fields=['next_embeddings_bytes', 'next_embeddings_version']
+        )
+
+    def pause(self):
+        self._pause = True
+        super().pause()
+
+    def resume(self):
+        self._pause = False
+        super().resume()
+
+    def stop(self):
+        self._run = False
+        super().stop()
+
+    def kill(self):
+        self._run = False
+        super().kill()
+
+    def failed(self):
+        self._run = False
+        super().failed()
@@ -1,5 +1,5 @@
 from time import time, sleep
-from typing import List
+from typing import List, Set
 
 import cv2 as cv
 from django.conf import settings
@@ -7,9 +7,9 @@ from dnfal.settings import Settings
 from dnfal.vision import FacesVision
 
 from .task import TaskRunner, PAUSE_DURATION, PROGRESS_UPDATE_INTERVAL
-from ..subjects import pred_sexage
+from ..crops import get_face_crop
+from ..subjects import update_pred_sexage
 from ...models import (
-    Subject,
     Face,
     PgaTaskConfig,
     Task
@@ -34,6 +34,7 @@ class PgaTaskRunner(TaskRunner):
         self.task_config: PgaTaskConfig = PgaTaskConfig(**task.config)
 
         self.faces_vision: FacesVision = FacesVision(se)
+        self.subjects_ids: Set[int] = set()
 
         self._run: bool = False
         self._pause: bool = False
@@ -92,40 +93,8 @@ class PgaTaskRunner(TaskRunner):
                     info['processing_time'] = now - started_at
                     self.send_progress()
 
-        # Update subjects
-        subjects_queryset = Subject.objects.all()
-
-        if self.task_config.min_created_at is not None:
-            subjects_queryset = subjects_queryset.filter(
-                faces_created_at__gt=self.task_config.min_created_at
-            )
-        if self.task_config.max_created_at is not None:
-            subjects_queryset = subjects_queryset.filter(
-                faces_created_at__lt=self.task_config.max_created_at
-            )
-
-        for subject in subjects_queryset.iterator():
-            if not self._run:
-                break
-            while self._pause:
-                sleep(PAUSE_DURATION)
-
-            pred_age, age_var, pred_sex, sex_score = pred_sexage(subject)
-            if pred_age is not None:
-                subject.pred_age = int(pred_age)
-                subject.pred_age_var = age_var
-
-            if pred_sex:
-                subject.pred_sex = pred_sex
-                subject.pred_sex_score = sex_score
-
-            if pred_age is not None or pred_sex:
-                subject.save(update_fields=[
-                    'pred_sex',
-                    'pred_sex_score',
-                    'pred_age',
-                    'pred_age_var'
-                ])
+        # Update subjects whose faces were predicted in this run
+        update_pred_sexage(self.subjects_ids)
 
     def predict_genderage(self, faces: List[Face]):
         genderage_predictor = self.faces_vision.genderage_predictor
@@ -134,6 +103,12 @@ class PgaTaskRunner(TaskRunner):
         faces_images = []
         faces_inds = []
         for ind, face in enumerate(faces):
+            face_image_align = get_face_crop(face)
+            if face_image_align is not None:
+                faces_images.append(face_image_align)
+                faces_inds.append(ind)
+                continue
+
             face_image = face.image
             landmarks = face.landmarks
             if face_image is not None and len(landmarks):
@@ -178,6 +153,9 @@ class PgaTaskRunner(TaskRunner):
                     'pred_age_var'
                 ])
 
+                if face.subject_id is not None:
+                    self.subjects_ids.add(face.subject_id)
+
     def pause(self):
         self._pause = True
         super().pause()
@@ -1,17 +1,27 @@
 import datetime
 from datetime import datetime
 from os import path
+from threading import Lock
 from time import time
+from typing import Any, List, Set, Tuple
 from uuid import uuid4
 
+import cv2 as cv
+import numpy as np
 from django.conf import settings
 from django.utils.timezone import make_aware
 from dnfal import mtypes
+from dnfal.alignment import FaceAligner
 from dnfal.engine import VideoAnalyzer
+from dnfal.genderage import GenderAgePredictor
 from dnfal.settings import Settings
 from dnfal.vision import FacesVision
 
 from .task import TaskRunner, logger, PROGRESS_UPDATE_INTERVAL
+from ..crops import CropsPack, release_task_crops
+from ..hunting import cosine_threshold
+from ..linking import SubjectLinker, shared_subject_linker
+from ..subjects import update_pred_sexage
 from ...models import (
     Subject,
     Face,
@@ -23,6 +33,139 @@ from ...models import (
 )
 
 
+LINK_REFRESH_INTERVAL = 5
+
+
+class AlignedFaceStage:
+    """Post detection stage working on the aligned in-memory face crops.
+
+    It predicts faces attributes, so they are stored together with the
+    face, and fills the aligned crops pack of the task.
+
+    The frame analyzer keeps on each face the crop it aligned for the
+    encoder, at ``ALIGNED_CROP_SIZE``, and the faces of a frame are
+    predicted in a single batch. Faces without an aligned crop are
+    decoded and aligned again. The decoding and alignment time is measured
+    and reported in the task info as ``aligned_stage``, to keep track of
+    the cost added to ingestion.
+    """
+
+    def __init__(
+        self,
+        predict_genderage: bool = False,
+        crops_pack: CropsPack = None
+    ):
+        # noinspection PyTypeChecker
+        self.genderage_predictor: GenderAgePredictor = None
+        if predict_genderage:
+            self.genderage_predictor = GenderAgePredictor(
+                settings.DNFAL_MODELS_PATHS['genderage_predictor']
+            )
+        self.crops_pack: CropsPack = crops_pack
+        self.face_aligner = FaceAligner(out_size=settings.ALIGNED_CROP_SIZE)
+        self.subjects_ids: Set[int] = set()
+        self.aligned_count: int = 0
+        self.decode_time: float = 0
+        self.align_time: float = 0
+        self._lock = Lock()
+
+    def align(self, face: mtypes.Face):
+        face_image_align = getattr(face, 'aligned_image', None)
+        if face_image_align is not None:
+            return face_image_align
+
+        started_at = time()
+        face_image = getattr(face, 'image', None)
+        if face_image is None and face.image_bytes is not None:
+            face_image = cv.imdecode(
+                np.frombuffer(face.image_bytes, np.uint8),
+                cv.IMREAD_COLOR
+            )
+        decoded_at = time()
+
+        if face_image is None or not len(face.landmarks):
+            return None
+
+        face_image_align, _ = self.face_aligner.align(
+            face_image, face.landmarks
+        )
+
+        with self._lock:
+            self.aligned_count += 1
+            self.decode_time += decoded_at - started_at
+            self.align_time += time() - decoded_at
+
+        return face_image_align
+
+    def timings(self) -> dict:
+        """Mean milliseconds per face spent decoding and aligning."""
+        count = max(self.aligned_count, 1)
+        return {
+            'faces_count': self.aligned_count,
+            'decode_ms': 1000 * self.decode_time / count,
+            'align_ms': 1000 * self.align_time / count
+        }
+
+    def predict(self, face_image_align) -> dict:
+        return self.predict_batch([face_image_align])[0]
+
+    def predict_batch(self, faces_images_align: List) -> List[dict]:
+        """Attributes of each face, predicted in a single call."""
+        faces_attributes = [{} for _ in faces_images_align]
+        if self.genderage_predictor is None:
+            return faces_attributes
+
+        inds = [
+            ind for ind, face_image_align in enumerate(faces_images_align)
+            if face_image_align is not None
+        ]
+        if not len(inds):
+            return faces_attributes
+
+        with self._lock:
+            (
+                genders,
+                genders_scores,
+                ages,
+                ages_vars
+            ) = self.genderage_predictor.predict([
+                faces_images_align[ind] for ind in inds
+            ])
+
+        for i, ind in enumerate(inds):
+            attributes = faces_attributes[ind]
+            attributes['pred_sex_score'] = float(genders_scores[i])
+            attributes['pred_age'] = int(ages[i])
+            attributes['pred_age_var'] = float(ages_vars[i])
+            if genders[i] == GenderAgePredictor.GENDER_WOMAN:
+                attributes['pred_sex'] = Face.SEX_WOMAN
+            elif genders[i] == GenderAgePredictor.GENDER_MAN:
+                attributes['pred_sex'] = Face.SEX_MAN
+
+        return faces_attributes
+
+    def prepare(self, faces: List[mtypes.Face]) -> List[Tuple[Any, dict]]:
+        """Aligned crop and attributes of each face."""
+        faces_images_align = [self.align(face) for face in faces]
+        return list(zip(
+            faces_images_align,
+            self.predict_batch(faces_images_align)
+        ))
+
+    def store(
+        self,
+        face_id: int,
+        subject_id: int,
+        face_image_align,
+        attributes: dict
+    ):
+        if len(attributes):
+            self.subjects_ids.add(subject_id)
+
+        if self.crops_pack is not None and face_image_align is not None:
+            self.crops_pack.append(face_id, face_image_align)
+
+
 def create_frame(frame: mtypes.Frame):
 
     frame_name = f'frame_{uuid4()}.jpg'
@@ -32,13 +175,20 @@ def create_frame(frame: mtypes.Frame):
         f.write(frame.image_bytes)
 
     instance = Frame.objects.create(
-        image=rel_path
+        image=rel_path,
+        size_bytes=len(frame.image_bytes)
     )
 
     frame.data['frame_id'] = instance.pk
 
 
-def create_face(face: mtypes.Face, subject_id: int, task_id: int):
+def create_face(
+    face: mtypes.Face,
+    subject_id: int,
+    task_id: int,
+    stage: AlignedFaceStage = None,
+    prepared: Tuple[Any, dict] = None
+) -> Face:
 
     frame_id = None
     if face.frame is not None:
@@ -57,31 +207,107 @@ def create_face(face: mtypes.Face, subject_id: int, task_id: int):
         datetime.fromtimestamp(face.timestamp)
     )
 
-    instance = Face.objects.create(
+    attributes = {}
+    face_image_align = None
+    if stage is not None:
+        if prepared is None:
+            prepared = stage.prepare([face])[0]
+        face_image_align, attributes = prepared
+
+    instance = Face(
         subject_id=subject_id,
         task_id=task_id,
         frame_id=frame_id,
         image=rel_path,
+        size_bytes=len(face.image_bytes),
         box=face.box,
-        embeddings=face.embeddings,
         landmarks=face.landmarks,
-        timestamp=timestamp
+        timestamp=timestamp,
+        **attributes
     )
+    instance.set_embeddings(face.embeddings, settings.DNFAL_ENCODER_VERSION)
+    instance.save()
 
     face.data['key'] = instance.pk
 
-
-def update_face_detect(face: mtypes.Face, task_id: int):
+    if stage is not None:
+        stage.store(instance.pk, subject_id, face_image_align, attributes)
+
+    return instance
+
+
+def create_subject() -> int:
+    return Subject.objects.create().pk
+
+
+def update_faces_detect(
+    faces: List[mtypes.Face],
+    task_id: int,
+    stage: AlignedFaceStage = None,
+    linker: SubjectLinker = None,
+    link_thresh: float = 0
+):
+    """Store the faces detected in a frame, whose attributes are predicted
+    in a single batch."""
+    faces_prepared = [None] * len(faces)
+    if stage is not None:
+        faces_prepared = stage.prepare(faces)
+
+    for face, prepared in zip(faces, faces_prepared):
+        try:
+            update_face_detect(
+                face,
+                task_id,
+                stage=stage,
+                linker=linker,
+                link_thresh=link_thresh,
+                prepared=prepared
+            )
+        except Exception as err:
+            logger.error(err)
+
+
+def update_face_detect(
+    face: mtypes.Face,
+    task_id: int,
+    stage: AlignedFaceStage = None,
+    linker: SubjectLinker = None,
+    link_thresh: float = 0,
+    prepared: Tuple[Any, dict] = None
+):
 
     if face.subject is None:
         logger.error('Invalid operation. Face subject can not be empty.')
         return
 
-    subject_id = face.subject.data.get('subject_id', None)
+    subject_data = face.subject.data
+    subject_id = subject_data.get('subject_id', None)
     if subject_id is None:
-        subject_instance = Subject.objects.create()
-        face.subject.data['subject_id'] = subject_instance.pk
-    create_face(face, face.subject.data['subject_id'], task_id)
+        if linker is not None:
+            subject_data['subject_id'] = linker.link(
+                face.embeddings,
+                link_thresh,
+                create_subject
+            )
+            subject_data['linked_at'] = time()
+        else:
+            subject_data['subject_id'] = create_subject()
+    elif (
+        linker is not None and
+        time() - subject_data.get('linked_at', 0) > LINK_REFRESH_INTERVAL
+    ):
+        # Refresh the subject in the linker as the person moves, without
+        # flooding it with every face of the track.
+        linker.add(subject_id, face.embeddings)
+        subject_data['linked_at'] = time()
+
+    create_face(
+        face,
+        face.subject.data['subject_id'],
+        task_id,
+        stage=stage,
+        prepared=prepared
+    )
 
 
 class VdfTaskRunner(TaskRunner):
@@ -99,6 +325,7 @@ class VdfTaskRunner(TaskRunner):
         se.encoder_weights_path = settings.DNFAL_MODELS_PATHS['face_encoder']
 
         task_config = VdfTaskConfig(**task.config)
+
         video_source_type = task_config.video_source_type
 
         if video_source_type == VdfTaskConfig.VIDEO_SOURCE_RECORD:
@@ -126,26 +353,92 @@ class VdfTaskRunner(TaskRunner):
 
         # noinspection PyTypeChecker
         self.faces_vision: FacesVision = None
+        # noinspection PyTypeChecker
+        self.aligned_stage: AlignedFaceStage = None
+
+        # noinspection PyTypeChecker
+        self.subject_linker: SubjectLinker = None
+        self.link_thresh: float = cosine_threshold(
+            task_config.link_similarity_thresh
+        )
+        if task_config.link_subjects:
+            self.subject_linker = shared_subject_linker(
+                settings.DNFAL_ENCODER_VERSION
+            )
+
+        # Faces detected in the current frame, stored once it is analyzed
+        self.frame_faces: List[mtypes.Face] = []
+
+        use_aligned_stage = (
+            task_config.predict_genderage or task_config.store_aligned_crops
+        )
+        if use_aligned_stage:
+            # The encoder resizes the aligned crops to its input size
+            se.face_align_size = settings.ALIGNED_CROP_SIZE
 
         self.init_vision(se)
 
+        if use_aligned_stage:
+            crops_pack = None
+            if task_config.store_aligned_crops:
+                crops_pack = CropsPack.for_task(task.pk)
+            self.aligned_stage = AlignedFaceStage(
+                predict_genderage=task_config.predict_genderage,
+                crops_pack=crops_pack
+            )
+
     def init_vision(self, vision_settings):
         self.faces_vision = FacesVision(vision_settings)
 
     def main_run(self):
-        self.faces_vision.video_analyzer.run(
-            frame_callback=self.on_frame,
-            update_subject_callback=self.on_subject_updated
-        )
+        if self.aligned_stage is not None:
+            # Faces keep the crop aligned for the encoder
+            self.faces_vision.frame_analyzer.store_aligned = True
+
+        try:
+            self.faces_vision.video_analyzer.run(
+                frame_callback=self.on_frame,
+                update_subject_callback=self.on_subject_updated
+            )
+        finally:
+            self.store_frame_faces()
+            # Pending faces may still append their crops, and their
+            # subjects are aggregated next.
+            self.executor.shutdown(wait=True)
+            if (
+                self.aligned_stage is not None and
+                self.aligned_stage.crops_pack is not None
+            ):
+                release_task_crops(self.task.pk)
+
+        if self.aligned_stage is not None:
+            update_pred_sexage(self.aligned_stage.subjects_ids)
+
+            timings = self.aligned_stage.timings()
+            self.task.info['aligned_stage'] = timings
+            logger.info(
+                f'Task [{self.task.pk}] aligned {timings["faces_count"]} '
+                f'faces, {timings["decode_ms"]:.2f}ms decoding and '
+                f'{timings["align_ms"]:.2f}ms aligning per face.'
+            )
 
     def on_subject_updated(self, face: Face):
-        self.executor.submit(
-            update_face_detect,
-            face=face,
-            task_id=self.task.pk
-        )
+        self.frame_faces.append(face)
+
+    def store_frame_faces(self):
+        if len(self.frame_faces):
+            self.executor.submit(
+                update_faces_detect,
+                faces=self.frame_faces,
+                task_id=self.task.pk,
+                stage=self.aligned_stage,
+                linker=self.subject_linker,
+                link_thresh=self.link_thresh
+            )
+            self.frame_faces = []
 
     def on_frame(self):
+        self.store_frame_faces()
         now = time()
         if (now - self.last_progress_update) > PROGRESS_UPDATE_INTERVAL:
             self.last_progress_update = now
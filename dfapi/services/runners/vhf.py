@@ -1,9 +1,22 @@
+from threading import Lock
+from time import time
+from typing import Dict, Iterable, Optional, Set
+
+from django.conf import settings
 from dnfal import mtypes
-from dnfal.engine import VideoAnalyzer
 from dnfal.settings import Settings
 
 from .task import logger
-from .vdf import VdfTaskRunner, create_face
+from .vdf import VdfTaskRunner, AlignedFaceStage, create_face
+from ..alerts import publish_hunt_alert
+from ..hunting import (
+    HuntIndex,
+    cosine_threshold,
+    engine_similarity,
+    get_hunt_match,
+    shared_hunt_index,
+    subjects_embeddings
+)
 from ...models import (
     Subject,
     Face,
@@ -12,8 +25,17 @@ from ...models import (
     Task
 )
 
+HUNT_RELOAD_INTERVAL = 5
+
 
-def update_face_hunt(face: mtypes.Face, task_id: int):
+def update_face_hunt(
+    face: mtypes.Face,
+    task_id: int,
+    stage: AlignedFaceStage = None,
+    score: Optional[float] = None
+):
+    """Store a face of a hunted subject. A ``score`` is given when the
+    match was just confirmed, and an alert is published for it."""
 
     if face.subject is None:
         logger.error('Invalid operation. Face subject can not be empty.')
@@ -31,41 +53,131 @@ def update_face_hunt(face: mtypes.Face, task_id: int):
         face.subject.data['subject_id'] = subject_instance.pk
         hunt_match.matched_subject = subject_instance
         hunt_match.save(update_fields=['matched_subject'])
-    create_face(face, subject_instance.pk, task_id)
+    instance = create_face(face, subject_instance.pk, task_id, stage=stage)
+
+    if score is not None:
+        publish_hunt_alert(hunt_match, instance, score, face.timestamp)
 
 
 class VhfTaskRunner(VdfTaskRunner):
+    """Hunt the subjects of a watch list in a video stream.
+
+    Detections are matched by the runner against the hunt index shared by
+    every hunt task of the worker, instead of by the video analyzer. The
+    watch list is reloaded from the task config while the task runs, so
+    hunted subjects can be added or removed without restarting it.
+    """
 
     def __init__(self, task: Task, daemon: bool = True):
+        self.version: str = settings.DNFAL_ENCODER_VERSION
+        self.hunt_index: HuntIndex = shared_hunt_index(self.version)
+        self.hunted_subjects: Set[int] = set()
+        self.hunt_matches: Dict[int, int] = {}
+        self.hunt_lock = Lock()
+        self.last_hunt_reload: float = 0
+        self.hunt_reloading: bool = False
+
         super().__init__(task, daemon)
 
+        task_config = VhfTaskConfig(**self.task.config)
+        # The threshold is given in the scale of the recognition engine
+        self.sim_thresh: float = cosine_threshold(
+            task_config.similarity_thresh
+        )
+
     def init_vision(self, vision_settings: Settings):
         task_config = VhfTaskConfig(**self.task.config)
+        self.update_hunted_subjects(task_config.hunted_subjects)
+        super().init_vision(vision_settings)
 
-        embeddings = []
-        keys = []
-        subjects = Subject.objects.filter(
-            pk__in=task_config.hunted_subjects
-        )
+    def main_run(self):
+        try:
+            super().main_run()
+        finally:
+            # Pending faces need the hunt matches of the task
+            self.executor.shutdown(wait=True)
+            self.update_hunted_subjects([])
 
-        for subject in subjects:
-            hunt_match = HuntMatch.objects.create(
-                target_subject=subject,
-                task=self.task
-            )
-            for face in subject.faces.all():
-                keys.append(hunt_match.pk)
-                embeddings.append(face.embeddings)
+    def update_hunted_subjects(self, subjects_ids: Iterable):
+        subjects_ids = {int(subject_id) for subject_id in subjects_ids}
+        with self.hunt_lock:
+            added = subjects_ids - self.hunted_subjects
+            removed = self.hunted_subjects - subjects_ids
+            hunted_subjects = self.hunted_subjects - removed
 
-        vision_settings.video_mode = VideoAnalyzer.MODE_HUNT
-        vision_settings.video_hunt_embeddings = embeddings
-        vision_settings.video_hunt_keys = keys
+            if len(added):
+                embeddings = subjects_embeddings(list(added), self.version)
+                for subject in Subject.objects.filter(pk__in=added):
+                    hunt_match = get_hunt_match(self.task.pk, subject.pk)
+                    self.hunt_matches[subject.pk] = hunt_match.pk
+                    self.hunt_index.add_subject(
+                        subject.pk,
+                        embeddings[subject.pk]
+                    )
+                    hunted_subjects.add(subject.pk)
 
-        super().init_vision(vision_settings)
+            for subject_id in removed:
+                self.hunt_index.remove_subject(subject_id)
+                self.hunt_matches.pop(subject_id, None)
+
+            # Matching threads read the set without locking, so it is
+            # replaced instead of updated in place.
+            self.hunted_subjects = hunted_subjects
+
+    def reload_hunted_subjects(self):
+        try:
+            config = Task.objects.filter(
+                pk=self.task.pk
+            ).values_list('config', flat=True).first()
+            task_config = VhfTaskConfig(**(config or {}))
+            self.update_hunted_subjects(task_config.hunted_subjects)
+        except Exception as err:
+            logger.error(err)
+        finally:
+            self.hunt_reloading = False
+
+    def hunt_face(self, face: mtypes.Face):
+        if face.subject is None:
+            logger.error('Invalid operation. Face subject can not be empty.')
+            return
+
+        score = None
+        if face.subject.data.get('hunt_key', None) is None:
+            match = self.hunt_index.match(
+                face.embeddings,
+                self.sim_thresh,
+                self.hunted_subjects
+            )
+            if match is None:
+                return
+            target_id, cosine = match
+            score = engine_similarity(cosine)
+            hunt_match_id = self.hunt_matches.get(target_id, None)
+            if hunt_match_id is None:
+                return
+            face.subject.data['hunt_key'] = hunt_match_id
+            HuntMatch.objects.filter(
+                pk=hunt_match_id,
+                score__lt=score
+            ).update(score=score)
+
+        update_face_hunt(
+            face,
+            self.task.pk,
+            stage=self.aligned_stage,
+            score=score
+        )
 
     def on_subject_updated(self, face: Face):
-        self.executor.submit(
-            update_face_hunt,
-            face=face,
-            task_id=self.task.pk
-        )
\ No newline at end of file
+        self.executor.submit(self.hunt_face, face)
+
+    def on_frame(self):
+        now = time()
+        if (
+            not self.hunt_reloading and
+            now - self.last_hunt_reload > HUNT_RELOAD_INTERVAL
+        ):
+            self.last_hunt_reload = now
+            self.hunt_reloading = True
+            self.executor.submit(self.reload_hunted_subjects)
+        super().on_frame()
@@ -0,0 +1,372 @@
+"""Scatter-gather recognition over shards partitioned by subject.
+
+Every shard indexes only the faces of the subjects assigned to it, so a
+query is sent to all the shards, each one answers with its best subjects
+and the coordinator merges them. Since a subject lives in a single shard,
+merging the top subjects of every shard gives the global top subjects.
+
+Shards are keyed by their worker primary key, and subjects are assigned
+to them by rendezvous hashing. Shards score faces with the face matcher
+of the recognition engine, as recognition without sharding does.
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import Process, Queue
+from queue import Empty as QueueEmptyError
+from typing import Iterable, List, Sequence, Tuple
+
+import numpy as np
+from django.conf import settings
+
+from .exceptions import ServiceError
+from .face_index import get_face_index, shard_of
+from ..models import SubjectSegment, Worker
+
+logger_name = settings.LOGGER_NAME
+logger = logging.getLogger(logger_name)
+
+Matches = List[Tuple[int, float]]
+
+SHARD_WAIT_TIMEOUT = 30
+
+
+def top_subjects(
+    embeddings: np.ndarray,
+    subjects: np.ndarray,
+    query: np.ndarray,
+    sim_thresh: float,
+    count: int,
+    face_matcher=None
+) -> Matches:
+    """Best subjects by similarity to ``query``, best first, see
+    ``top_subjects_batch``."""
+    return top_subjects_batch(
+        embeddings,
+        subjects,
+        np.asarray(query, np.float32).reshape((1, -1)),
+        sim_thresh,
+        count,
+        face_matcher
+    )[0]
+
+
+def top_subjects_batch(
+    embeddings: np.ndarray,
+    subjects: np.ndarray,
+    queries: np.ndarray,
+    sim_thresh: float,
+    count: int,
+    face_matcher=None
+) -> List[Matches]:
+    """Best subjects by similarity to each row of ``queries``, best first.
+
+    Faces are scored by ``face_matcher``, the matcher of the recognition
+    engine. Without it, which is only the case of the process shards used
+    as stand-ins of worker nodes, the cosine similarity is used instead.
+    A subject is scored by its most similar face. A ``count`` of zero
+    returns every subject above the threshold.
+    """
+    queries = np.asarray(queries, np.float32)
+    queries = queries.reshape((-1, queries.shape[-1]))
+    if not len(subjects):
+        return [[] for _ in queries]
+
+    if face_matcher is not None:
+        face_matcher.similarity_threshold = float(sim_thresh)
+        queries_subjects, queries_scores = face_matcher.match(
+            x_test=queries,
+            x_train=embeddings,
+            y_train=subjects
+        )
+        results = []
+        for subject_ids, scores in zip(queries_subjects, queries_scores):
+            if 0 < count < len(subject_ids):
+                subject_ids = subject_ids[0:count]
+                scores = scores[0:count]
+            results.append([
+                (int(subject_id), float(score))
+                for subject_id, score in zip(subject_ids, scores)
+            ])
+        return results
+
+    norms = np.outer(
+        np.linalg.norm(queries, axis=1),
+        np.linalg.norm(embeddings, axis=1)
+    )
+    queries_similarities = (queries @ embeddings.T) / np.where(
+        norms > 0, norms, 1
+    )
+
+    results = []
+    for similarities in queries_similarities:
+        matches = []
+        seen = set()
+        for ind in np.argsort(-similarities):
+            score = float(similarities[ind])
+            if score < sim_thresh:
+                break
+            subject_id = int(subjects[ind])
+            if subject_id in seen:
+                continue
+            seen.add(subject_id)
+            matches.append((subject_id, score))
+            if len(matches) == count:
+                break
+        results.append(matches)
+
+    return results
+
+
+def merge_matches(results: Sequence[Matches], count: int) -> Matches:
+    best = {}
+    for matches in results:
+        for subject_id, score in matches:
+            if score > best.get(subject_id, -np.inf):
+                best[subject_id] = score
+    merged = sorted(best.items(), key=lambda item: item[1], reverse=True)
+    if count > 0:
+        merged = merged[0:count]
+    return merged
+
+
+def search_shard(
+    queries: np.ndarray,
+    shard_key: int,
+    shard_keys: Iterable[int],
+    segments_ids: List[int],
+    sim_thresh: float,
+    count: int,
+    face_matcher
+) -> List[Matches]:
+    index = get_face_index(shard=(shard_key, tuple(sorted(shard_keys))))
+    segments = list(SubjectSegment.objects.filter(pk__in=segments_ids))
+    if not len(segments):
+        segments = [SubjectSegment()]
+    embeddings, subjects = index.segments_data(segments)
+    return top_subjects_batch(
+        embeddings,
+        subjects,
+        queries,
+        sim_thresh,
+        count,
+        face_matcher
+    )
+
+
+class LocalShard:
+    """Shard served by the current process."""
+
+    def __init__(
+        self,
+        shard_key: int,
+        shard_keys: Tuple[int, ...],
+        face_matcher
+    ):
+        self.shard_key: int = shard_key
+        self.shard_keys: Tuple[int, ...] = shard_keys
+        self.face_matcher = face_matcher
+
+    def search(
+        self,
+        queries: np.ndarray,
+        segments_ids: List[int],
+        sim_thresh: float,
+        count: int
+    ) -> List[Matches]:
+        return search_shard(
+            queries,
+            self.shard_key,
+            self.shard_keys,
+            segments_ids,
+            sim_thresh,
+            count,
+            self.face_matcher
+        )
+
+
+class RemoteShard:
+    """Shard served by another worker node through its API."""
+
+    def __init__(
+        self,
+        worker: Worker,
+        worker_api,
+        shard_key: int,
+        shard_keys: Tuple[int, ...]
+    ):
+        self.worker: Worker = worker
+        self.worker_api = worker_api
+        self.shard_key: int = shard_key
+        self.shard_keys: Tuple[int, ...] = shard_keys
+
+    def search(
+        self,
+        queries: np.ndarray,
+        segments_ids: List[int],
+        sim_thresh: float,
+        count: int
+    ) -> List[Matches]:
+        matches = self.worker_api.search_shard(
+            data={
+                'embeddings': np.asarray(queries, np.float32).tolist(),
+                'shard_key': self.shard_key,
+                'shard_keys': list(self.shard_keys),
+                'segments': segments_ids,
+                'sim_thresh': sim_thresh,
+                'max_matches': count
+            },
+            username=self.worker.username,
+            password=self.worker.password
+        )
+        if matches is None:
+            raise ServiceError(
+                f'Shard {self.shard_key} at {self.worker.api_url} did not '
+                f'respond.'
+            )
+        return [
+            [(match['subject'], match['score']) for match in query_matches]
+            for query_matches in matches
+        ]
+
+
+def _serve_shard(
+    embeddings: np.ndarray,
+    subjects: np.ndarray,
+    recv_queue: Queue,
+    send_queue: Queue
+):
+    while True:
+        request = recv_queue.get()
+        if request is None:
+            break
+        send_queue.put(top_subjects_batch(embeddings, subjects, **request))
+
+
+class ProcessShard:
+    """Local stand-in of a worker node holding a fixed gallery shard in its
+    own process. Segment filters are not applied."""
+
+    def __init__(self, embeddings: np.ndarray, subjects: np.ndarray):
+        self.send_queue = Queue()
+        self.recv_queue = Queue()
+        self.process = Process(
+            target=_serve_shard,
+            kwargs={
+                'embeddings': embeddings,
+                'subjects': subjects,
+                'recv_queue': self.send_queue,
+                'send_queue': self.recv_queue
+            },
+            daemon=True
+        )
+        self.process.start()
+
+    @classmethod
+    def partition(
+        cls,
+        embeddings: np.ndarray,
+        subjects: np.ndarray,
+        shards_count: int
+    ) -> List['ProcessShard']:
+        shards = shard_of(subjects, range(shards_count))
+        return [
+            cls(embeddings[shards == key], subjects[shards == key])
+            for key in range(shards_count)
+        ]
+
+    def search(
+        self,
+        queries: np.ndarray,
+        segments_ids: List[int],
+        sim_thresh: float,
+        count: int
+    ) -> List[Matches]:
+        self.send_queue.put({
+            'queries': queries,
+            'sim_thresh': sim_thresh,
+            'count': count
+        })
+        try:
+            return self.recv_queue.get(timeout=SHARD_WAIT_TIMEOUT)
+        except QueueEmptyError:
+            raise ServiceError('Shard search timeout.')
+
+    def terminate(self):
+        if self.process.is_alive():
+            self.send_queue.put(None)
+            self.process.join(timeout=SHARD_WAIT_TIMEOUT)
+
+
+def worker_shards(face_matcher) -> list:
+    """One shard per registered worker, keyed by its primary key."""
+    # The task runners import this module through the faces service, so
+    # the workers service can not be imported at module level.
+    from .workers import WorkerApi
+
+    workers = list(Worker.objects.order_by('pk'))
+    shard_keys = tuple(worker.pk for worker in workers)
+    return [
+        LocalShard(worker.pk, shard_keys, face_matcher) if worker.is_self()
+        else RemoteShard(
+            worker,
+            WorkerApi(api_url=worker.api_url),
+            worker.pk,
+            shard_keys
+        )
+        for worker in workers
+    ]
+
+
+def scatter_gather(
+    shards: list,
+    query: np.ndarray,
+    segments_ids: List[int],
+    sim_thresh: float,
+    count: int
+) -> Matches:
+    """Best subjects of ``query`` over every shard, see
+    ``scatter_gather_batch``."""
+    return scatter_gather_batch(
+        shards,
+        np.asarray(query, np.float32).reshape((1, -1)),
+        segments_ids,
+        sim_thresh,
+        count
+    )[0]
+
+
+def scatter_gather_batch(
+    shards: list,
+    queries: np.ndarray,
+    segments_ids: List[int],
+    sim_thresh: float,
+    count: int
+) -> List[Matches]:
+    """Send the ``queries`` to every shard concurrently, in a single request
+    each, and merge the best subjects of each query.
+
+    Shards that fail are logged and skipped, so an offline node degrades
+    recall instead of failing the recognition.
+    """
+    if not len(shards):
+        return [[] for _ in queries]
+
+    with ThreadPoolExecutor(max_workers=len(shards)) as executor:
+        futures = [
+            executor.submit(
+                shard.search, queries, segments_ids, sim_thresh, count
+            )
+            for shard in shards
+        ]
+
+    results = []
+    for future in futures:
+        try:
+            results.append(future.result())
+        except Exception as err:
+            logger.error(err)
+
+    return [
+        merge_matches([shard_matches[ind] for shard_matches in results], count)
+        for ind in range(len(queries))
+    ]
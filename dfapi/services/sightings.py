@@ -0,0 +1,261 @@
+from datetime import timedelta
+from threading import Lock
+from typing import Dict, Iterable, Optional, Tuple
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Max, Min, QuerySet
+from django.db.models.functions import Greatest, Least
+
+from django.http import QueryDict
+
+from ..models import (
+    Camera,
+    Face,
+    Sighting,
+    Task,
+    VideoRecord,
+    VTaskConfig
+)
+
+Source = Tuple[Optional[int], Optional[int]]
+
+_tasks_sources: Dict[int, Source] = {}
+_tasks_sources_lock = Lock()
+
+
+def task_source(task_id: int) -> Source:
+    """Camera and video record ids of a task video source. Cached, since
+    the video source of a task does not change once it has faces."""
+    with _tasks_sources_lock:
+        source = _tasks_sources.get(task_id, None)
+    if source is not None:
+        return source
+
+    config = Task.objects.filter(
+        pk=task_id
+    ).values_list('config', flat=True).first()
+    config = VTaskConfig(**(config or {}))
+
+    camera_id, video_id = None, None
+    if config.video_source_type == VTaskConfig.VIDEO_SOURCE_CAMERA:
+        if Camera.objects.filter(pk=config.video_source_id).exists():
+            camera_id = config.video_source_id
+    elif config.video_source_type == VTaskConfig.VIDEO_SOURCE_RECORD:
+        if VideoRecord.objects.filter(pk=config.video_source_id).exists():
+            video_id = config.video_source_id
+
+    source = (camera_id, video_id)
+    with _tasks_sources_lock:
+        _tasks_sources[task_id] = source
+    return source
+
+
+def add_face(face: Face):
+    """Extend the open sighting of the face subject in its task, or start
+    a new one.
+
+    The common case, a face extending one sighting, is a single UPDATE
+    that only locks that row. When the face bridges several sightings they
+    are merged, and concurrent first faces of a track that started two
+    sightings are merged by the next face.
+    """
+    if (
+        face.subject_id is None or
+        face.task_id is None or
+        face.timestamp is None
+    ):
+        return
+
+    timestamp = face.timestamp
+    track = sightings_near(face.subject_id, face.task_id, timestamp)
+    updated = track.update(
+        first_seen=Least(F('first_seen'), timestamp),
+        last_seen=Greatest(F('last_seen'), timestamp),
+        faces_count=F('faces_count') + 1
+    )
+
+    if updated == 0:
+        camera_id, video_id = task_source(face.task_id)
+        Sighting.objects.create(
+            subject_id=face.subject_id,
+            task_id=face.task_id,
+            camera_id=camera_id,
+            video_id=video_id,
+            first_seen=timestamp,
+            last_seen=timestamp,
+            faces_count=1
+        )
+    elif updated > 1:
+        merge(face.subject_id, face.task_id, timestamp)
+
+
+def sightings_near(subject_id: int, task_id: int, timestamp) -> QuerySet:
+    """Sightings of a subject in a task that a face at ``timestamp``
+    extends."""
+    max_gap = timedelta(seconds=settings.SIGHTING_MAX_GAP)
+    return Sighting.objects.filter(
+        subject_id=subject_id,
+        task_id=task_id,
+        last_seen__gte=timestamp - max_gap,
+        first_seen__lte=timestamp + max_gap
+    )
+
+
+def merge(subject_id: int, task_id: int, timestamp):
+    """Merge the sightings bridged by a face at ``timestamp``, which was
+    counted by each of them."""
+    with transaction.atomic():
+        track = list(sightings_near(
+            subject_id, task_id, timestamp
+        ).select_for_update().order_by('first_seen', 'pk'))
+        if len(track) < 2:
+            return
+
+        sighting = track[0]
+        sighting.first_seen = min(item.first_seen for item in track)
+        sighting.last_seen = max(item.last_seen for item in track)
+        sighting.faces_count = (
+            sum(item.faces_count for item in track) - len(track) + 1
+        )
+        sighting.save(update_fields=['first_seen', 'last_seen', 'faces_count'])
+        Sighting.objects.filter(
+            pk__in=[item.pk for item in track[1:]]
+        ).delete()
+
+
+def remove_face(face: Face):
+    """Shrink or split the sighting of a deleted face."""
+    if (
+        face.subject_id is None or
+        face.task_id is None or
+        face.timestamp is None
+    ):
+        return
+
+    max_gap = timedelta(seconds=settings.SIGHTING_MAX_GAP)
+    timestamp = face.timestamp
+
+    with transaction.atomic():
+        sighting = Sighting.objects.select_for_update().filter(
+            subject_id=face.subject_id,
+            task_id=face.task_id,
+            first_seen__lte=timestamp,
+            last_seen__gte=timestamp
+        ).order_by('pk').first()
+        if sighting is None:
+            return
+
+        faces = Face.objects.filter(
+            subject_id=face.subject_id,
+            task_id=face.task_id,
+            timestamp__gte=sighting.first_seen,
+            timestamp__lte=sighting.last_seen
+        )
+        before = faces.filter(timestamp__lte=timestamp).aggregate(
+            first_seen=Min('timestamp'),
+            last_seen=Max('timestamp'),
+            faces_count=Count('pk')
+        )
+        after = faces.filter(timestamp__gt=timestamp).aggregate(
+            first_seen=Min('timestamp'),
+            last_seen=Max('timestamp'),
+            faces_count=Count('pk')
+        )
+
+        parts = [part for part in (before, after) if part['faces_count']]
+        if not len(parts):
+            sighting.delete()
+            return
+        if (
+            len(parts) == 2 and
+            after['first_seen'] - before['last_seen'] <= max_gap
+        ):
+            parts = [{
+                'first_seen': before['first_seen'],
+                'last_seen': after['last_seen'],
+                'faces_count': before['faces_count'] + after['faces_count']
+            }]
+
+        for field, value in parts[0].items():
+            setattr(sighting, field, value)
+        sighting.save(update_fields=['first_seen', 'last_seen', 'faces_count'])
+
+        if len(parts) == 2:
+            # The face was the only one bridging both parts
+            Sighting.objects.create(
+                subject_id=sighting.subject_id,
+                task_id=sighting.task_id,
+                camera_id=sighting.camera_id,
+                video_id=sighting.video_id,
+                **parts[1]
+            )
+
+
+def rebuild(subjects_ids: Iterable[int]):
+    """Recompute the sightings of some subjects from their faces, after
+    faces are moved between subjects in bulk."""
+    subjects_ids = list(subjects_ids)
+    if not len(subjects_ids):
+        return
+
+    max_gap = timedelta(seconds=settings.SIGHTING_MAX_GAP)
+
+    faces = Face.objects.filter(
+        subject_id__in=subjects_ids,
+        task__isnull=False,
+        timestamp__isnull=False
+    ).order_by(
+        'subject_id', 'task_id', 'timestamp'
+    ).values_list('subject_id', 'task_id', 'timestamp')
+
+    sightings = []
+    sighting: Optional[Sighting] = None
+    for subject_id, task_id, timestamp in faces.iterator():
+        if (
+            sighting is None or
+            sighting.subject_id != subject_id or
+            sighting.task_id != task_id or
+            timestamp - sighting.last_seen > max_gap
+        ):
+            camera_id, video_id = task_source(task_id)
+            sighting = Sighting(
+                subject_id=subject_id,
+                task_id=task_id,
+                camera_id=camera_id,
+                video_id=video_id,
+                first_seen=timestamp,
+                last_seen=timestamp,
+                faces_count=0
+            )
+            sightings.append(sighting)
+        sighting.last_seen = timestamp
+        sighting.faces_count += 1
+
+    with transaction.atomic():
+        Sighting.objects.filter(subject_id__in=subjects_ids).delete()
+        Sighting.objects.bulk_create(sightings, batch_size=1000)
+
+
+def trajectory(subject_id: int, params: QueryDict) -> QuerySet:
+    """Sightings of a subject overlapping the requested time range, in
+    chronological order."""
+    queryset = Sighting.objects.filter(subject_id=subject_id)
+
+    min_timestamp = params.get('min_timestamp', None)
+    if min_timestamp is not None:
+        queryset = queryset.filter(last_seen__gte=min_timestamp)
+
+    max_timestamp = params.get('max_timestamp', None)
+    if max_timestamp is not None:
+        queryset = queryset.filter(first_seen__lte=max_timestamp)
+
+    cameras = params.getlist('cameras', None)
+    if cameras is not None and len(cameras):
+        queryset = queryset.filter(camera__in=cameras)
+
+    videos = params.getlist('videos', None)
+    if videos is not None and len(videos):
+        queryset = queryset.filter(video__in=videos)
+
+    return queryset.order_by('first_seen', 'pk')
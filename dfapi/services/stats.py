@@ -1,229 +1,359 @@
+from collections import defaultdict
 from datetime import datetime, timedelta
+from typing import Dict, Iterable, Tuple
+
+from django.db import connections, router, transaction
+from django.db.models import Count, F, FloatField, IntegerField, Q, Sum
+from django.db.models.functions import TruncDay, TruncHour
+from django.utils.timezone import localtime, make_aware
+
+from .media import json_value
+from ..models import (
+    Face,
+    Subject,
+    Task,
+    Frame,
+    VideoRecord,
+    Camera,
+    Stat,
+    StatDelta
+)
+
+
+# Count and size stats of every stored model
+TOTAL_STATS = (
+    (Face, 'stored_faces', 'faces_image_size'),
+    (Frame, 'stored_frames', 'frames_image_size'),
+    (VideoRecord, 'stored_videos', 'videos_size'),
+    (Subject, 'stored_subjects', None),
+    (Camera, 'stored_cameras', None),
+    (Task, 'stored_tasks', None)
+)
+
+TOTAL_COUNTERS = {
+    model: (count_name, size_name)
+    for model, count_name, size_name in TOTAL_STATS
+}
+
+
+def set_totals(values: Dict[str, float]):
+    now = make_aware(datetime.now())
+    for name, value in values.items():
+        Stat.objects.update_or_create(
+            name=name,
+            resolution=Stat.RESOLUTION_ALL,
+            defaults={'value': value, 'timestamp': now}
+        )
 
-from django.db.models import Sum
-from django.utils.timezone import make_aware
-
-from ..models import Face, Subject, Task, Frame, VideoRecord, Camera, Stat
-
-
-def update_total_stats():
-
-    def faces_image_size():
-        result = Face.objects.all().aggregate(
-            Sum('size_bytes'))['size_bytes__sum']
-        return result if result is not None else 0
-
-    def frames_image_size():
-        result = Frame.objects.all().aggregate(
-            Sum('size_bytes'))['size_bytes__sum']
-        return result if result is not None else 0
-
-    def videos_size():
-        result = VideoRecord.objects.all().aggregate(
-            Sum('size_bytes'))['size_bytes__sum']
-        return result if result is not None else 0
-
-    def stored_subjects_eval():
-        # return randint(0, 50)
-        result = Subject.objects.filter().count()
-        return result
-
-    def stored_faces_eval():
-        # return randint(0, 50)
-        result = Face.objects.filter().count()
-        return result
-
-    def stored_frames_eval():
-        # return randint(0, 50)
-        result = Frame.objects.filter().count()
-        return result
-
-    def stored_cameras_eval():
-        # return randint(0, 50)
-        result = Camera.objects.filter().count()
-        return result
-
-    def stored_videos_eval():
-        # return randint(0, 50)
-        result = VideoRecord.objects.filter().count()
-        return result
-
-    def stored_tasks_eval():
-        # return randint(0, 50)
-        result = Task.objects.filter().count()
-        return result
-
-    stats_kwargs = [
-        {
-            'name': 'faces_image_size',
-            'value_eval': faces_image_size
-        }, {
-            'name': 'frames_image_size',
-            'value_eval': frames_image_size
-        }, {
-            'name': 'videos_size',
-            'value_eval': videos_size
-        }, {
-            'name': 'stored_subjects',
-            'value_eval': stored_subjects_eval
-        }, {
-            'name': 'stored_faces',
-            'value_eval': stored_faces_eval
-        }, {
-            'name': 'stored_frames',
-            'value_eval': stored_frames_eval
-        }, {
-            'name': 'stored_cameras',
-            'value_eval': stored_cameras_eval
-        }, {
-            'name': 'stored_videos',
-            'value_eval': stored_videos_eval
-        }, {
-            'name': 'stored_tasks',
-            'value_eval': stored_tasks_eval
-        }
-    ]
 
-    for stat_kwargs in stats_kwargs:
-        stat, _ = Stat.objects.get_or_create(
-            name=stat_kwargs['name'],
-            resolution=Stat.RESOLUTION_ALL
-        )
-        stat.timestamp = make_aware(datetime.now())
-        stat.value = stat_kwargs['value_eval']()
-        stat.save()
-
-
-def update_time_stats(resolution):
-
-    def faces_count_eval(min_timestamp, max_timestamp):
-        # return randint(0, 100)
-        result = Task.objects.filter(
-            created_at__gt=min_timestamp,
-            created_at__lte=max_timestamp
-        ).aggregate(Sum('faces_count'))['faces_count__sum']
-        return result if result is not None else 0
-
-    def frames_count_eval(min_timestamp, max_timestamp):
-        # return randint(0, 1000)
-        result = Task.objects.filter(
-            created_at__gt=min_timestamp,
-            created_at__lte=max_timestamp
-        ).aggregate(Sum('frames_count'))['frames_count__sum']
-        return result if result is not None else 0
-
-    def processing_time_eval(min_timestamp, max_timestamp):
-        # return 7200 * random() + 1800
-        result = Task.objects.filter(
-            created_at__gt=min_timestamp,
-            created_at__lte=max_timestamp
-        ).aggregate(Sum('processing_time'))['processing_time__sum']
-        return result if result is not None else 0
-
-    def tasks_count_eval(min_timestamp, max_timestamp):
-        # return 7200 * random() + 1800
-        result = Task.objects.filter(
-            created_at__gt=min_timestamp,
-            created_at__lte=max_timestamp,
-            status__in=[Task.STATUS_SUCCESS, Task.STATUS_STOPPED, Task.STATUS_KILLED]
-        ).distinct().count()
-        return result if result is not None else 0
-
-    stats_kwargs = [
-        {
-            'name': 'faces_count',
-            'value_eval': faces_count_eval
-        }, {
-            'name': 'frames_count',
-            'value_eval': frames_count_eval
-        }, {
-            'name': 'processing_time',
-            'value_eval': processing_time_eval
-        }, {
-            'name': 'tasks_count',
-            'value_eval': tasks_count_eval
-        }
-    ]
+def add_totals(deltas: Dict[str, float]):
+    """Append ``deltas`` to the log of pending total stats changes.
+
+    Inserting rows does not lock the counters, so concurrent writers do not
+    wait on each other. Connections are in autocommit mode, so the deltas
+    are logged right away, even if the change they account for is rolled
+    back later by a transaction of the caller. ``fold_totals`` adds them to
+    the counters.
+    """
+    StatDelta.objects.bulk_create([
+        StatDelta(name=name, delta=delta)
+        for name, delta in deltas.items() if delta
+    ])
+
+
+def fold_totals():
+    """Add the pending deltas to the total stats counters.
+
+    Deltas are deleted and read with a single statement, so concurrent
+    folds never add them twice. Counters that were never computed by
+    ``update_total_stats`` are left alone, since a delta is meaningless
+    without a starting value.
+    """
+    with transaction.atomic(using=router.db_for_write(StatDelta)):
+        with connections[router.db_for_write(StatDelta)].cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {StatDelta._meta.db_table} '
+                f'RETURNING name, delta'
+            )
+            rows = cursor.fetchall()
+
+        deltas = defaultdict(float)
+        for name, delta in rows:
+            deltas[name] += delta
 
-    for stat_kwargs in stats_kwargs:
-        update_stat(resolution=resolution, **stat_kwargs)
-
-
-def update_stat(name: str, resolution: str, value_eval: callable):
-
-    if resolution == Stat.RESOLUTION_HOUR:
-        replace_kwargs = {
-            'minute': 0,
-            'second': 0,
-            'microsecond': 0
-        }
-        backward_kwargs = {'hours': 24}
-        forward_kwargs = {'hours': 1}
-    elif resolution == Stat.RESOLUTION_DAY:
-        replace_kwargs = {
-            'hour': 0,
-            'minute': 0,
-            'second': 0,
-            'microsecond': 0
-        }
-        backward_kwargs = {'days': 30}
-        forward_kwargs = {'hours': 24}
+        now = make_aware(datetime.now())
+        for name, delta in deltas.items():
+            if not delta:
+                continue
+            Stat.objects.filter(
+                name=name,
+                resolution=Stat.RESOLUTION_ALL
+            ).update(value=F('value') + delta, timestamp=now)
+
+
+def instance_totals(instance, sign: int = 1) -> Dict[str, float]:
+    """Total counters deltas of adding (``sign`` 1) or removing (``sign``
+    -1) a stored ``instance``."""
+    count_name, size_name = TOTAL_COUNTERS[type(instance)]
+    deltas = {count_name: sign}
+    if size_name is not None:
+        deltas[size_name] = sign * (instance.size_bytes or 0)
+    return deltas
+
+
+def exact_totals() -> Dict[str, float]:
+    values = {}
+    for model, count_name, size_name in TOTAL_STATS:
+        aggregates = {'count': Count('pk')}
+        if size_name is not None:
+            aggregates['size'] = Sum('size_bytes')
+        result = model.objects.order_by().aggregate(**aggregates)
+        values[count_name] = result['count']
+        if size_name is not None:
+            values[size_name] = result['size'] or 0
+    return values
+
+
+def estimated_counts() -> Dict[str, float]:
+    """Rows count of every stored model from the PostgreSQL catalog
+    statistics, as of their last analyze."""
+    tables = {
+        model._meta.db_table: count_name
+        for model, count_name, _ in TOTAL_STATS
+    }
+    with connections[router.db_for_read(Stat)].cursor() as cursor:
+        cursor.execute(
+            'SELECT relname, reltuples FROM pg_class '
+            'WHERE relkind = %s AND relname = ANY(%s)',
+            ['r', list(tables)]
+        )
+        rows = cursor.fetchall()
+    return {tables[table]: max(0, int(count)) for table, count in rows}
+
+
+def update_total_stats(estimate: bool = False):
+    """Compute the total stats counters again.
+
+    The counters are kept up to date as instances are stored and deleted,
+    so this only needs to run to initialize them or fix their drift. With
+    ``estimate``, counts are read from the catalog statistics instead of
+    scanning the tables and sizes are left as counted.
+    """
+    # Computed values replace the folded ones
+    fold_totals()
+    if estimate:
+        set_totals(estimated_counts())
     else:
+        set_totals(exact_totals())
+
+
+TIME_RESOLUTIONS = {
+    Stat.RESOLUTION_HOUR: (
+        TruncHour,
+        {'minute': 0, 'second': 0, 'microsecond': 0},
+        timedelta(hours=1),
+        timedelta(hours=24)
+    ),
+    Stat.RESOLUTION_DAY: (
+        TruncDay,
+        {'hour': 0, 'minute': 0, 'second': 0, 'microsecond': 0},
+        timedelta(hours=24),
+        timedelta(days=30)
+    )
+}
+
+FACES_METRICS = ('faces_count',)
+TASKS_METRICS = ('frames_count', 'processing_time', 'tasks_count')
+TIME_METRICS = FACES_METRICS + TASKS_METRICS
+
+TASK_FINISHED_STATUSES = [
+    Task.STATUS_SUCCESS,
+    Task.STATUS_STOPPED,
+    Task.STATUS_KILLED
+]
+
+
+def time_resolution(resolution: str) -> tuple:
+    try:
+        return TIME_RESOLUTIONS[resolution]
+    except KeyError:
         raise ValueError(f'Invalid resolution "{resolution}"')
 
-    query = Stat.objects.filter(
-        name=name,
-        resolution=resolution
-    ).order_by('-timestamp')
 
-    last_stat = None
-    if query.exists():
-        last_stat = query.last()
+def bucket_timestamp(timestamp: datetime, resolution: str) -> datetime:
+    """Timestamp of the bucket holding ``timestamp``, which is the end of
+    the bucket time range."""
+    _, replace_kwargs, step, _ = time_resolution(resolution)
+    return localtime(timestamp).replace(**replace_kwargs) + step
+
+
+def faces_time_stats(resolution: str, min_timestamp, max_timestamp):
+    trunc, _, _, _ = time_resolution(resolution)
+    return Face.objects.filter(
+        created_at__gte=min_timestamp,
+        created_at__lt=max_timestamp
+    ).annotate(
+        bucket=trunc('created_at')
+    ).values('bucket').annotate(
+        faces_count=Count('id')
+    ).order_by()
+
+
+def tasks_time_stats(resolution: str, min_timestamp, max_timestamp):
+    trunc, _, _, _ = time_resolution(resolution)
+    return Task.objects.filter(
+        created_at__gte=min_timestamp,
+        created_at__lt=max_timestamp
+    ).annotate(
+        bucket=trunc('created_at')
+    ).values('bucket').annotate(
+        frames_count=Sum(json_value('frames_count', IntegerField())),
+        processing_time=Sum(json_value('processing_time', FloatField())),
+        tasks_count=Count(
+            'id', filter=Q(status__in=TASK_FINISHED_STATUSES)
+        )
+    ).order_by()
+
+
+def time_stats(
+    resolution: str,
+    min_timestamp: datetime,
+    max_timestamp: datetime,
+    metrics: Iterable[str] = TIME_METRICS
+) -> Dict[Tuple[str, datetime], float]:
+    """Values of the time ``metrics`` in the buckets between the bucket
+    starts ``min_timestamp`` and ``max_timestamp``, with one grouped query
+    per source table. Empty buckets are not returned."""
+    _, _, step, _ = time_resolution(resolution)
+
+    sources = []
+    faces_metrics = [name for name in FACES_METRICS if name in metrics]
+    if len(faces_metrics):
+        sources.append((
+            faces_time_stats(resolution, min_timestamp, max_timestamp),
+            faces_metrics
+        ))
+    tasks_metrics = [name for name in TASKS_METRICS if name in metrics]
+    if len(tasks_metrics):
+        sources.append((
+            tasks_time_stats(resolution, min_timestamp, max_timestamp),
+            tasks_metrics
+        ))
+
+    values = {}
+    for rows, names in sources:
+        for row in rows:
+            timestamp = row['bucket'] + step
+            for name in names:
+                values[(name, timestamp)] = row[name] or 0
+    return values
+
+
+def upsert_stats(
+    stats: Iterable[Tuple[str, str, datetime, float]],
+    increment: bool = False
+):
+    """Insert or update ``(name, resolution, timestamp, value)`` stats in a
+    single statement. With ``increment``, values are added to the stored
+    ones instead of replacing them."""
+    stats = list(stats)
+    if not len(stats):
+        return
+
+    connection = connections[router.db_for_write(Stat)]
+    quote = connection.ops.quote_name
+    table = quote(Stat._meta.db_table)
+    value = (
+        f'{table}.{quote("value")} + EXCLUDED.{quote("value")}' if increment
+        else f'EXCLUDED.{quote("value")}'
+    )
+    columns = ', '.join(
+        quote(column)
+        for column in ('name', 'resolution', 'timestamp', 'value', 'updated_at')
+    )
+    rows = ', '.join(['(%s, %s, %s, %s, %s)'] * len(stats))
+    sql = (
+        f'INSERT INTO {table} ({columns}) VALUES {rows} '
+        f'ON CONFLICT ({quote("name")}, {quote("resolution")}, '
+        f'{quote("timestamp")}) DO UPDATE SET {quote("value")} = {value}, '
+        f'{quote("updated_at")} = EXCLUDED.{quote("updated_at")}'
+    )
 
     now = make_aware(datetime.now())
-    now = now.replace(**replace_kwargs)
-    min_timestamp = now - timedelta(**backward_kwargs)
+    params = []
+    for name, resolution, timestamp, stat_value in stats:
+        params.extend((name, resolution, timestamp, stat_value, now))
 
-    if not last_stat:
-        last_update_at = min_timestamp
-    else:
-        last_update_at = last_stat.timestamp.replace(**replace_kwargs)
-        if last_update_at < min_timestamp:
-            last_update_at = min_timestamp
-            stats_query = Stat.objects.filter(
-                name=name,
-                resolution=resolution,
-                timestamp__lte=min_timestamp
-            )
-            if stats_query.exists():
-                stats_query.delete()
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
 
-    # count = Face.objects.filter(
-    #     created_at__gt=last_update_at
-    # ).count()
-    #
-    # if count == 0:
-    #     return
 
-    timestamp_prev = last_update_at
-    timestamp = last_update_at + timedelta(**forward_kwargs)
+def update_time_stats(resolution: str):
+    """Compute the missing buckets of every time metric.
 
-    while timestamp <= now:
+    Buckets are computed from the oldest missing one up to the last
+    complete one, with a single query per source table, and stored with a
+    single upsert. Buckets older than the resolution history are deleted.
+    """
+    _, replace_kwargs, step, history = time_resolution(resolution)
 
-        value = value_eval(min_timestamp=timestamp_prev, max_timestamp=timestamp)
-        # value = Face.objects.filter(
-        #     created_at__gt=timestamp_prev,
-        #     created_at__lte=timestamp
-        # ).count()
+    now = make_aware(datetime.now()).replace(**replace_kwargs)
+    min_timestamp = now - history
 
-        stat, _ = Stat.objects.get_or_create(
-            name=name,
-            resolution=resolution,
-            timestamp=timestamp
-        )
+    Stat.objects.filter(
+        name__in=TIME_METRICS,
+        resolution=resolution,
+        timestamp__lte=min_timestamp
+    ).delete()
 
-        stat.value = value
-        stat.save()
+    stored = set(Stat.objects.filter(
+        name__in=TIME_METRICS,
+        resolution=resolution,
+        timestamp__gt=min_timestamp
+    ).values_list('name', 'timestamp'))
 
-        timestamp_prev = timestamp
-        timestamp = timestamp + timedelta(**forward_kwargs)
\ No newline at end of file
+    timestamps = [
+        min_timestamp + step * (ind + 1) for ind in range(history // step)
+    ]
+    missing = [
+        timestamp for timestamp in timestamps
+        if any((name, timestamp) not in stored for name in TIME_METRICS)
+    ]
+    if not len(missing):
+        return
+
+    values = time_stats(resolution, missing[0] - step, now)
+    upsert_stats(
+        (name, resolution, timestamp, values.get((name, timestamp), 0))
+        for timestamp in timestamps if timestamp >= missing[0]
+        for name in TIME_METRICS
+    )
+
+
+def add_face_stats(face: Face):
+    """Count a new face in its buckets of every resolution."""
+    upsert_stats(
+        (
+            'faces_count',
+            resolution,
+            bucket_timestamp(face.created_at, resolution),
+            1
+        )
+        for resolution in TIME_RESOLUTIONS
+    )
+
+
+def refresh_task_stats(task: Task):
+    """Compute again the tasks metrics of the buckets holding ``task``."""
+    stats = []
+    for resolution in TIME_RESOLUTIONS:
+        _, _, step, _ = time_resolution(resolution)
+        timestamp = bucket_timestamp(task.created_at, resolution)
+        values = time_stats(
+            resolution, timestamp - step, timestamp, TASKS_METRICS
+        )
+        stats.extend(
+            (name, resolution, timestamp, values.get((name, timestamp), 0))
+            for name in TASKS_METRICS
+        )
+    upsert_stats(stats)
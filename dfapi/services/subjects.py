@@ -1,14 +1,26 @@
-from os import path
-from typing import List
+import hashlib
+from typing import Iterable
 from typing import Tuple
 
-import numpy as np
-from django.db.models import QuerySet
-from django.http import QueryDict, HttpRequest
-from openpyxl import Workbook
-from openpyxl.cell import Cell
+from django.conf import settings
+from django.contrib.postgres.fields import ArrayField
+from django.core.cache import cache
+from django.db.models import (
+    QuerySet,
+    Q,
+    Avg,
+    Count,
+    F,
+    Func,
+    IntegerField,
+    Max,
+    Min,
+    Sum,
+    Value
+)
+from django.http import QueryDict
 
-from ..models import Subject
+from ..models import Face, Subject
 from ..models import (
     SubjectSegment
 )
@@ -132,166 +144,250 @@ def build_queryset(
     return queryset, filtered
 
 
-def pred_sexage(subject: Subject):
-    faces = subject.faces.all()
-    age = None
-    age_var = 0
-    sex = ''
-    sex_score = 0
-    ages_sum = 0
-    ages_var_sum = 0
-    ages_count = 0
-    man_count = 0
-    woman_count = 0
-    sex_scores_man_sum = 0
-    sex_scores_woman_sum = 0
-
-    for face in faces:
-        if face.pred_age:
-            ages_sum += face.pred_age
-            ages_count += 1
-            ages_var_sum += face.pred_age_var
-
-        pred_sex = face.pred_sex
-        if pred_sex:
-            if pred_sex == subject.SEX_MAN:
-                man_count += 1
-                sex_scores_man_sum += face.pred_sex_score
-            elif pred_sex == subject.SEX_WOMAN:
-                woman_count += 1
-                sex_scores_woman_sum += face.pred_sex_score
-
-    if ages_count:
-        age = ages_sum / ages_count
-        age_var = ages_var_sum / ages_count
-
-    if man_count + woman_count:
-        if man_count > woman_count:
-            sex = subject.SEX_MAN
-            sex_score = sex_scores_man_sum / man_count
-        else:
-            sex = subject.SEX_WOMAN
-            sex_score = sex_scores_woman_sum / woman_count
-
-    return age, age_var, sex, sex_score
-
-
-def demograp(subjects_queryset: QuerySet):
-    men_ages = []
-    women_ages = []
-    men_count = 0
-    women_count = 0
-
-    for subject in subjects_queryset.iterator():
-        age = subject.pred_age
-        sex = subject.pred_sex
-        if age and sex:
-            if sex == Subject.SEX_MAN:
-                men_ages.append(age)
-                men_count += 1
-            elif sex == Subject.SEX_WOMAN:
-                women_ages.append(age)
-                women_count += 1
-
-    lower = 18
-    upper = 74
-    step = 6
-    labels = list(range(lower, upper, step))
+def update_pred_sexage(subjects_ids: Iterable[int], batch_size: int = 500):
+    """Update subjects predicted sex and age from their faces predictions.
+
+    Per subject aggregates are computed in the database with a single
+    grouped query and written back with bulk updates.
+    """
+    subjects_ids = set(subjects_ids)
+    if not len(subjects_ids):
+        return
+
+    has_age = Q(pred_age__gt=0)
+    is_man = Q(pred_sex=Face.SEX_MAN)
+    is_woman = Q(pred_sex=Face.SEX_WOMAN)
+
+    rows = Face.objects.filter(
+        subject_id__in=subjects_ids
+    ).values('subject_id').annotate(
+        age=Avg('pred_age', filter=has_age),
+        age_var=Avg('pred_age_var', filter=has_age),
+        man_count=Count('id', filter=is_man),
+        woman_count=Count('id', filter=is_woman),
+        man_score=Avg('pred_sex_score', filter=is_man),
+        woman_score=Avg('pred_sex_score', filter=is_woman)
+    ).order_by()
+
+    age_subjects = []
+    sex_subjects = []
+    for row in rows.iterator():
+        subject = Subject(pk=row['subject_id'])
+
+        if row['age'] is not None:
+            subject.pred_age = int(row['age'])
+            subject.pred_age_var = row['age_var']
+            age_subjects.append(subject)
+
+        if row['man_count'] + row['woman_count']:
+            if row['man_count'] > row['woman_count']:
+                subject.pred_sex = Subject.SEX_MAN
+                subject.pred_sex_score = row['man_score']
+            else:
+                subject.pred_sex = Subject.SEX_WOMAN
+                subject.pred_sex_score = row['woman_score']
+            sex_subjects.append(subject)
+
+    Subject.objects.bulk_update(
+        age_subjects,
+        fields=['pred_age', 'pred_age_var'],
+        batch_size=batch_size
+    )
+    Subject.objects.bulk_update(
+        sex_subjects,
+        fields=['pred_sex', 'pred_sex_score'],
+        batch_size=batch_size
+    )
 
-    return {
-        'age_labels': labels,
-        'men_ages': age_stats(men_ages, labels),
-        'women_ages': age_stats(women_ages, labels),
-        'men_count': men_count,
-        'women_count': women_count
+    if len(age_subjects) or len(sex_subjects):
+        invalidate_demograp()
+
+
+def add_face_summary(face: Face):
+    """Update the cover face and last seen time of the subject of a new
+    face, without reading its other faces. As ``Subject.timestamp`` always
+    was, the last seen time is the creation time of the latest face."""
+    if face.subject_id is None:
+        return
+
+    seen_at = face.created_at
+    if seen_at is not None:
+        Subject.objects.filter(
+            Q(last_seen_at__isnull=True) | Q(last_seen_at__lt=seen_at),
+            pk=face.subject_id
+        ).update(last_seen_at=seen_at)
+
+    if face.image:
+        Subject.objects.filter(
+            pk=face.subject_id,
+            cover_face__isnull=True
+        ).update(cover_face=face.pk)
+
+
+def remove_face_summary(face: Face):
+    """Refresh the subject of a deleted face, only if the face was its
+    cover or the last one seen."""
+    if face.subject_id is None:
+        return
+
+    subject = Subject.objects.filter(
+        pk=face.subject_id
+    ).values('cover_face_id', 'last_seen_at').first()
+    if subject is None:
+        return
+
+    seen_at = face.created_at
+    last_seen_at = subject['last_seen_at']
+    if (
+        subject['cover_face_id'] is None or
+        subject['cover_face_id'] == face.pk or
+        (
+            seen_at is not None and
+            last_seen_at is not None and
+            seen_at >= last_seen_at
+        )
+    ):
+        refresh_summary([face.subject_id])
+
+
+def refresh_summary(subjects_ids: Iterable[int], batch_size: int = 500):
+    """Recompute subjects cover face and last seen time from their faces.
+
+    The cover face is the first face with an image, as kept by
+    ``add_face_summary``.
+    """
+    subjects = {
+        subject_id: Subject(pk=subject_id)
+        for subject_id in set(subjects_ids)
     }
+    if not len(subjects):
+        return
+
+    has_image = Q(image__isnull=False) & ~Q(image='')
+    rows = Face.objects.filter(
+        subject_id__in=subjects.keys()
+    ).values('subject_id').annotate(
+        seen_at=Max('created_at'),
+        cover_face_id=Min('id', filter=has_image)
+    ).order_by()
+
+    for row in rows.iterator():
+        subject = subjects[row['subject_id']]
+        subject.last_seen_at = row['seen_at']
+        subject.cover_face_id = row['cover_face_id']
+
+    Subject.objects.bulk_update(
+        subjects.values(),
+        fields=['cover_face', 'last_seen_at'],
+        batch_size=batch_size
+    )
 
 
-def age_stats(ages, labels):
-    if not len(ages):
-        return {
-            'counts': [0] * len(labels),
-            'mean_value': 0,
-            'min_value': 0,
-            'max_value': 0
-        }
+DEMOGRAP_AGE_LABELS = list(range(18, 74, 6))
 
-    mean_age = np.mean(ages)
-    max_age = np.max(ages)
-    min_age = np.min(ages)
+DEMOGRAP_GENERATION_KEY = 'demograp:generation'
 
-    limits = (
-        min(0, labels[0] - 1),
-        max(max_age, labels[len(labels) - 1])
-    )
-    counts, _ = np.histogram(ages, bins=([limits[0]] + labels + [limits[1]]))
 
-    return {
-        'counts': counts,
-        'mean_value': mean_age,
-        'min_value': min_age,
-        'max_value': max_age
-    }
+def demograp_generation() -> int:
+    return cache.get_or_set(DEMOGRAP_GENERATION_KEY, 0, None)
 
 
-def fill_cell(subject: Subject, cell: Cell, col_key: str, request: HttpRequest):
-    if col_key == 'id':
-        cell.value = subject.pk
-    elif col_key == 'image':
-        image = subject.image
-        if image is None:
-            cell.value = ''
-        else:
-            cell.value = path.basename(image.path)
-            cell.hyperlink = request.build_absolute_uri(image.url)
-    elif col_key == 'created_at':
-        cell.value = subject.created_at
-    elif col_key == 'pred_sex':
-        cell.value = subject.pred_sex
-    elif col_key == 'pred_age':
-        cell.value = subject.pred_age
-    else:
-        raise ValueError(f'Invalid column "{col_key}".')
-
-
-def xls_export(
-    queryset: QuerySet,
-    request: HttpRequest,
-    title: str = 'Subjects',
-    columns: List[str] = None
-):
-
-    workbook = Workbook()
-
-    # Get active worksheet/tab
-    worksheet = workbook.active
-    worksheet.title = title
-
-    fields = {
-        'id': 'Id',
-        'image': 'Image',
-        'created_at': 'Created at',
-        'pred_sex': 'Predicted sex',
-        'pred_age': 'Predicted age'
-    }
+def invalidate_demograp():
+    """Expire every cached demographics result, after subjects change."""
+    try:
+        cache.incr(DEMOGRAP_GENERATION_KEY)
+    except ValueError:
+        cache.set(DEMOGRAP_GENERATION_KEY, 1, None)
 
-    if columns is not None:
-        fields = {key: val for key, val in fields.items() if key in columns}
 
-    # Define the titles for fields
-    row_num = 1
+def demograp_key(params: QueryDict) -> str:
+    signature = sorted(
+        (key, sorted(values)) for key, values in params.lists()
+        if key not in ('limit', 'offset', 'format')
+    )
+    digest = hashlib.sha1(repr(signature).encode('utf-8')).hexdigest()
+    return f'demograp:{demograp_generation()}:{digest}'
+
+
+def demograp(subjects_queryset: QuerySet, params: QueryDict = None) -> dict:
+    """Age histograms and statistics per predicted sex.
+
+    Subjects are bucketed by the database with ``width_bucket`` in a single
+    grouped query. Bucket 0 holds the ages below the first label and the
+    last one the ages from the last label on. Results are cached by the
+    filter ``params`` until subjects change.
+    """
+    key = None
+    if params is not None:
+        key = demograp_key(params)
+        data = cache.get(key)
+        if data is not None:
+            return data
+
+    if subjects_queryset.query.distinct:
+        # Filters across faces produce duplicated rows to group
+        subjects_queryset = Subject.objects.filter(
+            pk__in=subjects_queryset.values('pk')
+        )
 
-    # Assign the titles for each cell of the header
-    for col_num, col_key in enumerate(fields.keys(), 1):
-        cell = worksheet.cell(row=row_num, column=col_num)
-        cell.value = fields[col_key]
+    labels = DEMOGRAP_AGE_LABELS
+    bucket = Func(
+        F('pred_age'),
+        Value(labels, output_field=ArrayField(IntegerField())),
+        function='width_bucket',
+        output_field=IntegerField()
+    )
+    rows = subjects_queryset.filter(
+        pred_sex__in=[Subject.SEX_MAN, Subject.SEX_WOMAN],
+        pred_age__gt=0
+    ).annotate(
+        bucket=bucket
+    ).order_by().values('pred_sex', 'bucket').annotate(
+        count=Count('id'),
+        ages_sum=Sum('pred_age'),
+        min_age=Min('pred_age'),
+        max_age=Max('pred_age')
+    )
 
-    # Iterate through all movies
-    for subject in queryset:
-        row_num += 1
-        # Assign the data for each cell of the row
-        for col_num, col_key in enumerate(fields, 1):
-            cell = worksheet.cell(row=row_num, column=col_num)
-            fill_cell(subject, cell, col_key, request)
+    stats = {
+        sex: {
+            'counts': [0] * (len(labels) + 1),
+            'count': 0,
+            'sum': 0,
+            'min_value': None,
+            'max_value': None
+        }
+        for sex in (Subject.SEX_MAN, Subject.SEX_WOMAN)
+    }
+    for row in rows:
+        sex_stats = stats[row['pred_sex']]
+        sex_stats['counts'][row['bucket']] += row['count']
+        sex_stats['count'] += row['count']
+        sex_stats['sum'] += row['ages_sum']
+        if sex_stats['min_value'] is None or row['min_age'] < sex_stats['min_value']:
+            sex_stats['min_value'] = row['min_age']
+        if sex_stats['max_value'] is None or row['max_age'] > sex_stats['max_value']:
+            sex_stats['max_value'] = row['max_age']
+
+    data = {
+        'age_labels': labels,
+        'men_ages': age_stats(stats[Subject.SEX_MAN]),
+        'women_ages': age_stats(stats[Subject.SEX_WOMAN]),
+        'men_count': stats[Subject.SEX_MAN]['count'],
+        'women_count': stats[Subject.SEX_WOMAN]['count']
+    }
+
+    if key is not None:
+        cache.set(key, data, settings.DEMOGRAP_CACHE_TIMEOUT)
+
+    return data
 
-    return workbook
\ No newline at end of file
+
+def age_stats(sex_stats: dict) -> dict:
+    count = sex_stats['count']
+    return {
+        'counts': sex_stats['counts'],
+        'mean_value': sex_stats['sum'] / count if count else 0,
+        'min_value': sex_stats['min_value'] or 0,
+        'max_value': sex_stats['max_value'] or 0
+    }
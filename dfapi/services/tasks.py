@@ -1,5 +1,6 @@
 import logging
 from datetime import timedelta, datetime, time
+from typing import List, Optional
 
 from django.conf import settings
 from django.db.models import Count
@@ -7,6 +8,7 @@ from django.utils.timezone import make_aware
 from django.utils import timezone
 
 from .exceptions import ServiceError
+from .hunting import get_hunt_match
 from .workers import RunnerManager, WorkerApi
 from ..models import Task
 from ..models import Worker
@@ -17,6 +19,10 @@ logger = logging.getLogger(logger_name)
 CHECK_TASKS_MAX_AGE_DAYS = 7
 CREATED_TASK_TIMEOUT_DAYS = 1
 
+# Worker process group of the video tasks sharing in-process state, the
+# hunt index of hunt tasks and the subject linker of linking tasks
+RUNNER_GROUP_SHARED = 'shared'
+
 runner_manager = RunnerManager()
 
 
@@ -59,6 +65,18 @@ def select_worker():
     return None
 
 
+def runner_group(task: Task) -> Optional[str]:
+    """Group of the tasks that must run in the same worker process."""
+    if task.task_type == Task.TYPE_VIDEO_HUNT_FACES:
+        return RUNNER_GROUP_SHARED
+    if (
+        task.task_type == Task.TYPE_VIDEO_DETECT_FACES and
+        task.config.get('link_subjects', False)
+    ):
+        return RUNNER_GROUP_SHARED
+    return None
+
+
 def create(task: Task):
     datetime_now = make_aware(datetime.now())
     if task.schedule_start_at is None or (
@@ -78,7 +96,7 @@ def start_task(task: Task):
     task.save(update_fields=['worker'])
 
     if worker.is_self():
-        runner_manager.create(task.pk)
+        runner_manager.create(task.pk, group=runner_group(task))
     else:
         worker_api = WorkerApi(api_url=worker.api_url)
         worker_api.execute(
@@ -143,6 +161,36 @@ def stop_task(task):
         )
 
 
+def update_hunted_subjects(
+    task: Task,
+    add: List[int] = None,
+    remove: List[int] = None
+):
+    """Add or remove hunted subjects of a hunt task.
+
+    Running tasks reload their watch list from the task config, so the
+    changes apply without restarting them.
+    """
+    if task.task_type != Task.TYPE_VIDEO_HUNT_FACES:
+        raise ServiceError(f'Task <{task.pk}> is not a hunt task.')
+
+    add = [int(subject_id) for subject_id in (add or [])]
+    remove = {int(subject_id) for subject_id in (remove or [])}
+
+    hunted_subjects = [
+        int(subject_id)
+        for subject_id in task.config.get('hunted_subjects', [])
+        if int(subject_id) not in remove
+    ]
+    for subject_id in add:
+        if subject_id not in hunted_subjects:
+            hunted_subjects.append(subject_id)
+        get_hunt_match(task.pk, subject_id)
+
+    task.config['hunted_subjects'] = hunted_subjects
+    task.save(update_fields=['config', 'updated_at'])
+
+
 def schedule_tasks():
 
     now = make_aware(datetime.now())
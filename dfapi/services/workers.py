@@ -4,7 +4,7 @@ from json import JSONDecodeError
 from queue import Empty as QueueEmptyError
 from queue import Full as QueueFullError
 from time import sleep
-from typing import Dict, List
+from typing import Dict, List, Optional
 
 import numpy as np
 import requests
@@ -19,7 +19,8 @@ from .runners import (
     VdfTaskRunner,
     PgaTaskRunner,
     FclTaskRunner,
-    VhfTaskRunner
+    VhfTaskRunner,
+    FreTaskRunner
 )
 from ..models import (
     Task
@@ -33,6 +34,7 @@ WORKER_PUT_TIMEOUT = 10
 WORKER_QUEUE_MAX_SIZE = 24
 
 TEST_CONN_TIMEOUT = 1
+SHARD_SEARCH_TIMEOUT = 30
 
 TASK_FLAG_RUN = 0
 TASK_FLAG_PAUSE = 1
@@ -76,6 +78,8 @@ def create_task_runner(task: Task) -> TaskRunner:
         return PgaTaskRunner(task)
     elif task.task_type == Task.TYPE_FACE_CLUSTERING:
         return FclTaskRunner(task)
+    elif task.task_type == Task.TYPE_FACE_REENCODING:
+        return FreTaskRunner(task)
     else:
         raise ValueError(f'Invalid task type "{task.task_type}"')
 
@@ -250,9 +254,19 @@ class Worker:
 
 
 class RunnerManager:
+    """Start the tasks of this node in worker processes.
+
+    Tasks of the same group run in the same worker process, so they share
+    the in-process state of their runners, like the hunt index and the
+    subject linker. When the worker of a group is full, the task starts in
+    the least loaded worker and keeps its own copy of that state, so its
+    subjects are not linked with the ones of the tasks of the group.
+    """
+
     def __init__(self):
         self.workers: List[Worker] = []
         self.tasks_worker: Dict[int, Worker] = {}
+        self.groups_worker: Dict[str, Worker] = {}
         self._id_count = 0
 
     def update_index(self):
@@ -273,15 +287,25 @@ class RunnerManager:
             worker for worker in self.workers
             if worker.is_alive()
         ]
+        self.groups_worker = {
+            group: worker for group, worker in self.groups_worker.items()
+            if worker.is_alive()
+        }
 
-    def create(self, task_id: int):
+    def create(self, task_id: int, group: Optional[str] = None):
 
         self.update_index()
 
         if task_id in self.tasks_worker:
             raise ServiceError(f'Task [{task_id}] is already running.')
 
-        if len(self.workers) < MAX_WORKERS:
+        group_worker = self.groups_worker.get(group, None)
+        if (
+            group_worker is not None and
+            group_worker.task_count < MAX_TASKS_PER_WORKER
+        ):
+            worker = group_worker
+        elif len(self.workers) < MAX_WORKERS:
             worker = Worker()
             db.connections.close_all()
             worker.start()
@@ -297,6 +321,8 @@ class RunnerManager:
 
         worker.start_task(task_id)
         self.tasks_worker[task_id] = worker
+        if group is not None and group_worker is None:
+            self.groups_worker[group] = worker
 
     def pause(self, task_id: int):
         task_id = self.validate_task(task_id)
@@ -328,6 +354,7 @@ class WorkerApi:
     ACTION_RESUME = 'resume/'
     ACTION_STOP = 'stop/'
     ACTION_LOGIN = 'login/'
+    ACTION_SHARD_SEARCH = 'recognition/shard_search/'
 
     ACTION_CHOICES = [
         ACTION_START,
@@ -386,6 +413,39 @@ class WorkerApi:
 
         return token
 
+    def _auth_headers(self, username: str, password: str):
+        if self.token is None and username and password:
+            self.token = self._login(username=username, password=password)
+        if self.token is not None:
+            return {
+                'Authorization': f'Token {self.token}'
+            }
+        return None
+
+    def search_shard(self, data: dict, username: str, password: str):
+        url = self.build_url(self.ACTION_SHARD_SEARCH)
+        headers = self._auth_headers(username, password)
+        try:
+            response = requests.post(
+                url,
+                json=data,
+                headers=headers,
+                timeout=SHARD_SEARCH_TIMEOUT
+            )
+        except requests.RequestException as err:
+            logger.error(err)
+            return None
+
+        if not response:
+            logger.error(f'Http request error {response.status_code}.')
+            self.handle_error(response)
+            return None
+
+        try:
+            return response.json()
+        except JSONDecodeError:
+            return None
+
     def execute(
         self,
         resource: [str, int],
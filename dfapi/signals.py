@@ -9,9 +9,12 @@ from django.dispatch import receiver
 
 from . import services
 from .models import (
+    Camera,
+    EncoderVersion,
     Face,
     Frame,
     VideoRecord,
+    Subject,
     SubjectSegment,
     Task,
     Notification
@@ -32,20 +35,294 @@ def delete_face_image_on_delete(sender, instance, **kwargs):
 @receiver(pre_save, sender=Face)
 def delete_face_image_on_change(sender, instance: Face, **kwargs):
     if not instance.pk:
+        if instance.size_bytes is None and instance.image:
+            try:
+                instance.size_bytes = instance.image.size
+            except OSError:
+                pass
         return False
 
     try:
-        old_file = Face.objects.get(pk=instance.pk).image
+        old_instance = Face.objects.get(pk=instance.pk)
     except Face.DoesNotExist:
         return False
 
+    instance.old_subject_id = old_instance.subject_id
+    instance.old_embeddings = old_instance.embeddings_for(
+        EncoderVersion.active_version()
+    )
+    old_file = old_instance.image
+
     new_file = instance.image
     if not old_file == new_file:
         instance.box_bytes = None
         instance.embeddings_bytes = None
+        instance.next_embeddings_bytes = None
+        instance.next_embeddings_version = ''
         instance.landmarks_bytes = None
         if os.path.isfile(old_file.path):
             os.remove(old_file.path)
+        instance.size_bytes = new_file.size if new_file else None
+        services.stats.add_totals({
+            'faces_image_size': (
+                (instance.size_bytes or 0) - (old_instance.size_bytes or 0)
+            )
+        })
+
+
+PROTOTYPE_FIELDS = {
+    'subject',
+    'embeddings_bytes',
+    'embeddings_version',
+    'next_embeddings_bytes',
+    'next_embeddings_version'
+}
+
+
+@receiver(post_save, sender=Face)
+def update_prototype_on_save(
+    sender,
+    instance: Face,
+    created: bool,
+    update_fields=None,
+    **kwargs
+):
+    if created:
+        services.prototypes.add_face(instance)
+        return
+
+    if update_fields is not None and not PROTOTYPE_FIELDS & set(update_fields):
+        return
+
+    services.prototypes.update_face(
+        instance,
+        getattr(instance, 'old_subject_id', None),
+        getattr(instance, 'old_embeddings', None)
+    )
+
+
+@receiver(post_delete, sender=Face)
+def update_prototype_on_delete(sender, instance: Face, **kwargs):
+    services.prototypes.remove_face(instance)
+
+
+@receiver(post_save, sender=Face)
+def invalidate_recognitions_on_save(
+    sender,
+    instance: Face,
+    created: bool,
+    update_fields=None,
+    **kwargs
+):
+    if update_fields is not None and not PROTOTYPE_FIELDS & set(update_fields):
+        return
+
+    if created:
+        if services.recognition_cache.face_recognizable(instance):
+            services.recognition_cache.invalidate_subjects(
+                [instance.subject_id]
+            )
+        return
+
+    old_subject_id = getattr(instance, 'old_subject_id', None)
+    if services.recognition_cache.face_changed(
+        instance,
+        old_subject_id,
+        getattr(instance, 'old_embeddings', None)
+    ):
+        services.recognition_cache.invalidate_subjects(
+            [old_subject_id, instance.subject_id]
+        )
+        services.face_index.invalidate_face_index()
+
+
+@receiver(post_delete, sender=Face)
+def invalidate_recognitions_on_delete(sender, instance: Face, **kwargs):
+    services.recognition_cache.invalidate_subjects([instance.subject_id])
+    services.face_index.invalidate_face_index()
+
+
+INDEX_SUBJECT_FIELDS = {'name', 'last_name', 'sex', 'skin', 'birthdate'}
+
+
+@receiver(post_save, sender=Subject)
+def invalidate_face_index_on_subject_save(
+    sender,
+    instance: Subject,
+    created: bool,
+    update_fields=None,
+    **kwargs
+):
+    if created:
+        return
+
+    if (
+        update_fields is not None and
+        not INDEX_SUBJECT_FIELDS & set(update_fields)
+    ):
+        return
+
+    # The subject may have moved between segments
+    services.recognition_cache.invalidate_all()
+    services.face_index.invalidate_face_index()
+
+
+@receiver(post_delete, sender=Subject)
+def invalidate_face_index_on_subject_delete(
+    sender,
+    instance: Subject,
+    **kwargs
+):
+    services.recognition_cache.invalidate_all()
+    services.face_index.invalidate_face_index()
+
+
+SUMMARY_FIELDS = {'subject', 'image', 'timestamp'}
+
+
+@receiver(post_save, sender=Face)
+def update_subject_summary_on_save(
+    sender,
+    instance: Face,
+    created: bool,
+    update_fields=None,
+    **kwargs
+):
+    if created:
+        services.subjects.add_face_summary(instance)
+        return
+
+    if update_fields is not None and not SUMMARY_FIELDS & set(update_fields):
+        return
+
+    subjects_ids = {
+        getattr(instance, 'old_subject_id', None),
+        instance.subject_id
+    }
+    subjects_ids.discard(None)
+    services.subjects.refresh_summary(subjects_ids)
+
+
+@receiver(post_delete, sender=Face)
+def update_subject_summary_on_delete(sender, instance: Face, **kwargs):
+    services.subjects.remove_face_summary(instance)
+
+
+SIGHTING_FIELDS = {'subject', 'task', 'timestamp'}
+
+
+@receiver(post_save, sender=Face)
+def update_sightings_on_save(
+    sender,
+    instance: Face,
+    created: bool,
+    update_fields=None,
+    **kwargs
+):
+    if created:
+        services.sightings.add_face(instance)
+        return
+
+    if update_fields is not None and not SIGHTING_FIELDS & set(update_fields):
+        return
+
+    subjects_ids = {
+        getattr(instance, 'old_subject_id', None),
+        instance.subject_id
+    }
+    subjects_ids.discard(None)
+    services.sightings.rebuild(subjects_ids)
+
+
+@receiver(post_delete, sender=Face)
+def update_sightings_on_delete(sender, instance: Face, **kwargs):
+    services.sightings.remove_face(instance)
+
+
+@receiver(post_delete, sender=Face)
+def remove_face_crop_on_delete(sender, instance: Face, **kwargs):
+    services.crops.remove_face_crop(instance)
+
+
+@receiver(post_save, sender=Face)
+@receiver(post_save, sender=Frame)
+@receiver(post_save, sender=VideoRecord)
+@receiver(post_save, sender=Subject)
+@receiver(post_save, sender=Camera)
+@receiver(post_save, sender=Task)
+def update_totals_on_save(sender, instance, created: bool, **kwargs):
+    if created:
+        services.stats.add_totals(services.stats.instance_totals(instance))
+
+
+@receiver(post_delete, sender=Face)
+@receiver(post_delete, sender=Frame)
+@receiver(post_delete, sender=VideoRecord)
+@receiver(post_delete, sender=Subject)
+@receiver(post_delete, sender=Camera)
+@receiver(post_delete, sender=Task)
+def update_totals_on_delete(sender, instance, **kwargs):
+    services.stats.add_totals(services.stats.instance_totals(instance, -1))
+
+
+@receiver(post_save, sender=Face)
+def update_time_stats_on_face_save(
+    sender,
+    instance: Face,
+    created: bool,
+    **kwargs
+):
+    if created and settings.STATS_INCREMENTAL:
+        services.stats.add_face_stats(instance)
+
+
+STATS_TASK_FIELDS = {'status', 'info'}
+
+
+@receiver(post_save, sender=Task)
+def update_time_stats_on_task_save(
+    sender,
+    instance: Task,
+    update_fields=None,
+    **kwargs
+):
+    if not settings.STATS_INCREMENTAL:
+        return
+
+    if instance.status not in services.stats.TASK_FINISHED_STATUSES:
+        return
+
+    if update_fields is not None and not STATS_TASK_FIELDS & set(update_fields):
+        return
+
+    services.stats.refresh_task_stats(instance)
+
+
+DEMOGRAP_FIELDS = {
+    'name', 'last_name', 'birthdate', 'sex', 'skin', 'pred_sex', 'pred_age'
+}
+
+
+@receiver(post_save, sender=Subject)
+def invalidate_demograp_on_save(
+    sender,
+    instance: Subject,
+    created: bool,
+    update_fields=None,
+    **kwargs
+):
+    if created and (not instance.pred_sex or instance.pred_age is None):
+        return
+
+    if update_fields is not None and not DEMOGRAP_FIELDS & set(update_fields):
+        return
+
+    services.subjects.invalidate_demograp()
+
+
+@receiver(post_delete, sender=Subject)
+def invalidate_demograp_on_delete(sender, instance: Subject, **kwargs):
+    services.subjects.invalidate_demograp()
 
 
 # @receiver(post_save, sender=Face)
@@ -121,6 +398,22 @@ def subject_segment_pre_save(sender, instance: SubjectSegment = None, **kwargs):
         instance.model_path = f'segment_{str(uuid.uuid4())}.npz'
 
 
+SEGMENT_DATA_FIELDS = {'updated_at', 'count'}
+
+
+@receiver(post_save, sender=SubjectSegment)
+def invalidate_recognitions_on_segment_save(
+    sender,
+    instance: SubjectSegment,
+    update_fields=None,
+    **kwargs
+):
+    # Rebuilding the data of a segment does not change its subjects
+    if update_fields is not None and set(update_fields) <= SEGMENT_DATA_FIELDS:
+        return
+    services.recognition_cache.invalidate_segments([instance.pk])
+
+
 @receiver(post_save, sender=SubjectSegment)
 def subject_segment_post_save(sender, instance: SubjectSegment = None, **kwargs):
     if instance is None or not instance.disk_cached:
@@ -145,3 +438,4 @@ def delete_frame_image_on_delete(sender, instance: SubjectSegment, **kwargs):
 def task_post_delete(sender, instance: Task, **kwargs):
     if instance:
         Notification.objects.filter(resource=instance.pk).delete()
+        services.crops.delete_task_crops(instance.pk)
@@ -444,9 +444,14 @@ class RecognitionFactory(ModelFactory):
     API_REQUIRED_FIELDS = ['face']
     API_READ_FIELDS = [
         'id',
+        'mode',
         'sim_thresh',
         'max_matches',
         'created_at',
+        'status',
+        'error',
+        'finished_at',
+        'batch',
         'face',
         'segments',
         'filter',
@@ -0,0 +1,77 @@
+from multiprocessing import Process
+
+from django import db
+from django.test import SimpleTestCase, TransactionTestCase
+
+from ..services.alerts import AlertChannel, AlertListener, notify_alert
+
+TEST_CHANNEL = 'test_hunt_alerts'
+
+
+def notify_from_process(alert: dict):
+    notify_alert(TEST_CHANNEL, alert)
+    db.connections.close_all()
+
+
+class AlertChannelTest(SimpleTestCase):
+
+    def test_publish_to_every_subscriber(self):
+        channel = AlertChannel(max_pending=8)
+        subscriptions = [channel.subscribe() for _ in range(3)]
+
+        alert = channel.publish({'hunt_match': 1})
+
+        self.assertEqual(1, alert['id'])
+        self.assertIn('published_at', alert)
+        for subscription in subscriptions:
+            self.assertEqual(alert, subscription.get_nowait())
+
+    def test_slow_subscriber_drops_oldest(self):
+        channel = AlertChannel(max_pending=2)
+        subscription = channel.subscribe()
+
+        for hunt_match in range(1, 5):
+            channel.publish({'hunt_match': hunt_match})
+
+        self.assertEqual(3, subscription.get_nowait()['hunt_match'])
+        self.assertEqual(4, subscription.get_nowait()['hunt_match'])
+        self.assertTrue(subscription.empty())
+
+    def test_unsubscribe(self):
+        channel = AlertChannel(max_pending=8)
+        subscription = channel.subscribe()
+        channel.unsubscribe(subscription)
+
+        channel.publish({'hunt_match': 1})
+
+        self.assertEqual(0, len(channel))
+        self.assertTrue(subscription.empty())
+
+
+class AlertListenerTest(TransactionTestCase):
+
+    def setUp(self):
+        self.channel = AlertChannel(max_pending=8)
+        self.listener = AlertListener(self.channel, TEST_CHANNEL)
+        self.listener.start()
+        self.assertTrue(self.listener.listening.wait(timeout=5))
+
+    def tearDown(self):
+        self.listener.stop()
+
+    def test_alert_from_other_process(self):
+        subscription = self.channel.subscribe()
+
+        # The child process opens its own connection
+        db.connections.close_all()
+        process = Process(
+            target=notify_from_process,
+            args=({'hunt_match': 1, 'published_at': 10.0},)
+        )
+        process.start()
+        process.join(timeout=10)
+
+        alert = subscription.get(timeout=5)
+        self.assertEqual(1, alert['hunt_match'])
+        self.assertEqual(10.0, alert['published_at'])
+        self.assertEqual(1, alert['id'])
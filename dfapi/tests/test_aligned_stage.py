@@ -0,0 +1,145 @@
+from concurrent.futures import ThreadPoolExecutor
+from time import sleep
+from types import SimpleNamespace
+from unittest import mock
+
+import numpy as np
+from django.test import SimpleTestCase
+from dnfal.genderage import GenderAgePredictor
+
+from ..models import Face
+from ..services.runners.vdf import (
+    AlignedFaceStage,
+    VdfTaskRunner,
+    update_faces_detect
+)
+
+
+def detected_face():
+    return SimpleNamespace(
+        image=np.zeros((64, 64, 3), np.uint8),
+        image_bytes=None,
+        landmarks=np.zeros(10, np.float32)
+    )
+
+
+class AlignedFaceStageTest(SimpleTestCase):
+
+    def setUp(self):
+        self.crops_pack = mock.Mock()
+        self.stage = AlignedFaceStage(crops_pack=self.crops_pack)
+        self.crop = np.ones((8, 8, 3), np.uint8)
+        self.stage.face_aligner = mock.Mock()
+        self.stage.face_aligner.align.return_value = (self.crop, None)
+
+    def test_align(self):
+        face_image_align = self.stage.align(detected_face())
+
+        self.assertIs(self.crop, face_image_align)
+        self.assertEqual(1, self.stage.timings()['faces_count'])
+
+    def test_align_without_landmarks(self):
+        face = detected_face()
+        face.landmarks = []
+
+        self.assertIsNone(self.stage.align(face))
+        self.stage.face_aligner.align.assert_not_called()
+
+    def test_predict(self):
+        self.assertDictEqual({}, self.stage.predict(self.crop))
+
+        self.stage.genderage_predictor = mock.Mock()
+        self.stage.genderage_predictor.predict.return_value = (
+            [GenderAgePredictor.GENDER_WOMAN], [0.9], [30], [2.5]
+        )
+        attributes = self.stage.predict(self.crop)
+
+        self.assertEqual(Face.SEX_WOMAN, attributes['pred_sex'])
+        self.assertEqual(30, attributes['pred_age'])
+
+    def test_align_reuses_encoder_crop(self):
+        face = detected_face()
+        face.aligned_image = self.crop
+
+        self.assertIs(self.crop, self.stage.align(face))
+        self.stage.face_aligner.align.assert_not_called()
+
+    def test_predict_batch(self):
+        self.stage.genderage_predictor = mock.Mock()
+        self.stage.genderage_predictor.predict.return_value = (
+            [GenderAgePredictor.GENDER_WOMAN, GenderAgePredictor.GENDER_MAN],
+            [0.9, 0.8],
+            [30, 40],
+            [2.5, 3.0]
+        )
+        faces_attributes = self.stage.predict_batch(
+            [self.crop, None, self.crop]
+        )
+
+        self.stage.genderage_predictor.predict.assert_called_once()
+        self.assertEqual(
+            2,
+            len(self.stage.genderage_predictor.predict.call_args[0][0])
+        )
+        self.assertEqual(Face.SEX_WOMAN, faces_attributes[0]['pred_sex'])
+        self.assertDictEqual({}, faces_attributes[1])
+        self.assertEqual(40, faces_attributes[2]['pred_age'])
+
+    def test_store(self):
+        self.stage.store(1, 10, self.crop, {})
+        self.stage.store(2, 20, self.crop, {'pred_age': 30})
+
+        self.assertSetEqual({20}, self.stage.subjects_ids)
+        self.assertEqual(2, self.crops_pack.append.call_count)
+
+
+class VdfTaskRunnerTest(SimpleTestCase):
+
+    def test_pred_sexage_after_pending_faces(self):
+        runner = VdfTaskRunner.__new__(VdfTaskRunner)
+        runner.task = SimpleNamespace(pk=1, info={})
+        runner.executor = ThreadPoolExecutor(max_workers=4)
+        runner.aligned_stage = AlignedFaceStage()
+        runner.frame_faces = []
+
+        def store_face(subject_id):
+            sleep(0.05)
+            runner.aligned_stage.store(subject_id, subject_id, None, {'a': 1})
+
+        def run(**kwargs):
+            for subject_id in range(8):
+                runner.executor.submit(store_face, subject_id)
+
+        runner.faces_vision = mock.Mock()
+        runner.faces_vision.video_analyzer.run.side_effect = run
+
+        with mock.patch(
+            'dfapi.services.runners.vdf.update_pred_sexage'
+        ) as update_pred_sexage:
+            runner.main_run()
+
+        update_pred_sexage.assert_called_once_with(set(range(8)))
+        self.assertIn('aligned_stage', runner.task.info)
+
+    def test_frame_faces_stored_in_one_batch(self):
+        runner = VdfTaskRunner.__new__(VdfTaskRunner)
+        runner.task = SimpleNamespace(pk=1, info={})
+        runner.executor = mock.Mock()
+        runner.aligned_stage = None
+        runner.subject_linker = None
+        runner.link_thresh = 0
+        runner.frame_faces = []
+        runner.last_progress_update = float('inf')
+
+        faces = [detected_face(), detected_face()]
+        for face in faces:
+            runner.on_subject_updated(face)
+        runner.executor.submit.assert_not_called()
+
+        runner.on_frame()
+        runner.on_frame()
+
+        runner.executor.submit.assert_called_once()
+        args, kwargs = runner.executor.submit.call_args
+        self.assertIs(update_faces_detect, args[0])
+        self.assertListEqual(faces, kwargs['faces'])
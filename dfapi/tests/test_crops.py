@@ -0,0 +1,111 @@
+import shutil
+import tempfile
+from os import path
+from unittest import mock
+
+import numpy as np
+from django.test import SimpleTestCase
+
+from ..services import crops
+from ..services.crops import CropsPack, _PacksRegistry
+
+
+class CropsPackTest(SimpleTestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.file_path = path.join(self.root, 'task.crops')
+        self.pack = CropsPack(self.file_path, crop_size=32)
+        self.crops = {
+            face_id: np.full((32, 32, 3), 40 * face_id, np.uint8)
+            for face_id in range(1, 6)
+        }
+        for face_id, crop in self.crops.items():
+            self.pack.append(face_id, crop)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def assertCropEqual(self, expected, crop):
+        np.testing.assert_array_equal(expected, crop)
+
+    def test_get(self):
+        for face_id, crop in self.crops.items():
+            self.assertCropEqual(crop, self.pack.get(face_id))
+        self.assertIsNone(self.pack.get(100))
+
+    def test_fixed_size_records(self):
+        record_size = crops.RECORD_HEADER.size + 32 * 32 * 3
+        self.assertEqual(record_size, self.pack.record_size)
+        self.assertEqual(
+            len(self.crops) * record_size,
+            path.getsize(self.file_path)
+        )
+
+        data = np.memmap(self.file_path, dtype=np.uint8, mode='r')
+        offset = 2 * record_size + crops.RECORD_HEADER.size
+        self.assertCropEqual(
+            self.crops[3],
+            data[offset:offset + 32 * 32 * 3].reshape((32, 32, 3))
+        )
+
+    def test_remove(self):
+        self.pack.remove(2)
+        self.assertIsNone(self.pack.get(2))
+        self.assertCropEqual(self.crops[3], self.pack.get(3))
+
+        pack = CropsPack(self.file_path, crop_size=32)
+        self.assertEqual(len(self.crops) - 1, len(pack))
+        self.assertNotIn(2, [face_id for face_id, _ in pack])
+
+    def test_read_from_other_instance(self):
+        pack = CropsPack(self.file_path, crop_size=32)
+        self.assertEqual(len(self.crops), len(pack))
+        for face_id, crop in pack:
+            self.assertCropEqual(self.crops[face_id], crop)
+
+    def test_lookup_does_not_stat_indexed_faces(self):
+        self.pack.get(1)
+        with mock.patch.object(
+            crops.path, 'getsize', side_effect=AssertionError
+        ):
+            self.assertIsNotNone(self.pack.get(2))
+
+    def test_partial_record(self):
+        with open(self.file_path, 'ab') as f:
+            f.write(crops.RECORD_HEADER.pack(6) + b'\0' * 10)
+
+        pack = CropsPack(self.file_path, crop_size=32)
+        self.assertEqual(len(self.crops), len(pack))
+        self.assertIsNone(pack.get(6))
+
+    def test_iter_batches(self):
+        batches = list(self.pack.iter_batches(batch_size=2))
+
+        self.assertListEqual([2, 2, 1], [len(ids) for ids, _ in batches])
+        self.assertEqual((2, 32, 32, 3), batches[0][1].shape)
+
+    def test_invalid_crop(self):
+        with self.assertRaises(ValueError):
+            self.pack.append(10, np.zeros((16, 16, 3), np.uint8))
+
+
+class PacksRegistryTest(SimpleTestCase):
+
+    def test_evict_least_recently_used(self):
+        registry = _PacksRegistry(max_size=2)
+        first = registry.get('first')
+        registry.get('second')
+        registry.get('first')
+        registry.get('third')
+
+        self.assertEqual(2, len(registry))
+        self.assertIs(first, registry.get('first'))
+
+    def test_discard(self):
+        registry = _PacksRegistry(max_size=2)
+        pack = registry.get('first')
+        registry.discard('first')
+
+        self.assertEqual(0, len(registry))
+        self.assertIsNot(pack, registry.get('first'))
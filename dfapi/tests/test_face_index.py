@@ -0,0 +1,153 @@
+from datetime import date, datetime, timezone
+from unittest import mock
+
+import numpy as np
+from django.core.cache import cache
+from django.test import SimpleTestCase, TransactionTestCase
+
+from ..models import SubjectSegment
+from ..services import face_index
+from ..services.face_index import (
+    ATTR_BIRTHDATE,
+    ATTR_NAMING,
+    ATTR_SEX,
+    ATTR_TIMESTAMP,
+    FaceIndex,
+    FaceIndexParts,
+    birthdate_bucket,
+    timestamp_bucket
+)
+from .factory import FaceFactory
+
+
+def _bitmaps(values):
+    values = np.array([str(value) for value in values])
+    return {
+        str(value): np.packbits(values == value)
+        for value in np.unique(values)
+    }
+
+
+class FaceIndexTest(SimpleTestCase):
+
+    def setUp(self):
+        birthdates = np.array([
+            date(1980, 1, 1).toordinal(),
+            date(1990, 6, 1).toordinal(),
+            date(1990, 6, 20).toordinal(),
+            date(2000, 1, 1).toordinal(),
+        ], np.int32)
+        timestamps = np.array([
+            datetime(2020, 1, day, tzinfo=timezone.utc).timestamp()
+            for day in (1, 2, 10, 20)
+        ])
+        self.index = FaceIndex(
+            version='',
+            embeddings=np.eye(4, dtype=np.float32),
+            faces=np.arange(4, dtype=np.int64),
+            subjects=np.array([10, 11, 12, 13], np.int32),
+            birthdates=birthdates,
+            timestamps=timestamps,
+            bitmaps={
+                ATTR_NAMING: _bitmaps(
+                    ['named', 'unnamed', 'named', 'unnamed']
+                ),
+                ATTR_SEX: _bitmaps(['man', 'woman', 'woman', 'man']),
+                ATTR_BIRTHDATE: _bitmaps(
+                    [birthdate_bucket(value) for value in birthdates]
+                ),
+                ATTR_TIMESTAMP: _bitmaps(
+                    [timestamp_bucket(value) for value in timestamps]
+                ),
+            }
+        )
+
+    def test_segment_mask(self):
+        cases = {
+            'No filters': (SubjectSegment(), [0, 1, 2, 3]),
+            'Sex': (SubjectSegment(sex='woman'), [1, 2]),
+            'Sex and naming': (
+                SubjectSegment(sex='woman', naming='named'), [2]
+            ),
+            'Birthdate range': (
+                SubjectSegment(
+                    min_birthdate=date(1990, 6, 10),
+                    max_birthdate=date(2000, 1, 2)
+                ),
+                [2, 3]
+            ),
+            'Timestamp range': (
+                SubjectSegment(
+                    min_timestamp=datetime(
+                        2020, 1, 1, 12, tzinfo=timezone.utc
+                    ),
+                    max_timestamp=datetime(
+                        2020, 1, 15, tzinfo=timezone.utc
+                    )
+                ),
+                [1, 2]
+            ),
+        }
+        for label, (segment, rows) in cases.items():
+            with self.subTest(msg=label):
+                mask = self.index.segment_mask(segment)
+                self.assertListEqual(rows, np.flatnonzero(mask).tolist())
+
+    def test_segments_data_union(self):
+        embeddings, subjects = self.index.segments_data([
+            SubjectSegment(sex='man'),
+            SubjectSegment(sex='woman', naming='named')
+        ])
+        self.assertListEqual([10, 12, 13], subjects.tolist())
+        self.assertEqual((3, 4), embeddings.shape)
+
+    def test_concat(self):
+        index = FaceIndex.concat([self.index, self.index])
+        mask = index.segment_mask(SubjectSegment(sex='woman'))
+
+        self.assertEqual(8, len(index))
+        self.assertListEqual([1, 2, 5, 6], np.flatnonzero(mask).tolist())
+
+    def test_parts_segments_data(self):
+        index = FaceIndexParts([self.index, self.index])
+        embeddings, subjects = index.segments_data([
+            SubjectSegment(sex='woman')
+        ])
+        self.assertListEqual([11, 12, 11, 12], subjects.tolist())
+        self.assertEqual((4, 4), embeddings.shape)
+
+
+class FaceIndexHolderTest(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.face_factory = FaceFactory()
+        self.faces = self.face_factory.create_instances(count=2)
+
+    def indexed_faces(self, index: FaceIndexParts):
+        return {
+            int(face_id) for part in index.parts for face_id in part.faces
+        }
+
+    def test_append_new_faces(self):
+        index = face_index.get_face_index()
+        self.assertEqual(2, len(index))
+
+        face = self.face_factory.create_instance()
+        with mock.patch.object(
+            FaceIndex, 'build', wraps=FaceIndex.build
+        ) as build:
+            index = face_index.get_face_index()
+
+        build.assert_called_once()
+        self.assertIsNotNone(build.call_args[1]['faces_filter'])
+        self.assertEqual(2, len(index.parts))
+        self.assertIn(face.pk, self.indexed_faces(index))
+
+    def test_rebuild_after_delete(self):
+        face_index.get_face_index()
+        self.faces[0].delete()
+
+        index = face_index.get_face_index()
+        self.assertEqual(1, len(index.parts))
+        self.assertSetEqual({self.faces[1].pk}, self.indexed_faces(index))
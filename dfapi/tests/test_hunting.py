@@ -0,0 +1,96 @@
+import numpy as np
+from django.test import SimpleTestCase, TransactionTestCase
+
+from ..models import HuntMatch, Task
+from ..services import tasks
+from ..services.hunting import HuntIndex, cosine_threshold, engine_similarity
+from .factory import SubjectFactory
+
+
+class HuntIndexTest(SimpleTestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.embeddings = {
+            subject_id: rng.normal(size=(3, 32)).astype(np.float32)
+            for subject_id in range(1, 6)
+        }
+        self.index = HuntIndex()
+        for subject_id, embeddings in self.embeddings.items():
+            self.index.add_subject(subject_id, embeddings)
+
+    def test_match(self):
+        for subject_id, embeddings in self.embeddings.items():
+            with self.subTest(msg=f'Subject {subject_id}'):
+                match = self.index.match(embeddings[1] * 2, sim_thresh=0.9)
+                self.assertEqual(subject_id, match[0])
+                self.assertAlmostEqual(1, match[1], places=5)
+
+    def test_match_restricted_to_subjects(self):
+        query = self.embeddings[2][0]
+        self.assertIsNone(self.index.match(query, 0.9, subjects={1, 3}))
+        self.assertEqual(2, self.index.match(query, 0.9, subjects={2})[0])
+
+    def test_hot_remove(self):
+        query = self.embeddings[3][0]
+        self.index.remove_subject(3)
+        self.assertEqual(12, len(self.index))
+        self.assertIsNone(self.index.match(query, 0.9))
+        self.assertEqual(
+            4,
+            self.index.match(self.embeddings[4][2], 0.9)[0]
+        )
+
+    def test_shared_subjects_are_reference_counted(self):
+        self.index.add_subject(1, self.embeddings[1])
+        self.index.remove_subject(1)
+        self.assertEqual(1, self.index.match(self.embeddings[1][0], 0.9)[0])
+        self.index.remove_subject(1)
+        self.assertIsNone(self.index.match(self.embeddings[1][0], 0.9))
+
+    def test_grows_past_initial_capacity(self):
+        rng = np.random.RandomState(1)
+        embeddings = rng.normal(size=(2000, 32)).astype(np.float32)
+        self.index.add_subject(100, embeddings)
+        self.assertEqual(2015, len(self.index))
+        self.assertEqual(100, self.index.match(embeddings[1999], 0.9)[0])
+
+
+class EngineScaleTest(SimpleTestCase):
+
+    def test_round_trip(self):
+        for sim_thresh in (0.3, 0.5, 0.7, 0.9):
+            with self.subTest(msg=f'sim_thresh={sim_thresh}'):
+                self.assertAlmostEqual(
+                    sim_thresh,
+                    engine_similarity(cosine_threshold(sim_thresh)),
+                    places=2
+                )
+
+    def test_monotonic(self):
+        thresholds = [cosine_threshold(s) for s in (0.3, 0.5, 0.7, 0.9)]
+        self.assertListEqual(sorted(thresholds), thresholds)
+
+
+class HuntedSubjectsTest(TransactionTestCase):
+
+    def setUp(self):
+        self.subject = SubjectFactory().create_instance()
+        self.task = Task.objects.create(
+            task_type=Task.TYPE_VIDEO_HUNT_FACES,
+            config={'hunted_subjects': []}
+        )
+
+    def test_hunt_match_reused(self):
+        tasks.update_hunted_subjects(self.task, add=[self.subject.pk])
+        tasks.update_hunted_subjects(self.task, remove=[self.subject.pk])
+        tasks.update_hunted_subjects(self.task, add=[self.subject.pk])
+
+        self.assertListEqual(
+            [self.subject.pk],
+            self.task.config['hunted_subjects']
+        )
+        self.assertEqual(1, HuntMatch.objects.filter(
+            task=self.task,
+            target_subject=self.subject
+        ).count())
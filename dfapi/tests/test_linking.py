@@ -0,0 +1,107 @@
+from concurrent.futures import ThreadPoolExecutor
+from itertools import count
+from threading import Barrier, Event
+from unittest import mock
+
+import numpy as np
+from django.test import SimpleTestCase
+
+from ..services.linking import SubjectLinker
+
+
+class SubjectLinkerTest(SimpleTestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.embeddings = rng.normal(size=(4, 64)).astype(np.float32)
+        self.subjects = count(1)
+        self.linker = SubjectLinker(capacity=8, memory=60)
+
+    def create_subject(self):
+        return next(self.subjects)
+
+    def test_link_recent_subject(self):
+        first = self.linker.link(self.embeddings[0], 0.9, self.create_subject)
+        other = self.linker.link(self.embeddings[1], 0.9, self.create_subject)
+        again = self.linker.link(
+            self.embeddings[0] * 3, 0.9, self.create_subject
+        )
+
+        self.assertEqual(1, first)
+        self.assertEqual(2, other)
+        self.assertEqual(first, again)
+
+    def test_forget_old_subjects(self):
+        with mock.patch('dfapi.services.linking.time', return_value=0):
+            self.linker.link(self.embeddings[0], 0.9, self.create_subject)
+        with mock.patch('dfapi.services.linking.time', return_value=61):
+            subject_id = self.linker.link(
+                self.embeddings[0], 0.9, self.create_subject
+            )
+        self.assertEqual(2, subject_id)
+
+    def test_ring_buffer_overwrites_oldest(self):
+        linker = SubjectLinker(capacity=2, memory=60)
+        for embeddings in self.embeddings[0:3]:
+            linker.link(embeddings, 0.9, self.create_subject)
+
+        subject_id = linker.link(self.embeddings[0], 0.9, self.create_subject)
+        self.assertEqual(4, subject_id)
+
+    def test_concurrent_tracks_of_same_person(self):
+        created = Event()
+
+        def create_subject():
+            created.wait(timeout=5)
+            return self.create_subject()
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            futures = [
+                executor.submit(
+                    self.linker.link,
+                    self.embeddings[0],
+                    0.9,
+                    create_subject
+                )
+                for _ in range(4)
+            ]
+            # Other tracks are not blocked by the pending creation
+            other = self.linker.link(
+                self.embeddings[1], 0.9, self.create_subject
+            )
+            created.set()
+            subjects = {future.result() for future in futures}
+
+        self.assertEqual(1, other)
+        self.assertSetEqual({2}, subjects)
+
+    def test_create_subject_outside_lock(self):
+        barrier = Barrier(2, timeout=5)
+
+        def create_subject():
+            # Both creations run at the same time
+            barrier.wait()
+            return self.create_subject()
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            futures = [
+                executor.submit(
+                    self.linker.link, embeddings, 0.9, create_subject
+                )
+                for embeddings in self.embeddings[0:2]
+            ]
+            subjects = {future.result() for future in futures}
+
+        self.assertSetEqual({1, 2}, subjects)
+
+    def test_failed_creation_releases_entry(self):
+        def fail():
+            raise RuntimeError
+
+        with self.assertRaises(RuntimeError):
+            self.linker.link(self.embeddings[0], 0.9, fail)
+
+        subject_id = self.linker.link(
+            self.embeddings[0], 0.9, self.create_subject
+        )
+        self.assertEqual(1, subject_id)
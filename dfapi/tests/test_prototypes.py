@@ -0,0 +1,72 @@
+from unittest import mock
+
+import numpy as np
+from django.core.cache import cache
+from django.test import TransactionTestCase
+
+from ..models import Face, SubjectPrototype
+from ..services import prototypes
+from .factory import FaceFactory
+
+
+class PrototypesTest(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.faces = FaceFactory().create_instances(count=2)
+
+    def prototype(self, subject_id) -> SubjectPrototype:
+        return SubjectPrototype.objects.filter(subject_id=subject_id).first()
+
+    def test_add_face(self):
+        face = self.faces[0]
+        prototype = self.prototype(face.subject_id)
+
+        self.assertEqual(1, prototype.faces_count)
+        np.testing.assert_array_almost_equal(face.embeddings, prototype.centroid)
+
+    def test_reassign_face(self):
+        face, other_face = self.faces
+        old_subject_id = face.subject_id
+
+        with mock.patch.object(prototypes, 'rebuild') as rebuild:
+            face.subject = other_face.subject
+            face.save()
+            rebuild.assert_not_called()
+
+        self.assertIsNone(self.prototype(old_subject_id))
+        prototype = self.prototype(other_face.subject_id)
+        self.assertEqual(2, prototype.faces_count)
+        np.testing.assert_array_almost_equal(
+            (face.embeddings + other_face.embeddings) / 2,
+            prototype.centroid
+        )
+
+    def test_change_embeddings(self):
+        face = Face.objects.get(pk=self.faces[0].pk)
+        face.embeddings = np.ones(512)
+        face.save()
+
+        prototype = self.prototype(face.subject_id)
+        self.assertEqual(1, prototype.faces_count)
+        np.testing.assert_array_almost_equal(np.ones(512), prototype.centroid)
+
+    def test_unrelated_change(self):
+        face = Face.objects.get(pk=self.faces[0].pk)
+        face.pred_age = 30
+
+        with mock.patch.object(
+            prototypes, 'add_embeddings'
+        ) as add_embeddings, mock.patch.object(
+            prototypes, 'remove_embeddings'
+        ) as remove_embeddings:
+            face.save()
+
+        add_embeddings.assert_not_called()
+        remove_embeddings.assert_not_called()
+
+    def test_delete_face(self):
+        face = self.faces[0]
+        face.delete()
+
+        self.assertIsNone(self.prototype(face.subject_id))
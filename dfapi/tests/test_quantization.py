@@ -0,0 +1,63 @@
+import numpy as np
+from django.test import SimpleTestCase
+
+from ..quantization import (
+    QUANTIZATION_CHOICES,
+    quantize,
+    dequantize,
+    scan,
+    top_candidates
+)
+
+
+class QuantizationTest(SimpleTestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.embeddings = rng.normal(size=(500, 512)).astype(np.float32)
+        self.norms = np.linalg.norm(self.embeddings, axis=1)
+        self.query = self.embeddings[42] + rng.normal(
+            scale=0.05, size=512
+        ).astype(np.float32)
+
+    def test_quantize(self):
+        for mode in QUANTIZATION_CHOICES:
+            with self.subTest(msg=mode):
+                codes, scales = quantize(self.embeddings, mode)
+                self.assertEqual(codes.shape, self.embeddings.shape)
+                self.assertEqual(scales.shape, (len(self.embeddings),))
+                restored = dequantize(codes, scales)
+                self.assertLess(
+                    np.abs(restored - self.embeddings).max(),
+                    0.05
+                )
+
+    def test_quantize_empty(self):
+        for mode in QUANTIZATION_CHOICES:
+            with self.subTest(msg=mode):
+                codes, scales = quantize(np.array([], np.float32), mode)
+                self.assertEqual(len(codes), 0)
+                self.assertEqual(len(scales), 0)
+
+    def test_scan(self):
+        for mode in QUANTIZATION_CHOICES:
+            with self.subTest(msg=mode):
+                codes, scales = quantize(self.embeddings, mode)
+                similarities = scan(self.query, codes, scales, self.norms)
+                inds = top_candidates(similarities, 5)
+                self.assertEqual(len(inds), 5)
+                self.assertEqual(inds[0], 42)
+                self.assertTrue(np.all(np.diff(similarities[inds]) <= 0))
+
+    def test_scan_queries(self):
+        codes, scales = quantize(self.embeddings, QUANTIZATION_CHOICES[0])
+        queries = np.vstack([self.query, self.embeddings[7]])
+        similarities = scan(queries, codes, scales, self.norms)
+
+        self.assertEqual((2, len(self.embeddings)), similarities.shape)
+        np.testing.assert_allclose(
+            scan(self.query, codes, scales, self.norms),
+            similarities[0],
+            rtol=1e-5
+        )
+        self.assertEqual(7, np.argmax(similarities[1]))
@@ -0,0 +1,118 @@
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import SimpleTestCase, TransactionTestCase
+from django.utils import timezone
+
+from ..models import Face, Recognition, Subject, SubjectSegment
+from ..services import faces
+from ..services.recognition_cache import RecognitionCache, recognition_cache
+from .factory import FaceFactory, RecognitionFactory
+
+
+class RecognitionCacheTest(SimpleTestCase):
+
+    def test_lru_eviction(self):
+        cache = RecognitionCache(max_size=2)
+        cache.set('a', [(1, 0.9)])
+        cache.set('b', [(2, 0.8)])
+        self.assertEqual(((1, 0.9),), cache.get('a'))
+
+        cache.set('c', [(3, 0.7)])
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNotNone(cache.get('a'))
+        self.assertIsNotNone(cache.get('c'))
+        self.assertEqual(2, len(cache))
+
+    def test_empty_matches_are_cached(self):
+        cache = RecognitionCache(max_size=2)
+        cache.set('a', [])
+        self.assertEqual((), cache.get('a'))
+
+
+class RecognizeFaceCacheTest(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        recognition_cache.clear()
+        self.recognition_factory = RecognitionFactory()
+        self.recognition = self.recognition_factory.create_instance()
+
+    def recognize(self, recognition) -> mock.Mock:
+        with mock.patch(
+            'dfapi.services.faces.match_face',
+            return_value=[(recognition.face.subject_id, 0.9)]
+        ) as match_face:
+            faces.recognize_face(recognition.pk, faces_vision=None)
+        self.assertEqual(1, recognition.matches.count())
+        return match_face
+
+    def same_face_recognition(self) -> Recognition:
+        return Recognition.objects.create(
+            face=self.recognition.face,
+            sim_thresh=self.recognition.sim_thresh,
+            max_matches=self.recognition.max_matches
+        )
+
+    def test_hit(self):
+        self.recognize(self.recognition).assert_called_once()
+        self.recognize(self.same_face_recognition()).assert_not_called()
+
+    def test_miss_after_faces_change(self):
+        self.recognize(self.recognition).assert_called_once()
+        FaceFactory().create_instance()
+        self.recognize(self.same_face_recognition()).assert_called_once()
+
+    def test_hit_after_unrelated_faces(self):
+        self.recognize(self.recognition).assert_called_once()
+        # Faces without subject are not recognizable
+        Face.objects.create()
+        self.recognize(self.same_face_recognition()).assert_not_called()
+
+    def test_hit_after_changes_out_of_segment(self):
+        subject = self.recognition.face.subject
+        Subject.objects.filter(pk=subject.pk).update(name='Xqzname')
+        segment = SubjectSegment.objects.create(
+            title='xqzname',
+            name='Xqzname'
+        )
+
+        def recognize():
+            recognition = self.same_face_recognition()
+            with mock.patch(
+                'dfapi.services.faces.recognition_segments',
+                return_value=[segment]
+            ):
+                return self.recognize(recognition)
+
+        recognize().assert_called_once()
+        # The subject of the new face is out of the segment
+        FaceFactory().create_instance()
+        recognize().assert_not_called()
+
+    def test_no_store_when_matching_rebuilds_segments(self):
+        segment = SubjectSegment.objects.create(title='all')
+
+        def match_face(recognition, face_embeddings, segments, faces_vision):
+            segments[0].updated_at = timezone.now()
+            return [(recognition.face.subject_id, 0.9)]
+
+        with mock.patch(
+            'dfapi.services.faces.recognition_segments',
+            return_value=[segment]
+        ), mock.patch(
+            'dfapi.services.faces.match_face',
+            side_effect=match_face
+        ):
+            faces.recognize_face(self.recognition.pk, faces_vision=None)
+        self.assertEqual(0, len(recognition_cache))
+
+    def test_face_without_embeddings(self):
+        Face.objects.filter(pk=self.recognition.face_id).update(
+            embeddings_bytes=None
+        )
+        with mock.patch('dfapi.services.faces.match_face') as match_face:
+            self.assertIsNone(
+                faces.recognize_face(self.recognition.pk, faces_vision=None)
+            )
+        match_face.assert_not_called()
@@ -0,0 +1,114 @@
+from types import SimpleNamespace
+from unittest import mock
+
+import numpy as np
+from django.core.cache import cache
+from django.test import TransactionTestCase
+
+from ..models import EncoderVersion, Face, FreTaskConfig, Subject
+from ..services.faces import activate_encoder_version
+from ..services.runners.fre import FreTaskRunner
+from .factory import FaceFactory
+
+
+def detected_faces(embeddings):
+    return [SimpleNamespace(embeddings=embeddings)], None
+
+
+class EncoderVersionTest(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.faces = FaceFactory().create_instances(count=3)
+        self.old_embeddings = {
+            face.pk: np.array(face.embeddings) for face in self.faces
+        }
+
+    def tearDown(self):
+        cache.clear()
+
+    def create_runner(self, version: str) -> FreTaskRunner:
+        runner = FreTaskRunner.__new__(FreTaskRunner)
+        runner.task = SimpleNamespace(pk=1, info={}, progress=0)
+        runner.task_config = FreTaskConfig(batch_size=2)
+        runner.version = version
+        runner.last_progress_update = 0
+        runner.send_progress = mock.Mock()
+        runner.faces_vision = mock.Mock()
+        runner._run = False
+        runner._pause = False
+        return runner
+
+    def test_stage_while_not_active(self):
+        face = Face(subject=self.faces[0].subject)
+        face.set_embeddings(np.ones(512), 'v2')
+        face.save()
+
+        face.refresh_from_db()
+        self.assertIsNone(face.embeddings_bytes)
+        self.assertEqual('v2', face.next_embeddings_version)
+
+        train_data = Subject.queryset_train_data(Subject.objects.all())
+        self.assertNotIn(face.pk, train_data[2])
+
+    def test_reencode_and_switch(self):
+        runner = self.create_runner('v2')
+        new_embeddings = np.full(512, 0.5, np.float32)
+        runner.faces_vision.frame_analyzer.find_faces.side_effect = [
+            detected_faces(new_embeddings),
+            ([], None),
+            detected_faces(new_embeddings)
+        ]
+
+        runner.main_run()
+
+        self.assertTrue(runner.task.info['switched'])
+        self.assertEqual('v2', EncoderVersion.active_version())
+
+        failed_face = Face.objects.get(pk=self.faces[1].pk)
+        self.assertEqual('', failed_face.embeddings_version)
+        np.testing.assert_array_almost_equal(
+            self.old_embeddings[failed_face.pk],
+            failed_face.embeddings
+        )
+
+        for face in (self.faces[0], self.faces[2]):
+            face.refresh_from_db()
+            self.assertEqual('v2', face.embeddings_version)
+            np.testing.assert_array_equal(new_embeddings, face.embeddings)
+            # The previous embeddings are kept staged
+            np.testing.assert_array_almost_equal(
+                self.old_embeddings[face.pk],
+                face.embeddings_for('')
+            )
+
+    def test_recognizable_during_switch(self):
+        Face.objects.update(
+            next_embeddings_bytes=np.ones(512, np.float32).tobytes(),
+            next_embeddings_version='v2'
+        )
+        faces_ids = {face.pk for face in self.faces}
+
+        # Activated before the staged embeddings are moved into place
+        EncoderVersion.objects.create(version='v2', active=True)
+        EncoderVersion.invalidate_active_version()
+        _, _, train_faces = Subject.queryset_train_data(Subject.objects.all())
+        self.assertSetEqual(faces_ids, set(train_faces.tolist()))
+
+        activate_encoder_version('v2', batch_size=2)
+        _, _, train_faces = Subject.queryset_train_data(Subject.objects.all())
+        self.assertSetEqual(faces_ids, set(train_faces.tolist()))
+        self.assertFalse(Face.objects.filter(
+            next_embeddings_version='v2'
+        ).exists())
+
+    def test_resume(self):
+        Face.objects.filter(pk=self.faces[0].pk).update(
+            next_embeddings_version='v2'
+        )
+        runner = self.create_runner('v2')
+
+        self.assertListEqual(
+            [face.pk for face in self.faces[1:]],
+            list(runner.pending_faces().values_list('pk', flat=True))
+        )
@@ -0,0 +1,77 @@
+from datetime import timedelta
+from os import path
+from unittest import mock
+
+from django.test import TransactionTestCase, override_settings
+from django.utils import timezone
+
+from ..models import Face, Frame, Subject
+from ..services import retention
+from .factory import FaceFactory
+
+
+@override_settings(RETENTION_BATCH_SIZE=1, RETENTION_BATCH_PAUSE=0)
+class RetentionTest(TransactionTestCase):
+
+    def setUp(self):
+        self.faces = FaceFactory().create_instances(count=3)
+
+    def test_orphan_faces(self):
+        orphan = self.faces[0]
+        Face.objects.filter(pk=orphan.pk).update(subject=None)
+
+        deleted = retention.clean_database({
+            'orphan_faces': {},
+            'frames_without_faces': {}
+        })
+
+        self.assertDictEqual(
+            {'orphan_faces': 1, 'frames_without_faces': 1},
+            deleted
+        )
+        self.assertFalse(Face.objects.filter(pk=orphan.pk).exists())
+        self.assertFalse(Frame.objects.filter(pk=orphan.frame_id).exists())
+        self.assertFalse(path.isfile(orphan.image.path))
+        self.assertEqual(2, Face.objects.count())
+
+    def test_unnamed_subjects(self):
+        face = self.faces[1]
+        Subject.objects.filter(pk=face.subject_id).update(
+            name='',
+            last_name='',
+            updated_at=timezone.now() - timedelta(days=400)
+        )
+
+        deleted = retention.clean_database({
+            'unnamed_subjects': {'days': 365}
+        })
+
+        self.assertEqual(1, deleted['unnamed_subjects'])
+        self.assertFalse(Subject.objects.filter(pk=face.subject_id).exists())
+        self.assertFalse(Face.objects.filter(pk=face.pk).exists())
+        self.assertFalse(path.isfile(face.image.path))
+
+    def test_cascade_in_batches(self):
+        subject_id = self.faces[0].subject_id
+        Face.objects.update(subject_id=subject_id)
+        Subject.objects.filter(pk=subject_id).update(
+            name='',
+            last_name='',
+            updated_at=timezone.now() - timedelta(days=400)
+        )
+
+        with mock.patch.object(
+            retention, 'raw_delete', wraps=retention.raw_delete
+        ) as raw_delete:
+            deleted = retention.clean_database({
+                'unnamed_subjects': {'days': 365}
+            })
+
+        self.assertEqual(1, deleted['unnamed_subjects'])
+        self.assertEqual(0, Face.objects.count())
+        faces_batches = [
+            pks for (model, pks), _ in raw_delete.call_args_list
+            if model is Face
+        ]
+        self.assertEqual(3, len(faces_batches))
+        self.assertTrue(all(len(pks) == 1 for pks in faces_batches))
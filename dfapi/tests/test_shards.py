@@ -0,0 +1,98 @@
+import numpy as np
+from django.test import SimpleTestCase
+
+from ..services.face_index import shard_of
+from ..services.shards import (
+    ProcessShard,
+    scatter_gather,
+    scatter_gather_batch,
+    top_subjects
+)
+
+
+class ShardsTest(SimpleTestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.subjects = rng.randint(1, 200, size=600).astype(np.int32)
+        self.embeddings = rng.normal(size=(600, 64)).astype(np.float32)
+        self.query = self.embeddings[7] + rng.normal(
+            scale=0.1, size=64
+        ).astype(np.float32)
+        self.shards = ProcessShard.partition(
+            self.embeddings,
+            self.subjects,
+            shards_count=3
+        )
+
+    def tearDown(self):
+        for shard in self.shards:
+            shard.terminate()
+
+    def test_scatter_gather_matches_single_shard(self):
+        for count in (1, 5, 0):
+            with self.subTest(msg=f'count={count}'):
+                expected = top_subjects(
+                    self.embeddings,
+                    self.subjects,
+                    self.query,
+                    sim_thresh=0.1,
+                    count=count
+                )
+                matches = scatter_gather(
+                    self.shards,
+                    self.query,
+                    segments_ids=[],
+                    sim_thresh=0.1,
+                    count=count
+                )
+                self.assertListEqual(
+                    [subject_id for subject_id, _ in expected],
+                    [subject_id for subject_id, _ in matches]
+                )
+                self.assertEqual(int(self.subjects[7]), matches[0][0])
+
+
+    def test_scatter_gather_batch(self):
+        queries = np.vstack([self.query, self.embeddings[11]])
+        matches = scatter_gather_batch(
+            self.shards,
+            queries,
+            segments_ids=[],
+            sim_thresh=0.1,
+            count=5
+        )
+
+        self.assertEqual(2, len(matches))
+        for query, query_matches in zip(queries, matches):
+            self.assertListEqual(
+                scatter_gather(
+                    self.shards,
+                    query,
+                    segments_ids=[],
+                    sim_thresh=0.1,
+                    count=5
+                ),
+                query_matches
+            )
+        self.assertEqual(int(self.subjects[11]), matches[1][0][0])
+
+
+class ShardOfTest(SimpleTestCase):
+
+    def test_adding_shard_moves_few_subjects(self):
+        subjects = np.arange(1, 10001, dtype=np.int32)
+        shards = shard_of(subjects, [3, 5, 8, 13])
+        new_shards = shard_of(subjects, [3, 5, 8, 13, 21])
+
+        moved = shards != new_shards
+        # Only the subjects taken by the new shard move
+        self.assertTrue(np.all(new_shards[moved] == 21))
+        self.assertAlmostEqual(1 / 5, moved.mean(), delta=0.02)
+
+    def test_keys_order(self):
+        subjects = np.arange(1, 1001, dtype=np.int32)
+        np.testing.assert_array_equal(
+            shard_of(subjects, [1, 2, 3]),
+            shard_of(subjects, [3, 1, 2])
+        )
@@ -0,0 +1,73 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TransactionTestCase
+from django.utils import timezone
+
+from ..models import Face, Sighting, Task
+from .factory import SubjectFactory
+
+
+class SightingsTest(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.subject = SubjectFactory().create_instance()
+        self.task = Task.objects.create(task_type=Task.TYPE_VIDEO_DETECT_FACES)
+        self.start = timezone.now() - timedelta(hours=1)
+
+    def create_face(self, seconds: float) -> Face:
+        return Face.objects.create(
+            subject=self.subject,
+            task=self.task,
+            timestamp=self.start + timedelta(seconds=seconds)
+        )
+
+    def sightings(self):
+        return [
+            (
+                (sighting.first_seen - self.start).total_seconds(),
+                (sighting.last_seen - self.start).total_seconds(),
+                sighting.faces_count
+            )
+            for sighting in Sighting.objects.order_by('first_seen')
+        ]
+
+    def test_bridging_face_merges_sightings(self):
+        self.create_face(0)
+        self.create_face(100)
+        self.assertListEqual([(0, 0, 1), (100, 100, 1)], self.sightings())
+
+        self.create_face(50)
+        self.assertListEqual([(0, 100, 3)], self.sightings())
+
+    def test_delete_face_splits_sighting(self):
+        self.create_face(0)
+        face = self.create_face(50)
+        self.create_face(100)
+
+        face.delete()
+        self.assertListEqual([(0, 0, 1), (100, 100, 1)], self.sightings())
+
+    def test_delete_face_shrinks_sighting(self):
+        self.create_face(0)
+        self.create_face(30)
+        face = self.create_face(60)
+
+        face.delete()
+        self.assertListEqual([(0, 30, 2)], self.sightings())
+
+    def test_delete_last_face(self):
+        face = self.create_face(0)
+        face.delete()
+        self.assertListEqual([], self.sightings())
+
+    def test_backfill(self):
+        for seconds in (0, 30, 200):
+            self.create_face(seconds)
+        Sighting.objects.all().delete()
+
+        call_command('backfill_sightings', batch_size=1, stdout=StringIO())
+        self.assertListEqual([(0, 30, 2), (200, 200, 1)], self.sightings())
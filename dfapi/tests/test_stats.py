@@ -0,0 +1,88 @@
+from datetime import timedelta
+
+from django.test import TransactionTestCase
+from django.utils import timezone
+
+from ..models import Face, Stat, StatDelta
+from ..services import stats
+from .factory import FaceFactory
+
+
+class TimeStatsTest(TransactionTestCase):
+
+    def setUp(self):
+        self.faces = FaceFactory().create_instances(count=3)
+        self.created_at = timezone.now() - timedelta(hours=2)
+        Face.objects.update(created_at=self.created_at)
+
+    def faces_count(self, timestamp):
+        return Stat.objects.get(
+            name='faces_count',
+            resolution=Stat.RESOLUTION_HOUR,
+            timestamp=timestamp
+        ).value
+
+    def test_update_time_stats(self):
+        stats.update_time_stats(Stat.RESOLUTION_HOUR)
+
+        for name in stats.TIME_METRICS:
+            self.assertEqual(24, Stat.objects.filter(
+                name=name,
+                resolution=Stat.RESOLUTION_HOUR
+            ).count())
+
+        timestamp = stats.bucket_timestamp(
+            self.created_at, Stat.RESOLUTION_HOUR
+        )
+        self.assertEqual(3, self.faces_count(timestamp))
+
+        # Complete buckets are not computed again
+        stats.update_time_stats(Stat.RESOLUTION_HOUR)
+        self.assertEqual(3, self.faces_count(timestamp))
+
+    def test_add_face_stats(self):
+        stats.update_time_stats(Stat.RESOLUTION_HOUR)
+
+        face = self.faces[0]
+        face.created_at = self.created_at
+        stats.add_face_stats(face)
+
+        timestamp = stats.bucket_timestamp(
+            self.created_at, Stat.RESOLUTION_HOUR
+        )
+        self.assertEqual(4, self.faces_count(timestamp))
+
+
+class TotalStatsTest(TransactionTestCase):
+
+    def totals(self):
+        stats.fold_totals()
+        return dict(Stat.objects.filter(
+            resolution=Stat.RESOLUTION_ALL
+        ).values_list('name', 'value'))
+
+    def test_counters(self):
+        FaceFactory().create_instances(count=2)
+        stats.update_total_stats()
+
+        faces = FaceFactory().create_instances(count=3)
+        faces[0].delete()
+
+        totals = self.totals()
+        self.assertEqual(4, totals['stored_faces'])
+        self.assertDictEqual(stats.exact_totals(), totals)
+
+    def test_deltas_are_logged(self):
+        stats.update_total_stats()
+
+        FaceFactory().create_instances(count=2)
+        self.assertTrue(StatDelta.objects.exists())
+        self.assertEqual(2, self.totals()['stored_faces'])
+        self.assertFalse(StatDelta.objects.exists())
+
+    def test_update_replaces_pending_deltas(self):
+        FaceFactory().create_instances(count=2)
+        stats.add_totals({'stored_faces': 10})
+        stats.update_total_stats()
+
+        self.assertEqual(2, self.totals()['stored_faces'])
@@ -0,0 +1,99 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TransactionTestCase
+from django.utils import timezone
+
+from ..models import Face, Subject
+from ..services import subjects
+from .factory import FACE_IMAGE_PATH, FaceFactory, create_image_file
+
+
+class SubjectSummaryTest(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.first_face = FaceFactory().create_instance()
+        self.subject = self.first_face.subject
+        self.last_face = self.create_face(self.subject)
+
+    def create_face(self, subject: Subject, image: bool = True) -> Face:
+        face = Face(subject=subject, timestamp=timezone.now())
+        if image:
+            face.image = create_image_file(
+                FACE_IMAGE_PATH,
+                settings.FACES_IMAGES_PATH
+            )
+        face.save()
+        return face
+
+    def assertSummary(self, cover_face: Face, last_face: Face):
+        subject = Subject.objects.get(pk=self.subject.pk)
+        self.assertEqual(cover_face.pk, subject.cover_face_id)
+        self.assertEqual(last_face.created_at, subject.last_seen_at)
+
+    def test_add_face_summary(self):
+        self.assertSummary(self.first_face, self.last_face)
+
+        face = self.create_face(self.subject, image=False)
+        self.assertSummary(self.first_face, face)
+
+    def test_timestamp_is_face_creation_time(self):
+        # Faces of old video records are captured long before stored
+        face = Face.objects.create(
+            subject=self.subject,
+            timestamp=timezone.now() - timedelta(days=30)
+        )
+        subject = Subject.objects.get(pk=self.subject.pk)
+        self.assertEqual(face.created_at, subject.timestamp)
+
+    def test_remove_face_summary(self):
+        self.first_face.delete()
+        self.assertSummary(self.last_face, self.last_face)
+
+        face = self.create_face(self.subject)
+        face.delete()
+        self.assertSummary(self.last_face, self.last_face)
+
+    def test_remove_unrelated_face(self):
+        face = self.create_face(self.subject)
+        Subject.objects.filter(pk=self.subject.pk).update(
+            last_seen_at=face.created_at + timedelta(seconds=1)
+        )
+        self.last_face.delete()
+
+        # Neither the cover nor the last one seen, the subject is kept
+        subject = Subject.objects.get(pk=self.subject.pk)
+        self.assertEqual(
+            face.created_at + timedelta(seconds=1),
+            subject.last_seen_at
+        )
+
+    def test_refresh_summary(self):
+        Subject.objects.filter(pk=self.subject.pk).update(
+            cover_face=None,
+            last_seen_at=None
+        )
+        subjects.refresh_summary([self.subject.pk])
+        self.assertSummary(self.first_face, self.last_face)
+
+    def test_refresh_summary_without_faces(self):
+        other_face = FaceFactory().create_instance()
+        self.first_face.subject = other_face.subject
+        self.first_face.save()
+        self.last_face.subject = other_face.subject
+        self.last_face.save()
+
+        subject = Subject.objects.get(pk=self.subject.pk)
+        self.assertIsNone(subject.cover_face_id)
+        self.assertIsNone(subject.last_seen_at)
+        self.assertEqual(subject.created_at, subject.timestamp)
+
+    def test_backfill_subjects(self):
+        Subject.objects.update(cover_face=None, last_seen_at=None)
+
+        call_command('backfill_subjects', batch_size=1, stdout=StringIO())
+        self.assertSummary(self.first_face, self.last_face)
@@ -1,7 +1,17 @@
+from datetime import timedelta
+from unittest import mock
+
+import numpy as np
+from django.test import override_settings
+from django.utils import timezone
 from rest_framework import status
 from rest_framework.reverse import reverse
 from rest_framework.test import APITransactionTestCase
 
+from ..models import Face, Recognition, Subject, Task, VdfTaskConfig
+from ..serializers import FaceSerializer
+from ..services.exports import read_embeddings
+
 from .factory import (
     ModelFactory,
     FaceFactory,
@@ -150,8 +160,46 @@ class FaceViewTest(
 
     url_list = 'dfapi:faces-list'
     url_detail = 'dfapi:faces-detail'
+    url_embeddings = 'dfapi:faces-embeddings'
     model_factory = FaceFactory()
 
+    def test_embeddings(self):
+        face_factory = FaceFactory()
+        faces = self.instances + [
+            face_factory.create_instance() for _ in range(2)
+        ]
+        response = self.client.get(reverse(self.url_embeddings))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        version, records = read_embeddings(
+            b''.join(response.streaming_content)
+        )
+        self.assertEqual('', version)
+        self.assertListEqual(
+            [face.pk for face in faces],
+            records['face'].tolist()
+        )
+        for face, record in zip(faces, records):
+            with self.subTest(msg=f'Face {face.pk}'):
+                self.assertEqual(face.subject_id, record['subject'])
+                np.testing.assert_array_equal(
+                    face.embeddings,
+                    record['embeddings']
+                )
+
+    def test_list_defers_blobs(self):
+        queryset = FaceSerializer.setup_queryset(
+            Face.objects.all(),
+            ['id', 'box', 'subject']
+        )
+        face = queryset.get(pk=self.instances[0].pk)
+        self.assertSetEqual(
+            {'id', 'box_bytes', 'subject_id'},
+            set(face.__dict__) & {
+                field.attname for field in Face._meta.concrete_fields
+            }
+        )
+
 
 class FrameViewTest(
     _ViewTest,
@@ -214,6 +262,41 @@ class CameraViewTest(
     url_detail = 'dfapi:cameras-detail'
     model_factory = CameraFactory()
 
+    def test_list_stats(self):
+        cameras = self.instances + [
+            self.model_factory.create_instance() for _ in range(3)
+        ]
+        for camera in cameras:
+            for frames_count in (10, 20):
+                Task.objects.create(
+                    task_type=Task.TYPE_VIDEO_DETECT_FACES,
+                    status=Task.STATUS_SUCCESS,
+                    config={
+                        'video_source_type': VdfTaskConfig.VIDEO_SOURCE_CAMERA,
+                        'video_source_id': camera.pk
+                    },
+                    info={
+                        'frames_count': frames_count,
+                        'processing_time': 1.5,
+                        'frame_rate': frames_count / 1.5
+                    }
+                )
+
+        # Count, cameras page and their tasks statistics
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse(self.url_list))
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_200_OK,
+            msg=repr(response.data)
+        )
+        for item in response.data['results']:
+            with self.subTest(msg=f'Camera {item["id"]}'):
+                self.assertEqual(30, item['frames_count'])
+                self.assertAlmostEqual(3, item['processing_time'])
+                self.assertAlmostEqual(10, item['frame_rate'])
+                self.assertEqual(0, item['running_tasks'])
+
 
 class SubjectViewTest(
     _ViewTest,
@@ -226,8 +309,155 @@ class SubjectViewTest(
 
     url_list = 'dfapi:subjects-list'
     url_detail = 'dfapi:subjects-detail'
+    url_trajectory = 'dfapi:subjects-trajectory'
     model_factory = SubjectFactory()
 
+    def test_list_queries(self):
+        # Every face is created with its own subject
+        face_factory = FaceFactory()
+        for _ in range(3):
+            face_factory.create_instance()
+
+        # Count, subjects page and their faces, whatever the page size
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse(self.url_list))
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_200_OK,
+            msg=repr(response.data)
+        )
+
+    def test_list_cursor(self):
+        for _ in range(4):
+            self.model_factory.create_instance()
+        expected = list(
+            Subject.objects.order_by('-created_at', '-id').values_list(
+                'id', flat=True
+            )
+        )
+
+        subjects_ids = []
+        url = reverse(self.url_list) + '?cursor=&limit=2'
+        while url is not None:
+            response = self.client.get(url)
+            self.assertEqual(
+                response.status_code,
+                status.HTTP_200_OK,
+                msg=repr(response.data)
+            )
+            self.assertIsNone(response.data['count'])
+            subjects_ids.extend(item['id'] for item in response.data['results'])
+            url = response.data['next']
+
+        self.assertListEqual(expected, subjects_ids)
+
+    def test_trajectory(self):
+        subject = self.instances[0]
+        cameras = [CameraFactory().create_instance() for _ in range(2)]
+        tasks = [
+            Task.objects.create(
+                task_type=Task.TYPE_VIDEO_DETECT_FACES,
+                config={
+                    'video_source_type': VdfTaskConfig.VIDEO_SOURCE_CAMERA,
+                    'video_source_id': camera.pk
+                }
+            )
+            for camera in cameras
+        ]
+        start = timezone.now() - timedelta(hours=1)
+        offsets = [(0, 0), (0, 10), (1, 30), (0, 3600)]
+        for task_index, seconds in offsets:
+            Face.objects.create(
+                subject=subject,
+                task=tasks[task_index],
+                timestamp=start + timedelta(seconds=seconds)
+            )
+
+        response = self.client.get(
+            reverse(self.url_trajectory, kwargs={'pk': subject.pk})
+        )
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_200_OK,
+            msg=repr(response.data)
+        )
+        sightings = response.data['results']
+        self.assertListEqual(
+            [cameras[0].pk, cameras[1].pk, cameras[0].pk],
+            [sighting['camera'] for sighting in sightings]
+        )
+        self.assertListEqual(
+            [2, 1, 1],
+            [sighting['faces_count'] for sighting in sightings]
+        )
+
+
+class DemograpViewTest(APITransactionTestCase):
+
+    url_export = 'dfapi:demograp-export'
+    url_stats = 'dfapi:demograp-stats'
+
+    def setUp(self):
+        self.subjects = []
+        for face in [FaceFactory().create_instance() for _ in range(3)]:
+            subject = face.subject
+            subject.pred_sex = Subject.SEX_WOMAN
+            subject.pred_age = 30
+            subject.save()
+            self.subjects.append(subject)
+
+    def test_stats(self):
+        response = self.client.get(reverse(self.url_stats))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(3, response.data['women_count'])
+        self.assertEqual(0, response.data['men_count'])
+        women_ages = response.data['women_ages']
+        self.assertEqual(
+            len(response.data['age_labels']) + 1,
+            len(women_ages['counts'])
+        )
+        self.assertEqual(3, women_ages['counts'][3])
+        self.assertEqual(30, women_ages['mean_value'])
+
+        subject = self.subjects[0]
+        subject.pred_sex = Subject.SEX_MAN
+        subject.save()
+
+        response = self.client.get(reverse(self.url_stats))
+        self.assertEqual(2, response.data['women_count'])
+        self.assertEqual(1, response.data['men_count'])
+        self.assertEqual(1, response.data['men_ages']['counts'][3])
+
+    def test_export_csv(self):
+        response = self.client.get(
+            reverse(self.url_export),
+            {'output': 'csv', 'columns': ['id', 'image']}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual('Id,Image', lines[0])
+        rows = [line.split(',') for line in lines[1:]]
+        self.assertSetEqual(
+            {subject.pk for subject in self.subjects},
+            {int(row[0]) for row in rows}
+        )
+        for row in rows:
+            self.assertTrue(row[1].startswith('http'))
+
+    def test_export_xlsx(self):
+        response = self.client.get(reverse(self.url_export))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(b''.join(response.streaming_content))
+
+    @override_settings(SUBJECTS_XLSX_MAX_ROWS=2)
+    def test_export_xlsx_too_large(self):
+        response = self.client.get(reverse(self.url_export))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.get(reverse(self.url_export), {'output': 'csv'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
 
 class SubjectSegmentViewTest(
     _ViewTest,
@@ -282,9 +512,59 @@ class RecognitionViewTest(
 
     url_list = 'dfapi:recognitions-list'
     url_detail = 'dfapi:recognitions-detail'
+    url_batch = 'dfapi:recognitions-batch'
     model_factory = RecognitionFactory()
     list_count = 1
 
+    def test_batch(self):
+        face_factory = FaceFactory()
+        faces = [face_factory.create_instance() for _ in range(2)]
+        response = self.client.post(
+            reverse(self.url_batch),
+            data={'faces': [face.pk for face in faces]},
+            format='json'
+        )
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_201_CREATED,
+            msg=repr(response.data)
+        )
+        self.assertEqual(len(faces), response.data['count'])
+
+        response = self.client.get(
+            reverse(self.url_list),
+            data={'batch': response.data['batch']}
+        )
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual(len(faces), response.data['count'])
+
+        faces_subjects = {face.pk: face.subject_id for face in faces}
+        for index, item in enumerate(response.data['results']):
+            with self.subTest(msg=f'List index {index}'):
+                self.assertEqual(Recognition.STATUS_SUCCESS, item['status'])
+                # Every face is in the default segment, through its subject
+                best_match = max(item['matches'], key=lambda m: m['score'])
+                self.assertEqual(
+                    faces_subjects[item['face']],
+                    best_match['subject']
+                )
+
+    @override_settings(RECOGNITION_BATCH_SYNC_SIZE=1)
+    def test_batch_large(self):
+        face_factory = FaceFactory()
+        faces = [face_factory.create_instance() for _ in range(2)]
+        with mock.patch(
+            'dfapi.views.recognition.run_recognitions'
+        ) as run_recognitions:
+            response = self.client.post(
+                reverse(self.url_batch),
+                data={'faces': [face.pk for face in faces]},
+                format='json'
+            )
+
+        self.assertEqual(status.HTTP_202_ACCEPTED, response.status_code)
+        run_recognitions.delay.assert_called_once()
+
 
 class StatViewTest(
     _ViewTest,
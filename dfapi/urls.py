@@ -13,7 +13,8 @@ from .views import (
     TaskView,
     TagView,
     StatView,
-    NotificationView
+    NotificationView,
+    HuntAlertView
 )
 
 app_name = 'dfapi'
@@ -31,6 +32,7 @@ router.register(r'segments', SubjectSegmentView, 'segments')
 router.register(r'stats', StatView, 'stats')
 router.register(r'notifications', NotificationView, 'notifications')
 router.register(r'recognition', RecognitionView, 'recognitions')
+router.register(r'hunts', HuntAlertView, 'hunts')
 
 urlpatterns = router.urls  # + [
 #     path('demograp/', DemograpView.as_view(), name='demograp')
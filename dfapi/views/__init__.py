@@ -7,6 +7,7 @@ from .tag import TagView
 from .stat import StatView
 from .notification import NotificationView
 from .recognition import RecognitionView
+from .hunt import HuntAlertView
 
 
 class ServiceError(Exception):
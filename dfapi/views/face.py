@@ -1,4 +1,8 @@
+from django.http import StreamingHttpResponse
 from rest_framework import viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError as ApiValidationError
+from rest_framework.renderers import JSONRenderer
 
 from .mixins import (
     RetrieveMixin,
@@ -7,7 +11,10 @@ from .mixins import (
     UpdateMixin,
     DestroyMixin
 )
-from ..models import Face
+from ..pagination import KeysetPagination
+from .. import services
+from ..models import EncoderVersion, Face
+from ..renderers import BinaryRenderer
 from ..serializers import FaceSerializer
 
 
@@ -34,12 +41,23 @@ class FaceView(
 
     partial_update:
         Update one or more fields on an existing face.
+
+    embeddings:
+        Stream the embeddings of the faces encoded with the active encoder
+        version, or the one given in `version`, in a compact binary format.
+        Filter them with the `subjects` and `tasks` parameters, and resume
+        an export with `after`, the last exported face id. The stream has a
+        header with the embeddings dimension and encoder version, followed
+        by records of face id (int64), subject id (int64, -1 if none) and
+        embeddings (float32), all little endian.
     """
 
     model_name = 'Face'
     lookup_field = 'pk'
     queryset = Face.objects.all()
     serializer_class = FaceSerializer
+    pagination_class = KeysetPagination
+    keyset_ordering = ('-id',)
 
     def get_queryset(self):
         queryset = self.queryset
@@ -53,3 +71,28 @@ class FaceView(
             queryset = queryset.order_by(order_by)
 
         return queryset
+
+    @action(
+        detail=False,
+        methods=['get'],
+        renderer_classes=[JSONRenderer, BinaryRenderer]
+    )
+    def embeddings(self, request):
+        params = request.query_params
+        version = params.get('version', None)
+        if version is None:
+            version = EncoderVersion.active_version()
+
+        try:
+            queryset = services.exports.export_faces(params)
+        except ValueError:
+            raise ApiValidationError(f'Invalid query parameters.')
+
+        response = StreamingHttpResponse(
+            services.exports.stream_embeddings(queryset, version),
+            content_type='application/octet-stream'
+        )
+        response['Content-Disposition'] = (
+            f'attachment; filename="embeddings-{version or "default"}.bin"'
+        )
+        return response
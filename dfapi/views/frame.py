@@ -10,6 +10,7 @@ from .mixins import (
     UpdateMixin,
     DestroyMixin
 )
+from ..pagination import KeysetPagination
 from ..models import Frame
 from ..serializers import FrameSerializer
 from ..services.faces import face_analyzer
@@ -47,6 +48,8 @@ class FrameView(
     lookup_field = 'pk'
     queryset = Frame.objects.all()
     serializer_class = FrameSerializer
+    pagination_class = KeysetPagination
+    keyset_ordering = ('-id',)
 
     @action(detail=True, methods=['post'])
     def detect_faces(self, request, pk=None):
@@ -0,0 +1,74 @@
+import json
+from queue import Empty as QueueEmptyError
+from time import time
+
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from rest_framework import viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError as ApiValidationError
+from rest_framework.renderers import JSONRenderer
+
+from ..renderers import EventStreamRenderer
+from ..services.alerts import hunt_alerts, subscribe_hunt_alerts
+
+
+def alert_events(tasks_ids=None):
+    subscription = subscribe_hunt_alerts()
+    # The stream holds a server thread, so it is closed after a while and
+    # the client reconnects.
+    closes_at = time() + settings.HUNT_ALERTS_STREAM_DURATION
+    try:
+        yield 'retry: 3000\n\n'
+        while time() < closes_at:
+            try:
+                alert = subscription.get(timeout=min(
+                    settings.HUNT_ALERTS_HEARTBEAT,
+                    max(closes_at - time(), 0)
+                ))
+            except QueueEmptyError:
+                # Comments keep proxies from closing idle streams, and let
+                # the server notice disconnected clients.
+                yield ': keep-alive\n\n'
+                continue
+
+            if tasks_ids is not None and alert['task'] not in tasks_ids:
+                continue
+
+            data = json.dumps(dict(alert, sent_at=time()))
+            yield f'id: {alert["id"]}\nevent: hunt_match\ndata: {data}\n\n'
+    finally:
+        hunt_alerts.unsubscribe(subscription)
+
+
+class HuntAlertView(viewsets.GenericViewSet):
+    """
+    stream:
+        Push hunt match alerts as server-sent events, as soon as the hunt
+        tasks confirm them. Use the `tasks` parameter (comma separated ids)
+        to only receive alerts of some tasks. Each alert carries the frame
+        capture, publication and delivery timestamps. The stream is closed
+        after `HUNT_ALERTS_STREAM_DURATION` seconds and the client is
+        expected to reconnect. Each open stream holds a server thread, so
+        the API must be served by a threaded worker class, as configured in
+        `deploy/gunicorn.conf.py`.
+    """
+
+    renderer_classes = (JSONRenderer, EventStreamRenderer)
+
+    @action(detail=False, methods=['get'])
+    def stream(self, request):
+        tasks_ids = request.query_params.get('tasks', None)
+        if tasks_ids is not None:
+            try:
+                tasks_ids = {int(pk) for pk in tasks_ids.split(',')}
+            except ValueError:
+                raise ApiValidationError(f'Invalid tasks value "{tasks_ids}".')
+
+        response = StreamingHttpResponse(
+            alert_events(tasks_ids),
+            content_type='text/event-stream'
+        )
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
@@ -39,19 +39,27 @@ class ListMixin:
             list_serializer_class = self.serializer_class
         serializer_context = {'request': request}
 
+        fields = request.query_params.get('fields', None)
+        if fields is not None:
+            fields = fields.split(',')
+
         try:
             queryset = self.get_queryset()
         except ValidationError:
             raise ApiValidationError(f'Invalid query parameters.')
 
+        setup_queryset = getattr(list_serializer_class, 'setup_queryset', None)
+        if setup_queryset is not None:
+            queryset = setup_queryset(queryset, fields)
+
         try:
             page = self.paginate_queryset(queryset)
         except FieldError:
             raise ApiValidationError(f'Invalid query parameters.')
 
-        fields = request.query_params.get('fields', None)
-        if fields is not None:
-            fields = fields.split(',')
+        setup_page = getattr(list_serializer_class, 'setup_page', None)
+        if page is not None and setup_page is not None:
+            setup_page(page, fields)
 
         serializer = list_serializer_class(
             page,
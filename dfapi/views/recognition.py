@@ -1,4 +1,9 @@
+from typing import List
+
+import numpy as np
+from django.conf import settings
 from rest_framework import status, viewsets, mixins
+from rest_framework.decorators import action
 from rest_framework.response import Response
 
 from .mixins import (
@@ -6,8 +11,14 @@ from .mixins import (
     ListMixin,
     DestroyMixin
 )
+from .. import services
+from ..celery_tasks import run_recognitions
 from ..models import Recognition
-from ..serializers import RecognitionSerializer
+from ..serializers import (
+    RecognitionSerializer,
+    RecognitionBatchSerializer,
+    ShardSearchSerializer
+)
 from ..services.faces import face_analyzer
 
 
@@ -22,10 +33,24 @@ class RecognitionView(
         Return a recognition instance.
 
     list:
-        Return all recognitions.
+        Return all recognitions, or the ones of a batch with `?batch=<id>`.
 
     create:
-        Create a new recognition.
+        Create a new recognition. With `?async=true` the recognition is
+        queued and returned immediately with status code 202; its `status`
+        field can then be polled until it is `success` or `failure`.
+
+    batch:
+        Recognize a list of faces, or all faces of a task, in a single job.
+        Supports `?async=true` as well, which is forced for batches larger
+        than the RECOGNITION_BATCH_SYNC_SIZE setting. Returns the batch ID
+        and the number of recognitions, whose results are listed with
+        `?batch=<id>`.
+
+    shard_search:
+        Search the best subjects of a list of faces embeddings in one shard
+        of the face index, and return a list of matches for each of them.
+        Used by the recognition coordinator when sharding is enabled.
 
     destroy:
         Remove an existing recognition.
@@ -36,6 +61,15 @@ class RecognitionView(
     queryset = Recognition.objects.all()
     serializer_class = RecognitionSerializer
 
+    def get_queryset(self):
+        queryset = self.queryset
+
+        batch = self.request.query_params.get('batch', None)
+        if batch is not None:
+            queryset = queryset.filter(batch=batch)
+
+        return queryset
+
     def create(self, request):
         serializer_context = {'request': request}
         serializer = self.serializer_class(
@@ -45,11 +79,94 @@ class RecognitionView(
         serializer.is_valid(raise_exception=True)
         recognition = serializer.save()
 
-        face_analyzer.recognize_face(recognition.pk)
+        response_status = self.recognize(request, [recognition.pk])
+
         recognition = Recognition.objects.get(pk=recognition.pk)
         serializer = self.serializer_class(
             recognition,
             context=serializer_context
         )
 
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
+        return Response(serializer.data, status=response_status)
+
+    @action(detail=False, methods=['post'])
+    def batch(self, request):
+        serializer_context = {'request': request}
+        serializer = RecognitionBatchSerializer(
+            data=request.data,
+            context=serializer_context
+        )
+        serializer.is_valid(raise_exception=True)
+        recognitions = serializer.save()
+        recognitions_ids = [recognition.pk for recognition in recognitions]
+
+        response_status = status.HTTP_201_CREATED
+        if len(recognitions_ids):
+            response_status = self.recognize(
+                request,
+                recognitions_ids,
+                force_async=(
+                    len(recognitions_ids) > settings.RECOGNITION_BATCH_SYNC_SIZE
+                )
+            )
+
+        batch = None
+        if len(recognitions):
+            batch = recognitions[0].batch
+
+        return Response(
+            {
+                'batch': batch,
+                'count': len(recognitions_ids)
+            },
+            status=response_status
+        )
+
+    @action(detail=False, methods=['post'])
+    def shard_search(self, request):
+        serializer = ShardSearchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        matches = face_analyzer.search_shard(
+            queries=np.array(data['embeddings'], np.float32),
+            shard_key=data['shard_key'],
+            shard_keys=data['shard_keys'],
+            segments_ids=data.get('segments', []),
+            sim_thresh=data['sim_thresh'],
+            count=data['max_matches']
+        )
+
+        return Response(
+            [
+                [
+                    {'subject': subject_id, 'score': score}
+                    for subject_id, score in query_matches
+                ]
+                for query_matches in matches
+            ],
+            status=status.HTTP_200_OK
+        )
+
+    @staticmethod
+    def recognize(
+        request,
+        recognitions_ids: List[int],
+        force_async: bool = False
+    ) -> int:
+        run_async = request.query_params.get('async', '').lower()
+        if force_async or run_async in ('1', 'true'):
+            run_recognitions.delay(recognitions_ids)
+            return status.HTTP_202_ACCEPTED
+
+        try:
+            if len(recognitions_ids) == 1:
+                face_analyzer.recognize_face(recognitions_ids[0])
+            else:
+                face_analyzer.recognize_faces(recognitions_ids)
+        except services.ServiceError as err:
+            services.faces.finish_recognitions(recognitions_ids, str(err))
+            raise
+
+        services.faces.finish_recognitions(recognitions_ids)
+        return status.HTTP_201_CREATED
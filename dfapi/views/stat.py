@@ -4,6 +4,7 @@ from rest_framework.response import Response
 from .mixins import (
     ListMixin
 )
+from .. import services
 from ..models import Stat
 from ..serializers import StatSerializer
 
@@ -32,6 +33,8 @@ class StatView(
         resolution = self.request.query_params.get('resolution', None)
         if resolution is not None:
             queryset = queryset.filter(resolution=resolution)
+        if resolution in (None, Stat.RESOLUTION_ALL):
+            services.stats.fold_totals()
 
         order_by = self.request.query_params.get('order_by', None)
         if order_by is not None:
@@ -1,14 +1,18 @@
 from datetime import datetime
 
 from django.conf import settings
-from django.http import HttpResponse
+from django.core.exceptions import ValidationError
+from django.http import FileResponse, StreamingHttpResponse
 from rest_framework import status
 from rest_framework import viewsets
 from rest_framework.decorators import action
+from rest_framework.exceptions import (
+    NotFound as ApiNotFound,
+    ValidationError as ApiValidationError
+)
 from rest_framework.response import Response
 
-from ..services.subjects import xls_export
-
+from ..pagination import KeysetPagination
 from .mixins import (
     RetrieveMixin,
     ListMixin,
@@ -21,11 +25,17 @@ from ..models import Subject
 from ..models import SubjectSegment
 from ..serializers import (
     SubjectSerializer,
-    SubjectSegmentSerializer
+    SubjectSegmentSerializer,
+    SightingSerializer
 )
 
 XLS_MIME = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
 XLS_NAME = 'attachment; filename="faces-{}.xlsx"'
+CSV_MIME = 'text/csv'
+CSV_NAME = 'attachment; filename="faces-{}.csv"'
+
+OUTPUT_XLSX = 'xlsx'
+OUTPUT_CSV = 'csv'
 
 
 class SubjectView(
@@ -51,12 +61,19 @@ class SubjectView(
 
     partial_update:
         Update one or more fields on an existing subject.
+
+    trajectory:
+        Return where and when a subject was seen, as sightings in
+        chronological order. Filter them with the `min_timestamp`,
+        `max_timestamp`, `cameras` and `videos` parameters.
     """
 
     model_name = 'Subject'
     lookup_field = 'pk'
     queryset = Subject.objects.all()
     serializer_class = SubjectSerializer
+    pagination_class = KeysetPagination
+    keyset_ordering = ('-created_at', '-id')
 
     def get_queryset(self):
         queryset, _ = services.subjects.build_queryset(
@@ -64,6 +81,28 @@ class SubjectView(
         )
         return queryset
 
+    @action(detail=True, methods=['get'])
+    def trajectory(self, request, pk=None):
+        try:
+            pk = int(pk)
+        except ValueError:
+            raise ApiNotFound(f'A {self.model_name} with pk={pk} does not exist.')
+        if not Subject.objects.filter(pk=pk).exists():
+            raise ApiNotFound(f'A {self.model_name} with pk={pk} does not exist.')
+
+        queryset = services.sightings.trajectory(pk, request.query_params)
+        try:
+            page = self.paginate_queryset(queryset)
+        except ValidationError:
+            raise ApiValidationError(f'Invalid query parameters.')
+
+        serializer = SightingSerializer(
+            page,
+            context={'request': request},
+            many=True
+        )
+        return self.get_paginated_response(serializer.data)
+
 
 class DemograpView(
     ListMixin,
@@ -72,6 +111,12 @@ class DemograpView(
     """
     list:
         Return all subjects.
+
+    export:
+        Download the subjects as an xlsx workbook, or as a streamed csv file
+        with `output=csv`. Select the exported columns with `columns`. The
+        workbook is written before it is sent, so it is limited to
+        `SUBJECTS_XLSX_MAX_ROWS` subjects, use csv for larger exports.
     """
 
     model_name = 'Subject'
@@ -90,23 +135,51 @@ class DemograpView(
 
     @action(detail=False, methods=['get'])
     def stats(self, request):
-        data = services.subjects.demograp(self.get_queryset())
+        data = services.subjects.demograp(
+            self.get_queryset(), self.request.query_params
+        )
         return Response(data, status=status.HTTP_200_OK)
 
     @action(detail=False, methods=['get'])
     def export(self, request, *args, **kwargs):
         now = datetime.now().strftime('%Y-%m-%d')
-        response = HttpResponse(content_type=XLS_MIME)
-        response['Content-Disposition'] = XLS_NAME.format(now)
-
         columns = self.request.query_params.getlist('columns', None)
-        workbook = xls_export(
-            self.get_queryset(),
-            columns=columns,
-            request=request
+        output = self.request.query_params.get('output', OUTPUT_XLSX)
+
+        try:
+            columns = services.exports.subjects_columns(columns)
+        except ValueError as err:
+            raise ApiValidationError(str(err))
+
+        if output == OUTPUT_CSV:
+            response = StreamingHttpResponse(
+                services.exports.stream_subjects_csv(
+                    self.get_queryset(),
+                    request=request,
+                    columns=columns
+                ),
+                content_type=CSV_MIME
+            )
+            response['Content-Disposition'] = CSV_NAME.format(now)
+            return response
+
+        if output != OUTPUT_XLSX:
+            raise ApiValidationError(f'Invalid query parameters.')
+
+        queryset = self.get_queryset()
+        max_rows = settings.SUBJECTS_XLSX_MAX_ROWS
+        if queryset[:max_rows + 1].count() > max_rows:
+            raise ApiValidationError(
+                f'More than {max_rows} subjects to export, use output=csv.'
+            )
+
+        xlsx_file = services.exports.subjects_xlsx(
+            queryset,
+            request=request,
+            columns=columns
         )
-        workbook.save(response)
-
+        response = FileResponse(xlsx_file, content_type=XLS_MIME)
+        response['Content-Disposition'] = XLS_NAME.format(now)
         return response
 
 
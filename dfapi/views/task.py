@@ -7,9 +7,10 @@ from .mixins import (
     RetrieveMixin,
     ListMixin
 )
+from ..pagination import KeysetPagination
 from .. import services
 from ..models import Task
-from ..serializers import TaskSerializer
+from ..serializers import TaskSerializer, HuntedSubjectsSerializer
 
 
 class TaskView(
@@ -41,12 +42,18 @@ class TaskView(
 
     stop:
         Stop task execution.
+
+    hunted_subjects:
+        Add or remove hunted subjects of a hunt task. Running tasks pick up
+        the changes without restarting.
     """
 
     model_name = 'Task'
     lookup_field = 'pk'
     queryset = Task.objects.all()
     serializer_class = TaskSerializer
+    pagination_class = KeysetPagination
+    keyset_ordering = ('-created_at', '-id')
 
     def get_queryset(self):
         queryset = self.queryset
@@ -155,6 +162,34 @@ class TaskView(
     def stop(self, request, pk):
         return self._do_action(request, pk, 'stop')
 
+    @action(detail=True, methods=['patch'])
+    def hunted_subjects(self, request, pk):
+        serializer_context = {'request': request}
+
+        try:
+            pk = int(pk)
+            task = Task.objects.get(pk=pk)
+        except (Task.DoesNotExist, ValueError):
+            raise NotFound(f'A task with pk={pk} does not exists.')
+
+        serializer = HuntedSubjectsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        try:
+            services.tasks.update_hunted_subjects(
+                task,
+                add=serializer.validated_data.get('add', []),
+                remove=serializer.validated_data.get('remove', [])
+            )
+        except services.ServiceError as err:
+            raise ValidationError(err)
+
+        serializer = self.serializer_class(
+            task,
+            context=serializer_context
+        )
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
     def _do_action(self, request, pk, action_name):
         serializer_context = {'request': request}
 
@@ -98,6 +98,20 @@ DATABASES = {
     }
 }
 
+# Cache
+# Shared by the API, celery and worker processes, which rely on it for the
+# generation counters expiring cached demographics, recognitions and face
+# indexes. A per-process cache would miss the changes of other processes.
+CACHES = {
+    'default': {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': os.getenv('DNFAS_CACHE_URL', 'redis://localhost:6379/1'),
+        'OPTIONS': {
+            'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+        }
+    }
+}
+
 # Internationalization
 # https://docs.djangoproject.com/en/2.2/topics/i18n/
 
@@ -137,6 +151,7 @@ VIDEO_RECORDS_PATH = 'video/'
 VIDEO_THUMBS_PATH = 'video/thumbs'
 FACES_IMAGES_PATH = 'faces/'
 MODELS_DATA_PATH = 'models/'
+CROPS_DATA_PATH = 'crops/'
 
 MEDIA_PATHS = [
     VIDEO_RECORDS_PATH,
@@ -149,7 +164,8 @@ for media_path in MEDIA_PATHS:
     os.makedirs(full_path, exist_ok=True)
 
 DATA_PATHS = [
-    MODELS_DATA_PATH
+    MODELS_DATA_PATH,
+    CROPS_DATA_PATH
 ]
 
 for data_path in DATA_PATHS:
@@ -157,6 +173,12 @@ for data_path in DATA_PATHS:
     os.makedirs(full_path, exist_ok=True)
 
 
+# Side length of the aligned face crops stored for downstream models
+ALIGNED_CROP_SIZE = 256
+
+# Crops packs kept open by each process, the least recently used are closed
+ALIGNED_CROPS_OPEN_PACKS = 16
+
 VIDEO_THUMBS_COUNT = 5
 VIDEO_THUMBS_SIZE = 256
 VIDEO_SUPPORTED_EXT = ('mp4', 'avi', 'mkv')
@@ -173,6 +195,15 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = TIME_ZONE
 
+# Asynchronous recognition jobs run in their own worker, so that the
+# models loaded by the worker are reused between jobs
+RECOGNITION_QUEUE = 'recognition'
+RECOGNITION_JOB_TIME_LIMIT = 3600
+
+CELERY_TASK_ROUTES = {
+    'dfapi.celery_tasks.run_recognitions': {'queue': RECOGNITION_QUEUE},
+}
+
 # Other Celery settings
 CELERY_BEAT_SCHEDULE = {
     'update_hourly_stats': {
@@ -208,6 +239,98 @@ for key, filename in DNFAL_MODELS_PATHS.items():
         DATA_ROOT, MODELS_DATA_PATH, filename
     )
 
+# Version tag of the face encoder weights. Change it whenever the
+# 'face_encoder' weights are replaced, then run a 'face_reencoding' task.
+DNFAL_ENCODER_VERSION = os.getenv('DNFAL_ENCODER_VERSION', '')
+
+# Seconds the active encoder version is cached for. Until the version of
+# the running encoder is activated, ingested embeddings are staged.
+ENCODER_VERSION_CACHE_TIMEOUT = 60
+
+# Compact embeddings representation scanned before re-ranking recognition
+# candidates at full precision: '' (disabled), 'float16' or 'int8'
+EMBEDDINGS_QUANTIZATION = os.getenv('DNFAS_EMBEDDINGS_QUANTIZATION', '')
+
+# Evaluate segment filters over a global face index with attribute bitmaps
+# instead of building the embeddings data of each segment. Prototype-first
+# and quantized recognitions still read the segments data.
+RECOGNITION_FACE_INDEX = os.getenv(
+    'DNFAS_RECOGNITION_FACE_INDEX', 'False'
+) == 'True'
+
+# Partition the face index by subject across the registered workers and
+# recognize by querying all of them
+RECOGNITION_SHARDING = os.getenv(
+    'DNFAS_RECOGNITION_SHARDING', 'False'
+) == 'True'
+
+# Number of first-pass candidates re-ranked at full precision
+RECOGNITION_RERANK_SIZE = 256
+
+# Diverse exemplars kept in each subject prototype besides its centroid
+PROTOTYPE_MAX_EXEMPLARS = 4
+
+# Subjects expanded to their faces in prototype-first recognition
+RECOGNITION_PROTOTYPE_CANDIDATES = 32
+
+# Query faces matched together in each block of a batch recognition
+RECOGNITION_BATCH_BLOCK_SIZE = 128
+
+# Largest batch recognition run while the request waits, larger batches
+# are queued as asynchronous jobs
+RECOGNITION_BATCH_SYNC_SIZE = 256
+
+# Recognition results kept in memory by each recognition process
+RECOGNITION_CACHE_SIZE = 4096
+
+# Hunt alerts queued for each stream subscriber, older ones are dropped
+HUNT_ALERTS_MAX_PENDING = 256
+
+# Seconds between keep-alive comments of idle hunt alert streams
+HUNT_ALERTS_HEARTBEAT = 15
+
+# Seconds a hunt alert stream stays open before the client has to reconnect
+HUNT_ALERTS_STREAM_DURATION = 600
+
+# Postgres notification channel of the hunt alerts sent by worker processes
+HUNT_ALERTS_CHANNEL = 'hunt_alerts'
+
+# Recent face embeddings kept by each worker process to link the subjects
+# of concurrent video tasks, and seconds they are kept
+SUBJECT_LINKING_CAPACITY = 8192
+SUBJECT_LINKING_MEMORY = 300
+
+# Faces of a subject in a task further apart than these seconds are
+# stored as different sightings
+SIGHTING_MAX_GAP = 60
+
+# Seconds demographics statistics are cached for the same filters, they
+# are also expired when subjects change
+DEMOGRAP_CACHE_TIMEOUT = 300
+
+# Most subjects exported as xlsx, which is written before it is sent, larger
+# exports are streamed as csv
+SUBJECTS_XLSX_MAX_ROWS = 100000
+
+# Update the hourly and daily statistics as faces are created and tasks
+# finish, instead of only from the periodic jobs
+STATS_INCREMENTAL = False
+
+# Retention policies of the clean database job, applied in order with their
+# parameters. A policy set to None is disabled.
+RETENTION_POLICIES = {
+    'orphan_faces': {},
+    'old_faces': None,
+    'frames_without_faces': {},
+    'unnamed_subjects': {'days': 365},
+    'old_recognitions': {'days': 7}
+}
+
+# Rows deleted by each retention transaction, and seconds to wait between
+# them to leave the database to the running tasks
+RETENTION_BATCH_SIZE = 1000
+RETENTION_BATCH_PAUSE = 0.1
+
 # Logging
 LOGGER_NAME = 'dnfas'
 LOGGER_FILE = os.path.realpath(os.path.join(BASE_DIR, 'dnfas.log'))
@@ -7,6 +7,11 @@ DATABASES['default']['TEST'] = {
     'NAME': os.environ['DNFAS_DB_NAME']
 }
 
+# Tests clear the cache, keep them off the cache of the application
+CACHES['default']['LOCATION'] = os.getenv(
+    'DNFAS_TEST_CACHE_URL', 'redis://localhost:6379/2'
+)
+
 MEDIA_ROOT = os.path.realpath(os.path.join(BASE_DIR, 'storage/testing'))
 DATA_ROOT = MEDIA_ROOT
 
@@ -14,7 +19,8 @@ MEDIA_PATHS = [
     VIDEO_RECORDS_PATH,
     VIDEO_THUMBS_PATH,
     FACES_IMAGES_PATH,
-    MODELS_DATA_PATH
+    MODELS_DATA_PATH,
+    CROPS_DATA_PATH
 ]
 
 for media_path in MEDIA_PATHS: